@@ -0,0 +1,178 @@
+"""
+Shared parser for brat standoff .ann files.
+
+Each line is split with str.split on tabs and spaces, which keeps the parsing
+in C, and becomes a compact record:
+
+    T1\tProtein 0 5;9 12\tsome text      Entity, one (start, end) per fragment
+    R1\tinteracts Arg1:T1 Arg2:T2       Relation
+    E1\tBinding:T3 Theme:T1 Theme2:T2   Event, trigger is None if left out
+    A1\tNegation E1                     Attribute, value is None for binary
+    M1\tConfidence E1 High              attributes ("M" is brat's old prefix)
+    #1\tAnnotatorNotes T1\tsome note    Note
+
+Anything else (equivalences, normalizations) is kept as the raw line. Records
+are namedtuples, so they're as small as plain tuples, and can be turned back
+into lines with format_ann_line.
+
+Author: Serena G. Lotreck
+"""
+from collections import namedtuple
+
+Entity = namedtuple('Entity', ['id', 'type', 'offsets', 'text'])
+Event = namedtuple('Event', ['id', 'type', 'trigger', 'args'])
+Attribute = namedtuple('Attribute', ['id', 'type', 'target', 'value'])
+Note = namedtuple('Note', ['id', 'type', 'target', 'text'])
+BratAnn = namedtuple(
+    'BratAnn',
+    ['entities', 'relations', 'events', 'attributes', 'notes', 'other'])
+
+
+class Relation(namedtuple('Relation', ['id', 'type', 'args'])):
+    """
+    Relation record. args is a tuple of (role, ID) pairs, normally
+    (('Arg1', ...), ('Arg2', ...)).
+    """
+    __slots__ = ()
+
+    @property
+    def arg1(self):
+        return self.args[0][1]
+
+    @property
+    def arg2(self):
+        return self.args[1][1]
+
+
+def parse_args(arg_strs):
+    """
+    Split "Role:ID" strings into (role, ID) pairs.
+
+    parameters:
+        arg_strs, list of str: arguments as they appear in the .ann file
+
+    returns:
+        args, tuple of tuple: (role, ID) for each argument
+    """
+    return tuple(tuple(arg.split(':', 1)) for arg in arg_strs)
+
+
+def parse_ann(ann):
+    """
+    Parse the contents of a brat .ann file.
+
+    parameters:
+        ann, str: contents of the .ann file
+
+    returns:
+        brat_ann, BratAnn: entities, relations, events, attributes and notes
+            are dicts of records keyed by ID, in file order; other is a list
+            of the lines that aren't any of those
+    """
+    entities = {}
+    relations = {}
+    events = {}
+    attributes = {}
+    notes = {}
+    other = []
+    for line in ann.split('\n'):
+        line = line.rstrip('\r')
+        if line.strip() == '':
+            continue
+        prefix = line[0]
+        fields = line.split('\t')
+
+        if prefix == 'T':
+            ann_type, offsets = fields[1].split(' ', 1)
+            offsets = tuple(
+                tuple(int(i) for i in fragment.split())
+                for fragment in offsets.split(';'))
+            text = fields[2] if len(fields) > 2 else ''
+            entities[fields[0]] = Entity(fields[0], ann_type, offsets, text)
+
+        elif prefix == 'R':
+            parts = fields[1].split()
+            relations[fields[0]] = Relation(fields[0], parts[0],
+                                            parse_args(parts[1:]))
+
+        elif prefix == 'E':
+            parts = fields[1].split()
+            ann_type, _, trigger = parts[0].partition(':')
+            events[fields[0]] = Event(fields[0], ann_type, trigger or None,
+                                      parse_args(parts[1:]))
+
+        elif prefix in ('A', 'M'):
+            parts = fields[1].split()
+            value = parts[2] if len(parts) > 2 else None
+            attributes[fields[0]] = Attribute(fields[0], parts[0], parts[1],
+                                              value)
+
+        elif prefix == '#':
+            ann_type, _, target = fields[1].partition(' ')
+            text = fields[2] if len(fields) > 2 else ''
+            notes[fields[0]] = Note(fields[0], ann_type, target, text)
+
+        else:
+            other.append(line)
+
+    return BratAnn(entities, relations, events, attributes, notes, other)
+
+
+def read_ann(path):
+    """
+    Read and parse a brat .ann file.
+
+    parameters:
+        path, str: path to the .ann file
+
+    returns:
+        brat_ann, BratAnn: see parse_ann
+    """
+    with open(path) as myf:
+        return parse_ann(myf.read())
+
+
+def format_offsets(offsets):
+    """
+    Format entity offsets the way they're written in .ann files.
+
+    parameters:
+        offsets, tuple of tuple: (start, end) of each fragment
+
+    returns:
+        offsets_str, str: e.g. "0 5;9 12"
+    """
+    return ';'.join(f'{start} {end}' for start, end in offsets)
+
+
+def format_ann_line(record):
+    """
+    Turn a record back into a line of a .ann file, without the newline.
+
+    parameters:
+        record, namedtuple or str: a record from parse_ann, or a raw line
+            from BratAnn.other
+
+    returns:
+        line, str: the .ann line
+    """
+    if isinstance(record, str):
+        return record
+    if isinstance(record, Entity):
+        return (f'{record.id}\t{record.type} '
+                f'{format_offsets(record.offsets)}\t{record.text}')
+    if isinstance(record, Note):
+        return f'{record.id}\t{record.type} {record.target}\t{record.text}'
+    if isinstance(record, Attribute):
+        parts = [record.type, record.target]
+        if record.value is not None:
+            parts.append(record.value)
+        return f'{record.id}\t' + ' '.join(parts)
+
+    # Relations and events
+    head = record.type
+    if isinstance(record, Event) and record.trigger is not None:
+        head = f'{record.type}:{record.trigger}'
+    args = ' '.join(f'{role}:{ann_id}' for role, ann_id in record.args)
+
+    return f'{record.id}\t{head} {args}'
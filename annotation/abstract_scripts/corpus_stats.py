@@ -4,16 +4,43 @@ Accepts an argument for brat or jsonl formatted data.
 Calculates total # annotations, mean/sd/median/max/min per
 document, and total number of tokens/sentences in corpus and per document.
 
+Documents are read one at a time, and the statistics are kept in running
+accumulators (see running_stats.py) instead of lists of per-document counts,
+so memory use doesn't grow with the size of the corpus. Several corpora can
+be given at once, in which case their statistics are also saved side by side.
+
+Optionally, the same pass also collects a DistributionProfile of each corpus:
+counts of each entity and relation type, histograms of entity span widths and
+sentence lengths (in tokens), and counts of relations whose arguments are in
+different sentences.
+
 Author: Serena G. Lotreck
 """
 import argparse
 from os import listdir
-from os.path import abspath, join, basename, splitext
-from collections import defaultdict
+from os.path import abspath, exists, join, basename, splitext
 import jsonlines
 import numpy as np
 import pandas as pd
-import spacy
+from brat_parser import read_ann
+from running_stats import Histogram, LabelCounts, RunningStats
+
+# Components of the scispaCy models that sentence boundaries and tokens don't
+# depend on; the boundaries come from the parser, which reads tok2vec
+NON_SENT_PIPES = ['tagger', 'attribute_ruler', 'lemmatizer', 'ner']
+
+TEXT_STATS = ['sentences', 'tokens']
+ANN_STATS = ['entities', 'relations']
+
+
+def as_running_stats(values):
+    """
+    Get a RunningStats for a list of per-document counts, or pass one
+    through if it already is one.
+    """
+    if isinstance(values, RunningStats):
+        return values
+    return RunningStats.from_values(values)
 
 
 def compile_text_stats(num_sents_per_doc, num_tokens_per_doc):
@@ -21,9 +48,9 @@ def compile_text_stats(num_sents_per_doc, num_tokens_per_doc):
     Compile summary statistics dataframe for text.
 
     parameters:
-        num_sents_per_doc, list of int: list of number of sentences
+        num_sents_per_doc, RunningStats or list of int: number of sentences
             in each document
-        num_tokens_per_doc, list of int: list of number of tokens in
+        num_tokens_per_doc, RunningStats or list of int: number of tokens in
             each document
 
     returns:
@@ -31,13 +58,10 @@ def compile_text_stats(num_sents_per_doc, num_tokens_per_doc):
     """
     text_stats_names = ['total_num', 'mean_per_doc', 'std_per_doc',
             'median_per_doc', 'max_per_doc', 'min_per_doc']
-    text_stats_dict = {'sentences':[sum(num_sents_per_doc),
-        np.mean(num_sents_per_doc), np.std(num_sents_per_doc),
-        np.median(num_sents_per_doc), max(num_sents_per_doc),
-        min(num_sents_per_doc)],
-        "tokens":[sum(num_tokens_per_doc), np.mean(num_tokens_per_doc),
-            np.std(num_tokens_per_doc), np.median(num_tokens_per_doc),
-            max(num_tokens_per_doc), min(num_tokens_per_doc)]}
+    text_stats_dict = {
+        'sentences': as_running_stats(num_sents_per_doc).summary(),
+        'tokens': as_running_stats(num_tokens_per_doc).summary()
+    }
 
     # Make into df with names as idx
     idx = pd.Index(text_stats_names)
@@ -46,103 +70,396 @@ def compile_text_stats(num_sents_per_doc, num_tokens_per_doc):
     return text_stats_df
 
 
-def get_text_stats_dygiepp(corpus_file):
+def compile_ann_stats(single_doc_anns):
     """
-    Gets total number of tokens and sentences in the document, as well as
-    mean/median/max/min per document for both tokens and sentences for a
-    dygiepp-formatted dataset.
+    Get summary statistics for annotation numbers.
 
     parameters:
-        corpus_file, str: path to the corpus file
+        single_doc_anns, dict: keys are doc keys or filenames and values
+            are tuples of (num_ent, num_rel) for the doc. Can also be a dict
+            with the keys 'entities' and 'relations' whose values are
+            RunningStats, as made by new_corpus_stats.
 
     returns:
-        text_stats_df, df: pandas df with text stats
+        ann_stats_df, df: dataframe of sumamry statistics
+    """
+    ann_stats_names = ['total_num_anns', 'mean_anns_per_doc',
+            'std_anns_per_doc', 'med_anns_per_doc', 'max_anns_per_doc',
+            'min_anns_per_doc']
+
+    if isinstance(single_doc_anns.get('entities'), RunningStats):
+        ent_stats = single_doc_anns['entities']
+        rel_stats = single_doc_anns['relations']
+    else:
+        ent_stats = as_running_stats(
+            [val[0] for val in single_doc_anns.values()])
+        rel_stats = as_running_stats(
+            [val[1] for val in single_doc_anns.values()])
+
+    corpus_stats = {
+        'entities': ent_stats.summary(),
+        'relations': rel_stats.summary()
+    }
+
+    # Make into df with names as index
+    idx = pd.Index(ann_stats_names)
+    ann_stats_df = pd.DataFrame(corpus_stats, index=idx)
+
+    return ann_stats_df
+
+
+class DistributionProfile:
+    """
+    Per-type counts and length histograms of a corpus.
+    """
+
+    def __init__(self):
+        self.entity_types = LabelCounts()
+        self.relation_types = LabelCounts()
+        self.cross_sentence_relations = LabelCounts()
+        self.span_widths = {}
+        self.sentence_lengths = Histogram()
+
+    def add_entities(self, ent_types, widths):
+        """
+        Count entities and their span widths.
+
+        parameters:
+            ent_types, list of str: type of each entity
+            widths, list of int: width of each entity in tokens
+        """
+        for ent_type, width in zip(ent_types, widths):
+            self.entity_types.add(ent_type)
+            self.span_widths.setdefault(ent_type, Histogram()).add(width)
+
+    def add_relations(self, rel_types, cross_sentence):
+        """
+        Count relations and the ones that cross sentence boundaries.
+
+        parameters:
+            rel_types, list of str: type of each relation
+            cross_sentence, list of bool: whether each relation's arguments
+                are in different sentences
+        """
+        for rel_type, cross in zip(rel_types, cross_sentence):
+            self.relation_types.add(rel_type)
+            self.cross_sentence_relations.add(rel_type, int(cross))
+
+    def add_dygiepp_doc(self, doc, predicted=False):
+        """
+        Profile a dygiepp-formatted document. A relation crosses sentences
+        if either of its arguments is outside the sentence it's listed in.
+
+        parameters:
+            doc, dict: dygiepp-formatted document
+            predicted, bool: whether to profile the predicted entities and
+                relations instead of the gold standard ones
+        """
+        prefix = 'predicted_' if predicted else ''
+        sent_lengths = [len(sent) for sent in doc['sentences']]
+        self.sentence_lengths.update(sent_lengths)
+        sent_ends = np.cumsum(sent_lengths)
+        for sent in doc.get(f'{prefix}ner', []):
+            self.add_entities([ent[2] for ent in sent],
+                              [ent[1] - ent[0] + 1 for ent in sent])
+        for sent_end, sent_len, sent in zip(
+                sent_ends, sent_lengths, doc.get(f'{prefix}relations', [])):
+            sent_start = sent_end - sent_len
+            self.add_relations([rel[4] for rel in sent], [
+                min(rel[:4]) < sent_start or max(rel[:4]) >= sent_end
+                for rel in sent
+            ])
+
+    def add_brat_doc(self, brat_ann, doc):
+        """
+        Profile a brat-formatted document, using its spaCy parse for tokens
+        and sentences. Discontinuous entities are as wide as the tokens of
+        all their fragments, and a relation crosses sentences if its
+        arguments start in different sentences.
+
+        parameters:
+            brat_ann, BratAnn or None: the document's annotations, None if it
+                has no .ann file, in which case only its sentences are
+                profiled
+            doc, spacy Doc: parse of the document's text
+        """
+        sent_lengths = [len(sent) for sent in doc.sents]
+        self.sentence_lengths.update(sent_lengths)
+        if brat_ann is None:
+            return
+        sent_starts = np.array([sent.start_char for sent in doc.sents])
+        tok_starts = np.array([tok.idx for tok in doc])
+
+        def count_tokens(start, end):
+            return (np.searchsorted(tok_starts, end, 'left') -
+                    np.searchsorted(tok_starts, start, 'right') + 1)
+
+        ents = brat_ann.entities
+        self.add_entities(
+            [ent.type for ent in ents.values()],
+            [sum(count_tokens(start, end) for start, end in ent.offsets)
+             for ent in ents.values()])
+
+        def get_sent(ent_id):
+            start = ents[ent_id].offsets[0][0]
+            return np.searchsorted(sent_starts, start, 'right') - 1
+
+        rels = [rel for rel in brat_ann.relations.values()
+                if rel.arg1 in ents and rel.arg2 in ents]
+        self.add_relations([rel.type for rel in rels], [
+            get_sent(rel.arg1) != get_sent(rel.arg2) for rel in rels
+        ])
+
+    def to_df(self, corpus_name):
+        """
+        Get the profile as a long-format dataframe.
+
+        parameters:
+            corpus_name, str: name to put in the corpus column
+
+        returns:
+            dist_df, df: columns are corpus, distribution, label, value and
+                count. label is the entity or relation type, if any, and
+                value is the width or length for histograms.
+        """
+        rows = []
+        for distribution, counts in [
+                ('entity_type', self.entity_types),
+                ('relation_type', self.relation_types),
+                ('cross_sentence_relations', self.cross_sentence_relations)
+        ]:
+            rows.extend((distribution, label, np.nan, count)
+                        for label, count in counts.items())
+        for label, histogram in self.span_widths.items():
+            rows.extend(('span_width', label, value, count)
+                        for value, count in histogram.items())
+        rows.extend(('sentence_length', '', value, count)
+                    for value, count in self.sentence_lengths.items())
+
+        dist_df = pd.DataFrame(
+            rows, columns=['distribution', 'label', 'value', 'count'])
+        dist_df.insert(0, 'corpus', corpus_name)
+
+        return dist_df
+
+
+def new_corpus_stats():
+    """
+    Make empty accumulators for the statistics of one corpus.
+
+    returns:
+        corpus_stats, dict of RunningStats: keys are TEXT_STATS + ANN_STATS
+    """
+    return {name: RunningStats() for name in TEXT_STATS + ANN_STATS}
+
+
+def iter_dygiepp_docs(corpus_file):
+    """
+    Read a dygiepp-formatted jsonl file one document at a time.
+
+    parameters:
+        corpus_file, str: path to the corpus file
+
+    yields:
+        doc, dict: each document
     """
-    # Read in files
     with jsonlines.open(corpus_file) as reader:
-        corpus = []
-        for obj in reader:
-            corpus.append(obj)
-
-    # Get per doc stats
-    num_sents_per_doc = []
-    num_tokens_per_doc = []
-    for doc in corpus:
-        num_sents = len(doc["sentences"])
-        num_tokens = sum([len(sent) for sent in doc["sentences"]])
-        num_sents_per_doc.append(num_sents)
-        num_tokens_per_doc.append(num_tokens)
+        for doc in reader:
+            yield doc
 
-    # Compile into overall stats
-    text_stats_df = compile_text_stats(num_sents_per_doc, num_tokens_per_doc)
 
-    print(f'\nSnapshot of the text stats df:\n{text_stats_df}')
+def iter_brat_anns(corpus_dir):
+    """
+    Read the .ann files of a brat-formatted corpus one at a time.
 
-    return text_stats_df
+    parameters:
+        corpus_dir, str: path to the corpus
 
-def get_text_stats_brat(corpus_dir):
+    yields:
+        brat_ann, BratAnn: each parsed .ann file, in order of file name
     """
-    Gets total number of tokens and sentences in the document, as well as
-    mean/median/max/min per document for both tokens and sentences for a
-    brat-formatted dataset.
+    for f in sorted(listdir(corpus_dir)):
+        if '.ann' in f:
+            yield read_ann(join(corpus_dir, f))
+
+
+def update_dygiepp_stats(corpus_stats, corpus_file, predicted=False,
+                         profile=None):
+    """
+    Add the text and annotation counts of every document in a
+    dygiepp-formatted corpus to a set of accumulators.
+
+    parameters:
+        corpus_stats, dict of RunningStats: from new_corpus_stats, updated
+            in place
+        corpus_file, str: path to the corpus file
+        predicted, bool: whether to count the predicted entities and
+            relations instead of the gold standard ones
+        profile, DistributionProfile or None: if given, every document is
+            also added to it
+    """
+    prefix = 'predicted_' if predicted else ''
+    for doc in iter_dygiepp_docs(corpus_file):
+        sents = doc['sentences']
+        corpus_stats['sentences'].add(len(sents))
+        corpus_stats['tokens'].add(sum(len(sent) for sent in sents))
+        corpus_stats['entities'].add(
+            sum(len(sent) for sent in doc.get(f'{prefix}ner', [])))
+        corpus_stats['relations'].add(
+            sum(len(sent) for sent in doc.get(f'{prefix}relations', [])))
+        if profile is not None:
+            profile.add_dygiepp_doc(doc, predicted)
+
+
+def update_brat_ann_stats(corpus_stats, corpus_dir):
+    """
+    Add the annotation counts of every document in a brat-formatted corpus
+    to a set of accumulators.
 
     parameters:
+        corpus_stats, dict of RunningStats: from new_corpus_stats, updated
+            in place
         corpus_dir, str: path to the corpus
+    """
+    for brat_ann in iter_brat_anns(corpus_dir):
+        corpus_stats['entities'].add(len(brat_ann.entities))
+        corpus_stats['relations'].add(len(brat_ann.relations))
 
-    returns:
-        text_stats_df, df: pandas df with text stats
+
+def iter_brat_docs(corpus_dir):
     """
-    # Read in .txt files
-    files = {}
-    for f in listdir(corpus_dir):
+    Read the .txt files of a brat-formatted corpus one at a time, with the
+    .ann file of the same name if there is one.
+
+    parameters:
+        corpus_dir, str: path to the corpus
+
+    yields:
+        text, str: contents of each .txt file, in order of file name
+        brat_ann, BratAnn or None: its parsed .ann file
+    """
+    for f in sorted(listdir(corpus_dir)):
         if '.txt' in f:
             with open(join(corpus_dir, f)) as myf:
-                lines = myf.read()
-                files[f] = lines
+                text = myf.read()
+            ann_path = join(corpus_dir, f'{splitext(f)[0]}.ann')
+            yield text, read_ann(ann_path) if exists(ann_path) else None
+
+
+def update_brat_stats(corpus_stats, corpus_dir, model='en_core_sci_sm',
+                      batch_size=64, n_process=1, profile=None):
+    """
+    Add the text and annotation counts of every document in a brat-formatted
+    corpus to a set of accumulators, in one pass over its documents.
+
+    Texts are streamed through nlp.pipe with only the components needed for
+    sentence boundaries, and both text counts are taken from the same parse.
+    Annotations are counted for the documents that have an .ann file.
+
+    parameters:
+        corpus_stats, dict of RunningStats: from new_corpus_stats, updated
+            in place
+        corpus_dir, str: path to the corpus
+        model, str: name of the spaCy model to use
+        batch_size, int: number of documents per batch for nlp.pipe
+        n_process, int: number of processes for nlp.pipe
+        profile, DistributionProfile or None: if given, every document is
+            also added to it
+    """
+    # Only needed for brat corpora, so only imported for them
+    import spacy
+    nlp = spacy.load(model, exclude=NON_SENT_PIPES)
+
+    for doc, brat_ann in nlp.pipe(iter_brat_docs(corpus_dir), as_tuples=True,
+                                  batch_size=batch_size, n_process=n_process):
+        corpus_stats['sentences'].add(sum(1 for _ in doc.sents))
+        corpus_stats['tokens'].add(len(doc))
+        if profile is not None:
+            profile.add_brat_doc(brat_ann, doc)
+        if brat_ann is None:
+            continue
+        corpus_stats['entities'].add(len(brat_ann.entities))
+        corpus_stats['relations'].add(len(brat_ann.relations))
+
+
+def get_corpus_stats(corpus, d_format='brat', predicted=False,
+                     model='en_core_sci_sm', batch_size=64, n_process=1,
+                     profile=None):
+    """
+    Get the text and annotation statistics of a corpus in one pass over its
+    documents.
+
+    parameters:
+        corpus, str: path to the directory of a brat corpus, or to the file
+            of a dygiepp corpus
+        d_format, str: "brat" or "dygiepp"
+        predicted, bool: for dygiepp corpora, whether to count predicted
+            annotations instead of gold standard ones
+        model, batch_size, n_process: see update_brat_stats
+        profile, DistributionProfile or None: if given, filled in during the
+            same pass
+
+    returns:
+        corpus_stats, dict of RunningStats: see new_corpus_stats
+    """
+    corpus_stats = new_corpus_stats()
+    if d_format == 'brat':
+        update_brat_stats(corpus_stats, corpus, model, batch_size, n_process,
+                          profile)
+    else:
+        update_dygiepp_stats(corpus_stats, corpus, predicted, profile)
+
+    return corpus_stats
 
-    # Get per doc stats
-    nlp = spacy.load("en_core_sci_sm")
-    num_sents_per_doc = [len(list(nlp(doc).sents)) for doc in files.values()]
-    num_tokens_per_doc = [len(nlp(doc)) for doc in files.values()]
+
+def get_text_stats_dygiepp(corpus_file):
+    """
+    Gets total number of tokens and sentences in the document, as well as
+    mean/median/max/min per document for both tokens and sentences for a
+    dygiepp-formatted dataset.
+
+    parameters:
+        corpus_file, str: path to the corpus file
+
+    returns:
+        text_stats_df, df: pandas df with text stats
+    """
+    corpus_stats = new_corpus_stats()
+    update_dygiepp_stats(corpus_stats, corpus_file)
 
     # Compile into overall stats
-    text_stats_df = compile_text_stats(num_sents_per_doc, num_tokens_per_doc)
+    text_stats_df = compile_text_stats(corpus_stats['sentences'],
+                                       corpus_stats['tokens'])
 
     print(f'\nSnapshot of the text stats df:\n{text_stats_df}')
 
     return text_stats_df
 
 
-def compile_ann_stats(single_doc_anns):
+def get_text_stats_brat(corpus_dir, model='en_core_sci_sm', batch_size=64,
+                        n_process=1):
     """
-    Get summary statistics for annotation numbers.
+    Gets total number of tokens and sentences in the document, as well as
+    mean/median/max/min per document for both tokens and sentences for a
+    brat-formatted dataset.
 
     parameters:
-        single_doc_anns, dict: keys are doc keys or filenames and values
-            are tuples of (num_ent, num_rel) for the doc
+        corpus_dir, str: path to the corpus
+        model, batch_size, n_process: see update_brat_stats
 
     returns:
-        ann_stats_df, df: dataframe of sumamry statistics
+        text_stats_df, df: pandas df with text stats
     """
-    ann_stats_names = ['total_num_anns', 'mean_anns_per_doc',
-            'std_anns_per_doc', 'med_anns_per_doc', 'max_anns_per_doc',
-            'min_anns_per_doc']
+    corpus_stats = new_corpus_stats()
+    update_brat_stats(corpus_stats, corpus_dir, model, batch_size, n_process)
 
-    ents_per_doc = [val[0] for key, val in single_doc_anns.items()]
-    rels_per_doc = [val[1] for key, val in single_doc_anns.items()]
-
-    corpus_stats ={'entities':[sum(ents_per_doc), np.mean(ents_per_doc),
-        np.std(ents_per_doc), np.median(ents_per_doc), max(ents_per_doc),
-        min(ents_per_doc)],
-    'relations':[sum(rels_per_doc), np.mean(rels_per_doc),
-        np.std(rels_per_doc), np.median(rels_per_doc), max(rels_per_doc),
-        min(rels_per_doc)]}
+    # Compile into overall stats
+    text_stats_df = compile_text_stats(corpus_stats['sentences'],
+                                       corpus_stats['tokens'])
 
-    # Make into df with names as index
-    idx = pd.Index(ann_stats_names)
-    ann_stats_df = pd.DataFrame(corpus_stats, index=idx)
+    print(f'\nSnapshot of the text stats df:\n{text_stats_df}')
 
-    return ann_stats_df
+    return text_stats_df
 
 
 def get_annotation_stats_dygiepp(corpus_file):
@@ -156,25 +473,11 @@ def get_annotation_stats_dygiepp(corpus_file):
     returns:
         ann_stats_df, df: pandas df containing stats
     """
-    # Read in documents
-    with jsonlines.open(corpus_file) as reader:
-        corpus = []
-        for obj in reader:
-            corpus.append(obj)
-
-    # Get number of ents and rels per document
-    single_doc_anns = {}
-    for doc in corpus:
-        total_ents = 0
-        total_rels = 0
-        for i, sent in enumerate(doc["sentences"]):
-            total_ents += len(doc["ner"][i])
-            total_rels += len(doc["relations"][i])
-
-        single_doc_anns[doc["doc_key"]] = (total_ents, total_rels)
+    corpus_stats = new_corpus_stats()
+    update_dygiepp_stats(corpus_stats, corpus_file)
 
     # Compile stats
-    ann_stats_df = compile_ann_stats(single_doc_anns)
+    ann_stats_df = compile_ann_stats(corpus_stats)
 
     print(f'\nSnapshot of annotation statistics:\n{ann_stats_df}')
 
@@ -192,74 +495,138 @@ def get_annotation_stats_brat(corpus_dir):
     returns:
         ann_stats_df, df: pandas df containing stats
     """
-    # Read in .ann files
-    files = {}
-    for f in listdir(corpus_dir):
-        if '.ann' in f:
-            with open(join(corpus_dir, f)) as myf:
-                lines = myf.readlines()
-                files[f] = lines
-
-    # Get number of each type of ann per doc
-    single_doc_anns = {}
-    for name, doc in files.items():
-        total_ents =  0
-        total_rels = 0
-        for line in doc:
-            if line[0] == 'T':
-                total_ents += 1
-            elif line[0] == 'R':
-                total_rels += 1
-
-        single_doc_anns[name] = (total_ents, total_rels)
+    corpus_stats = new_corpus_stats()
+    update_brat_ann_stats(corpus_stats, corpus_dir)
 
     # Compile into overall stats
-    ann_stats_df = compile_ann_stats(single_doc_anns)
+    ann_stats_df = compile_ann_stats(corpus_stats)
 
     print(f'\nSnapshot of annotation statistics:\n{ann_stats_df}')
 
     return ann_stats_df
 
 
-def main(corpus, d_format, out_loc):
-
-    # Get annotation stats
-    if d_format == 'brat':
-        ann_stats_df = get_annotation_stats_brat(corpus)
-    else:
-        ann_stats_df = get_annotation_stats_dygiepp(corpus)
-
-    # Get text stats
-    if d_format == 'brat':
-        text_stats_df = get_text_stats_brat(corpus)
-    else:
-        text_stats_df = get_text_stats_dygiepp(corpus)
-
-    # Save both
+def get_file_prefix(corpus, d_format):
+    """
+    Get the name to save a corpus' statistics under.
+    """
     file_prefix = basename(corpus)
     if d_format == 'dygiepp':
         file_prefix = splitext(file_prefix)[0]
-    print(f'\nSaving annotation stats as {out_loc}/{file_prefix}_annotation_stats.csv')
-    print(f'\nSaving text stats as {out_loc}/{file_prefix}_text_stats.csv')
-    ann_stats_df.to_csv(f'{out_loc}/{file_prefix}_annotation_stats.csv')
-    text_stats_df.to_csv(f'{out_loc}/{file_prefix}_text_stats.csv')
+    return file_prefix
+
+
+def save_dist_df(dist_df, out_prefix, dist_format='csv'):
+    """
+    Save a distribution profile dataframe as CSV or Parquet. Parquet needs
+    pyarrow or fastparquet to be installed.
+
+    parameters:
+        dist_df, df: from DistributionProfile.to_df
+        out_prefix, str: path to save to, without the extension
+        dist_format, str: "csv" or "parquet"
+    """
+    out_name = f'{out_prefix}_distributions.{dist_format}'
+    print(f'\nSaving distributions as {out_name}')
+    if dist_format == 'parquet':
+        dist_df.to_parquet(out_name, index=False)
+    else:
+        dist_df.to_csv(out_name, index=False)
+
+
+def main(corpora, d_format, out_loc, model='en_core_sci_sm', batch_size=64,
+         n_process=1, predicted=False, comparison_name='corpus_comparison',
+         distributions=False, dist_format='csv'):
+
+    if isinstance(corpora, str):
+        corpora = [corpora]
+
+    ann_dfs = {}
+    text_dfs = {}
+    dist_dfs = []
+    for corpus in corpora:
+
+        # Get annotation and text stats
+        print(f'\nCalculating statistics for {corpus}...')
+        profile = DistributionProfile() if distributions else None
+        corpus_stats = get_corpus_stats(corpus, d_format, predicted, model,
+                                        batch_size, n_process, profile)
+        ann_stats_df = compile_ann_stats(corpus_stats)
+        text_stats_df = compile_text_stats(corpus_stats['sentences'],
+                                           corpus_stats['tokens'])
+        print(f'\nSnapshot of annotation statistics:\n{ann_stats_df}')
+        print(f'\nSnapshot of the text stats df:\n{text_stats_df}')
+
+        # Save both
+        file_prefix = get_file_prefix(corpus, d_format)
+        print(f'\nSaving annotation stats as {out_loc}/{file_prefix}_annotation_stats.csv')
+        print(f'\nSaving text stats as {out_loc}/{file_prefix}_text_stats.csv')
+        ann_stats_df.to_csv(f'{out_loc}/{file_prefix}_annotation_stats.csv')
+        text_stats_df.to_csv(f'{out_loc}/{file_prefix}_text_stats.csv')
+        ann_dfs[file_prefix] = ann_stats_df
+        text_dfs[file_prefix] = text_stats_df
+        if distributions:
+            dist_dfs.append(profile.to_df(file_prefix))
+            save_dist_df(dist_dfs[-1], f'{out_loc}/{file_prefix}',
+                         dist_format)
+
+    # Put the corpora side by side
+    if len(corpora) > 1:
+        for stat_type, dfs in [('annotation', ann_dfs), ('text', text_dfs)]:
+            side_by_side = pd.concat(dfs, axis=1)
+            print(f'\nComparison of {stat_type} stats:\n{side_by_side}')
+            out_name = f'{out_loc}/{comparison_name}_{stat_type}_stats.csv'
+            print(f'\nSaving {stat_type} stats comparison as {out_name}')
+            side_by_side.to_csv(out_name)
+        if distributions:
+            save_dist_df(pd.concat(dist_dfs, ignore_index=True),
+                         f'{out_loc}/{comparison_name}', dist_format)
     print('\nDone!\n')
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Get corpus statistics')
 
-    parser.add_argument('corpus', type=str,
+    parser.add_argument('corpus', type=str, nargs='+',
             help='Path to directory containing .txt and .ann files for the '
-            'corpus if d_format == "brat", otherwise a file path')
+            'corpus if d_format == "brat", otherwise a file path. Several '
+            'corpora can be given to compare them side by side.')
     parser.add_argument('out_loc', type=str,
-            help='Path for saving corpus stats. Two files will be saved.')
+            help='Path for saving corpus stats. Two files will be saved per '
+            'corpus, and two more comparing them if there\'s more than one.')
     parser.add_argument('-d_format', type=str, default='brat',
             help='Options are "brat" or "dygiepp", default is "brat"')
+    parser.add_argument('-model', type=str, default='en_core_sci_sm',
+            help='spaCy model to split brat documents into sentences and '
+            'tokens with, default is "en_core_sci_sm"')
+    parser.add_argument('-batch_size', type=int, default=64,
+            help='Number of brat documents to parse at a time, default is 64')
+    parser.add_argument('-n_process', type=int, default=1,
+            help='Number of processes to parse brat documents with, default '
+            'is 1')
+    parser.add_argument('--predicted', action='store_true',
+            help='For dygiepp corpora, count the predicted entities and '
+            'relations instead of the gold standard ones, e.g. to profile '
+            'model output')
+    parser.add_argument('-comparison_name', type=str,
+            default='corpus_comparison',
+            help='Prefix for the side by side files if there\'s more than '
+            'one corpus, default is "corpus_comparison"')
+
+    parser.add_argument('--distributions', action='store_true',
+            help='Also count each entity and relation type, the span widths '
+            'of each entity type, sentence lengths and relations between '
+            'sentences, and save them as <corpus>_distributions.<format>')
+    parser.add_argument('-dist_format', type=str, default='csv',
+            choices=['csv', 'parquet'],
+            help='File format for --distributions, default is csv. Parquet '
+            'needs pyarrow or fastparquet.')
 
     args = parser.parse_args()
 
-    args.corpus = abspath(args.corpus)
+    args.corpus = [abspath(corpus) for corpus in args.corpus]
     args.out_loc = abspath(args.out_loc)
 
-    main(args.corpus, args.d_format, args.out_loc)
+    main(args.corpus, args.d_format, args.out_loc, args.model,
+         args.batch_size, args.n_process, args.predicted,
+         args.comparison_name, args.distributions, args.dist_format)
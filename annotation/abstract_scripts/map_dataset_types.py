@@ -9,14 +9,89 @@ from os.path import abspath, splitext, isfile, basename
 import json
 from os import listdir
 from subprocess import run
-from collections import OrderedDict
 import jsonlines
-from copy import deepcopy
+from brat_parser import parse_ann, format_ann_line
+
+
+def map_doc(doc, entity_map, relation_map, ner_key, rel_key):
+    """
+    Get the mapped entities and relations of one dygiepp document, without
+    modifying it. Each sentence's lists are rebuilt in one pass; relations are
+    dropped if their type doesn't map, or if one of their arguments was
+    dropped from the same document. Relations whose type isn't in
+    relation_map are left as they are.
+
+    parameters:
+        doc, dict: dygiepp-formatted document
+        entity_map, dict: entity type map
+        relation_map, dict: relation type map
+        ner_key, str: 'ner' or 'predicted_ner'
+        rel_key, str: 'relations' or 'predicted_relations'
+
+    returns:
+        ner, list of list: mapped entities for each sentence
+        rels, list of list or None: mapped relations for each sentence, None
+            if the document has no rel_key
+        dropped_ents, int: number of dropped entities
+        dropped_rels, int: number of dropped rels
+    """
+    dropped_ents = 0
+    dropped_rels = 0
+
+    # Map entities, keeping track of the spans dropped from this doc
+    dropped_spans = set()
+    ner = []
+    for sent in doc[ner_key]:
+        kept = []
+        for ent in sent:
+            new_type = entity_map[ent[2]]
+            if new_type == '':
+                dropped_spans.add((ent[0], ent[1]))
+            else:
+                kept.append(ent[:2] + [new_type] + ent[3:])
+        dropped_ents += len(sent) - len(kept)
+        ner.append(kept)
+
+    # Then relations
+    if rel_key not in doc:
+        return ner, None, dropped_ents, dropped_rels
+    rels = []
+    for sent in doc[rel_key]:
+        kept = []
+        for rel in sent:
+            new_type = relation_map.get(rel[4], rel[4])
+            if new_type == '' or (rel[0], rel[1]) in dropped_spans or (
+                    rel[2], rel[3]) in dropped_spans:
+                continue
+            kept.append(rel[:4] + [new_type] + rel[5:])
+        dropped_rels += len(sent) - len(kept)
+        rels.append(kept)
+
+    return ner, rels, dropped_ents, dropped_rels
+
+
+def get_keys(predicted):
+    """
+    Get the names of the entity and relation fields to map.
+
+    parameters:
+        predicted, bool: whether to map the predicted fields or the gold
+            standard ones
+
+    returns:
+        ner_key, str: 'predicted_ner' or 'ner'
+        rel_key, str: 'predicted_relations' or 'relations'
+    """
+    if predicted:
+        return 'predicted_ner', 'predicted_relations'
+    else:
+        return 'ner', 'relations'
 
 
 def map_jsonl(dygiepp_data, entity_map, relation_map, predicted=True):
     """
-    Convert annotation types for dygiepp-formatted data.
+    Convert annotation types for dygiepp-formatted data, in place. See
+    map_doc for how each document is mapped.
 
     parameters:
         dygiepp_data, list of dict: dygiepp-formatted dataset
@@ -29,52 +104,57 @@ def map_jsonl(dygiepp_data, entity_map, relation_map, predicted=True):
         dropped_ents, int: number of dropped entities
         dropped_rels, int: number of dropped rels
     """
-    dropped_ent_idxs = []
     dropped_ents = 0
     dropped_rels = 0
-
+    ner_key, rel_key = get_keys(predicted)
     for doc in dygiepp_data:
-
-        # Check which version of ner/relations we want to map
-        if predicted:
-            ner_map = 'predicted_ner'
-            rel_map = 'predicted_relations'
-        else:
-            ner_map = 'ner'
-            rel_map = 'relations'
-
-        # Modify each sentence's ner and rels
-        for i in range(len(doc['sentences'])):
-            for ent in deepcopy(doc[ner_map][i]):
-                new_type = entity_map[ent[2]]
-                if new_type == '':
-                    dropped_ents += 1
-                    doc[ner_map][i].remove(ent)
-                    dropped_ent_idxs.append([ent[0], ent[1]])
-                else:
-                    ent_idx = doc[ner_map][i].index(ent)
-                    doc[ner_map][i][ent_idx][2] = new_type
-            try:
-                for rel in deepcopy(doc[rel_map][i]):
-                    new_type = relation_map[rel[4]]
-                    if new_type == '':
-                        dropped_rels += 1
-                        doc[rel_map][i].remove(rel)
-                    else:
-                        e1 = [rel[0], rel[1]]
-                        e2 = [rel[2], rel[3]]
-                        if (e1 in dropped_ent_idxs) or (e2 in dropped_ent_idxs):
-                            dropped_rels += 1
-                            doc[rel_map][i].remove(rel)
-                        else:
-                            rel_idx = doc[rel_map][i].index(rel)
-                            doc[rel_map][i][rel_idx][4] = new_type
-            except KeyError:
-                continue
+        ner, rels, de, dr = map_doc(doc, entity_map, relation_map, ner_key,
+                                    rel_key)
+        doc[ner_key] = ner
+        if rels is not None:
+            doc[rel_key] = rels
+        dropped_ents += de
+        dropped_rels += dr
 
     return dropped_ents, dropped_rels
 
 
+def map_jsonl_view(dygiepp_data, entity_map, relation_map, predicted=True):
+    """
+    Like map_jsonl, but leaves dygiepp_data as it is. Each mapped document is
+    a new dict that shares everything but its mapped fields with the
+    original, so the same data can be mapped to several ontologies.
+
+    parameters:
+        dygiepp_data, list of dict: dygiepp-formatted dataset
+        entity_map, dict: entity type map
+        relation_map, dict: relation type map
+        predicted, bool: whether or not to map predicted_ner and
+            predicted_relations, or the goild standard ner and relations
+
+    returns:
+        mapped_data, list of dict: mapped documents
+        dropped_ents, int: number of dropped entities
+        dropped_rels, int: number of dropped rels
+    """
+    mapped_data = []
+    dropped_ents = 0
+    dropped_rels = 0
+    ner_key, rel_key = get_keys(predicted)
+    for doc in dygiepp_data:
+        ner, rels, de, dr = map_doc(doc, entity_map, relation_map, ner_key,
+                                    rel_key)
+        mapped_doc = dict(doc)
+        mapped_doc[ner_key] = ner
+        if rels is not None:
+            mapped_doc[rel_key] = rels
+        mapped_data.append(mapped_doc)
+        dropped_ents += de
+        dropped_rels += dr
+
+    return mapped_data, dropped_ents, dropped_rels
+
+
 def map_ann(ann, entity_map, relation_map):
     """
     Convert annotation types for brat-formatted data.
@@ -87,48 +167,28 @@ def map_ann(ann, entity_map, relation_map):
     returns:
         mapped_ann, str: mapped ann file contents
     """
-    # Make a dict where keys are annotation IDs, values are the rest of the line
-    ann_list = ann.split('\n')
-    ann_dict = OrderedDict([(l.split('\t')[0], '\t'.join(l.split('\t')[1:])) for l in ann_list])
-
-    # Split into entities and relations
-    ent_dict = OrderedDict([(k, v) for k,v in ann_dict.items() if k[0] == 'T'])
-    rel_dict = OrderedDict([(k, v) for k,v in ann_dict.items() if k[0] == 'R'])
+    brat_ann = parse_ann(ann)
 
     # Go through entities first, remove unmappable
-    updated_ent_dict = {}
-    for ent_id, rest_ent in ent_dict.items():
-        middle, text = rest_ent.split('\t')
-        middle_split = middle.split(' ')
-        new_type = entity_map[middle_split[0]]
-        if new_type == '':
-            continue
-        else:
-            new_middle = [new_type] + middle_split[1:]
-            new_middle = ' '.join(new_middle)
-            new_rest = new_middle + '\t' + text
-            updated_ent_dict[ent_id] = new_rest
+    updated_ents = {}
+    for ent_id, ent in brat_ann.entities.items():
+        new_type = entity_map[ent.type]
+        if new_type != '':
+            updated_ents[ent_id] = ent._replace(type=new_type)
 
     # Then go through relations
-    updated_rel_dict = {}
-    for rel_id, rest_rel in rel_dict.items():
-        middle = rest_rel.split(' ')
-        arg1_id = middle[1][middle[1].index(':')+1:]
-        arg2_id = middle[2][middle[2].index(':')+1:]
-        if (arg1_id not in updated_ent_dict.keys()) or (arg2_id not in updated_ent_dict.keys()):
+    updated_rels = []
+    for rel in brat_ann.relations.values():
+        if (rel.arg1 not in updated_ents) or (rel.arg2 not in updated_ents):
             continue
-        else:
-            new_type = relation_map[middle[0]]
-            if new_type == '':
-                continue
-            else:
-                updated_rest = [new_type] + middle[1:]
-                updated_rel_dict[rel_id] = ' '.join(updated_rest)
+        new_type = relation_map[rel.type]
+        if new_type != '':
+            updated_rels.append(rel._replace(type=new_type))
 
     # Combine back into ann file
-    ent_list = [f'{k}\t{v}\n' for k, v in updated_ent_dict.items()]
-    rel_list = [f'{k}\t{v}\n' for k,v in updated_rel_dict.items()]
-    mapped_ann = ''.join(ent_list + rel_list)
+    mapped_ann = ''.join(
+        format_ann_line(record) + '\n'
+        for record in list(updated_ents.values()) + updated_rels)
 
     return mapped_ann
 
@@ -0,0 +1,304 @@
+"""
+Summary statistics that are updated one value at a time, so that corpora of
+any size can be described without holding their per-document counts in
+memory.
+
+RunningStats keeps the count, sum, min and max, the mean and variance with
+Welford's algorithm, and a QuantileSketch for the median. The sketch counts
+small non-negative integers exactly, which covers most per-document counts,
+and puts everything else in logarithmic buckets that are within a fixed
+relative error of the values in them, so its size only grows with the
+logarithm of the range of the values.
+
+Histogram and LabelCounts keep whole distributions of integers (e.g. span
+widths) and labels (e.g. entity types) as compact count arrays.
+
+Author: Serena G. Lotreck
+"""
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    Approximate distribution of a stream of values, for quantiles.
+    """
+
+    def __init__(self, rel_acc=0.005, exact_limit=1024):
+        """
+        parameters:
+            rel_acc, float: largest relative error of a value that isn't
+                counted exactly
+            exact_limit, int: integers from 0 up to but not including this
+                are counted exactly
+        """
+        self.rel_acc = rel_acc
+        self.gamma = (1 + rel_acc) / (1 - rel_acc)
+        self.log_gamma = math.log(self.gamma)
+        self.exact = np.zeros(exact_limit, dtype=np.int64)
+        self.buckets = {}
+        self.count = 0
+
+    def get_bucket(self, value):
+        """
+        Get the bucket of a value that isn't counted exactly. Buckets are
+        (sign, k), where bucket k holds the values whose magnitude is in
+        (gamma^(k-1), gamma^k], and 0 is in bucket (0, 0).
+        """
+        if value == 0:
+            return (0, 0)
+        sign = 1 if value > 0 else -1
+        return (sign, math.ceil(math.log(abs(value)) / self.log_gamma))
+
+    def get_bucket_value(self, bucket):
+        """
+        Get the value that stands for every value in a bucket, which is
+        within rel_acc of all of them.
+        """
+        sign, k = bucket
+        return sign * 2 * self.gamma**k / (self.gamma + 1)
+
+    def add(self, value, num=1):
+        """
+        Add a value to the sketch.
+
+        parameters:
+            value, int or float: value to add
+            num, int: number of times to add it
+        """
+        if value == int(value) and 0 <= value < self.exact.size:
+            self.exact[int(value)] += num
+        else:
+            key = self.get_bucket(value)
+            self.buckets[key] = self.buckets.get(key, 0) + num
+        self.count += num
+
+    def merge(self, other):
+        """
+        Add the values of another sketch with the same settings.
+        """
+        self.exact += other.exact
+        for key, num in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + num
+        self.count += other.count
+
+    def quantile(self, q):
+        """
+        Estimate a quantile, interpolating between the two closest ranks as
+        numpy.quantile does by default, so values that are counted exactly
+        give the same answer as numpy.
+
+        parameters:
+            q, float: quantile between 0 and 1
+
+        returns:
+            value, float: estimated quantile, NaN if the sketch is empty
+        """
+        if self.count == 0:
+            return np.nan
+        exact_values = np.flatnonzero(self.exact)
+        values = np.concatenate([
+            exact_values.astype(float),
+            [self.get_bucket_value(key) for key in self.buckets]
+        ])
+        nums = np.concatenate(
+            [self.exact[exact_values],
+             list(self.buckets.values())]).astype(np.int64)
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        ends = np.cumsum(nums[order])
+
+        # Values at the ranks on either side of the quantile
+        rank = q * (self.count - 1)
+        lower = math.floor(rank)
+        lower_value = values[np.searchsorted(ends, lower, 'right')]
+        upper_value = values[np.searchsorted(ends, min(lower + 1,
+                                                       self.count - 1),
+                                             'right')]
+
+        return lower_value + (rank - lower) * (upper_value - lower_value)
+
+
+class RunningStats:
+    """
+    Count, sum, mean, standard deviation, min, max and median of a stream of
+    values.
+    """
+
+    def __init__(self, rel_acc=0.005, exact_limit=1024):
+        """
+        parameters:
+            rel_acc, exact_limit: settings for the QuantileSketch
+        """
+        self.count = 0
+        self.total = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch(rel_acc, exact_limit)
+
+    def add(self, value):
+        """
+        Add one value.
+
+        parameters:
+            value, int or float: value to add
+        """
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        """
+        Add the values of another RunningStats with the same settings, e.g.
+        to combine the stats of several corpora.
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.total += other.total
+        for attr, func in [('min', min), ('max', max)]:
+            values = [v for v in (getattr(self, attr), getattr(other, attr))
+                      if v is not None]
+            setattr(self, attr, func(values))
+        self.sketch.merge(other.sketch)
+
+    @classmethod
+    def from_values(cls, values, **kwargs):
+        """
+        Make a RunningStats from an iterable of values.
+        """
+        stats = cls(**kwargs)
+        for value in values:
+            stats.add(value)
+        return stats
+
+    @property
+    def std(self):
+        """
+        Population standard deviation, as given by np.std.
+        """
+        if self.count == 0:
+            return np.nan
+        return math.sqrt(self.m2 / self.count)
+
+    @property
+    def median(self):
+        return self.sketch.quantile(0.5)
+
+    def summary(self):
+        """
+        Get the statistics in the order corpus_stats reports them.
+
+        returns:
+            summary, list: total, mean, std, median, max and min, NaN for
+                everything but the total if there are no values
+        """
+        if self.count == 0:
+            return [self.total] + [np.nan] * 5
+        return [
+            self.total, self.mean, self.std, self.median, self.max, self.min
+        ]
+
+
+class Histogram:
+    """
+    Counts of non-negative integers, kept in an array that grows as needed.
+    """
+
+    def __init__(self):
+        self.counts = np.zeros(16, dtype=np.int64)
+
+    def grow(self, size):
+        """
+        Make room for values up to size - 1.
+        """
+        if size > self.counts.size:
+            counts = np.zeros(max(size, 2 * self.counts.size),
+                              dtype=np.int64)
+            counts[:self.counts.size] = self.counts
+            self.counts = counts
+
+    def add(self, value, num=1):
+        """
+        Count a value.
+
+        parameters:
+            value, int: non-negative value
+            num, int: number of times to count it
+        """
+        self.grow(value + 1)
+        self.counts[value] += num
+
+    def update(self, values):
+        """
+        Count every value in an array of non-negative integers.
+        """
+        binned = np.bincount(np.asarray(values, dtype=np.int64))
+        self.grow(binned.size)
+        self.counts[:binned.size] += binned
+
+    def merge(self, other):
+        """
+        Add the counts of another histogram.
+        """
+        self.grow(other.counts.size)
+        self.counts[:other.counts.size] += other.counts
+
+    def items(self):
+        """
+        Get the values that were counted and their counts.
+
+        returns:
+            items, list of tuple: (value, count), in order of value
+        """
+        values = np.flatnonzero(self.counts)
+        return list(zip(values.tolist(), self.counts[values].tolist()))
+
+
+class LabelCounts:
+    """
+    Counts of string labels, interned as integer IDs into a Histogram.
+    """
+
+    def __init__(self):
+        self.label_ids = {}
+        self.histogram = Histogram()
+
+    def add(self, label, num=1):
+        """
+        Count a label.
+        """
+        label_id = self.label_ids.setdefault(label, len(self.label_ids))
+        self.histogram.add(label_id, num)
+
+    def merge(self, other):
+        """
+        Add the counts of another LabelCounts.
+        """
+        for label, num in other.items():
+            self.add(label, num)
+
+    def items(self):
+        """
+        Get the labels that were counted and their counts.
+
+        returns:
+            items, list of tuple: (label, count), in the order the labels
+                were first seen
+        """
+        counts = self.histogram.counts
+        return [(label, int(counts[label_id]))
+                for label, label_id in self.label_ids.items()
+                if counts[label_id] != 0]
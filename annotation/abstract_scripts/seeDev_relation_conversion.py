@@ -16,6 +16,7 @@ import argparse
 from os.path import abspath, splitext, isfile
 from os import listdir
 from tqdm import tqdm
+from brat_parser import parse_ann, format_ann_line, Relation
 
 
 def convert_rels(a2):
@@ -28,25 +29,22 @@ def convert_rels(a2):
     returns:
         updated_a2, str: updated annotation list
     """
-    a2_list = a2.split('\n')
-
-    updated_a2 = ''
-    for rel in a2_list:
-        if rel == '':
-            continue
-        elif rel[0] == 'E':
-            newrel = ''
-            relid, body = rel.split('\t')
-            new_id = 'R' + relid[1:]
-            newrel += new_id + '\t'
-            splitbody = body.split(' ')
-            newrel += splitbody[0] + ' '
-            arg1 = splitbody[1].split(':')[1]
-            arg2 = splitbody[2].split(':')[1]
-            newrel += f'Arg1:{arg1} Arg2:{arg2}\n'
-            updated_a2 += newrel
-        else:
-            updated_a2 += rel
+    brat_ann = parse_ann(a2)
+
+    # Events become relations between their first two arguments
+    records = []
+    for event in brat_ann.events.values():
+        records.append(
+            Relation('R' + event.id[1:], event.type,
+                     (('Arg1', event.args[0][1]), ('Arg2', event.args[1][1]))))
+
+    # Anything else is kept as it was
+    for kind in (brat_ann.entities, brat_ann.relations, brat_ann.attributes,
+                 brat_ann.notes):
+        records.extend(kind.values())
+    records.extend(brat_ann.other)
+
+    updated_a2 = ''.join(format_ann_line(record) + '\n' for record in records)
 
     return updated_a2
 
@@ -5,11 +5,48 @@ DyGIE++. The developer's reccomended solution
 make them smaller. This script splits any documents with more than 20 sentences
 into two documents, roughly in half.
 
+Alternatively, documents can be split into as many chunks as needed to keep
+each chunk under a token budget and/or a budget of candidate spans, which is
+what DyGIE++ actually enumerates and scores. Chunks are made of whole
+sentences, and sentences that are connected by a relation always stay in the
+same chunk. The chunk each part of a document went to is saved in an offset
+map, which is used to reassemble the predictions on the chunks into
+predictions on the original documents, so that they can be evaluated against
+the unsplit gold standard.
+
 Author: Serena G. Lotreck
 """
 import argparse
 from os.path import abspath, splitext
 import jsonlines
+import numpy as np
+
+# Per-sentence fields of a dygiepp document, and the number of token indices
+# at the start of each of their elements
+SENT_KEYS = ['sentences', 'ner', 'relations', 'predicted_ner',
+             'predicted_relations']
+IDX_KEYS = {'ner': 2, 'relations': 4, 'predicted_ner': 2,
+            'predicted_relations': 4}
+
+# DyGIE++ default, none of the configs in models/training_config change it
+MAX_SPAN_WIDTH = 8
+
+
+def shift_indices(doc, shift):
+    """
+    Add a number to the token indices in every field of a document that has
+    them, in place.
+
+    parameters:
+        doc, dict: document to update
+        shift, int: number to add, negative to subtract
+    """
+    for key, idxs in IDX_KEYS.items():
+        if key not in doc:
+            continue
+        doc[key] = [[[idx + shift for idx in elt[:idxs]] + list(elt[idxs:])
+                     for elt in sent]
+                    for sent in doc[key]]
 
 
 def adjust_indices(first_half, second_half):
@@ -29,22 +66,216 @@ def adjust_indices(first_half, second_half):
     to_subtract = len(tokens)
 
     # Then subtract
-    for key in ["ner", "relations"]:
-        idxs = 4 if key == "relations" else 2
-        updated_value = []
-        for sent in second_half[key]:
-            updated_sent = []
-            for elt in sent:
-                updated_elt = []
-                for idx in range(idxs):
-                    updated_elt.append(elt[idx] - to_subtract)
-                updated_elt += elt[idxs:]
-                updated_sent.append(updated_elt)
-            updated_value.append(updated_sent)
-        second_half[key] = updated_value
+    shift_indices(second_half, -to_subtract)
 
     return second_half
-        
+
+
+def get_span_counts(sent_lengths, max_span_width=MAX_SPAN_WIDTH):
+    """
+    Get the number of candidate spans DyGIE++ enumerates in each sentence,
+    which is every span of up to max_span_width tokens.
+
+    parameters:
+        sent_lengths, array of int: number of tokens in each sentence
+        max_span_width, int: longest span the model considers
+
+    returns:
+        span_counts, array of int: number of spans in each sentence
+    """
+    lengths = np.asarray(sent_lengths, dtype=np.int64)
+    widths = np.minimum(lengths, max_span_width)
+
+    # A sentence of n tokens has n - w + 1 spans of width w
+    return widths * (lengths + 1) - widths * (widths + 1) // 2
+
+
+def get_sentence_blocks(doc):
+    """
+    Group the sentences of a document into blocks that can't be split,
+    because a relation connects tokens in more than one of their sentences.
+
+    parameters:
+        doc, dict: dygiepp-formatted document
+
+    returns:
+        block_ends, list of int: index after the last sentence of each block
+    """
+    sent_ends = np.cumsum([len(sent) for sent in doc["sentences"]])
+    num_sents = len(sent_ends)
+
+    # Mark each boundary between sentences that a relation spans
+    crossed = np.zeros(num_sents + 1, dtype=np.int64)
+    for i, sent in enumerate(doc.get("relations", [])):
+        for rel in sent:
+            rel_sents = np.append(
+                np.searchsorted(sent_ends, rel[:4], 'right'), i)
+            crossed[rel_sents.min()] += 1
+            crossed[rel_sents.max()] -= 1
+    joined = np.cumsum(crossed)[:num_sents - 1] > 0
+
+    return (np.flatnonzero(~joined) + 1).tolist() + [num_sents]
+
+
+def get_chunk_bounds(doc, max_tokens=None, max_spans=None,
+                     max_span_width=MAX_SPAN_WIDTH):
+    """
+    Decide where to split a document so that each chunk is within the
+    budgets, adding blocks of sentences to a chunk until the next one
+    doesn't fit. A block that's over budget by itself is its own chunk.
+
+    parameters:
+        doc, dict: dygiepp-formatted document
+        max_tokens, int or None: most tokens in a chunk
+        max_spans, int or None: most candidate spans in a chunk
+        max_span_width, int: longest span the model considers
+
+    returns:
+        bounds, list of tuple: (first sentence, index after last sentence) of
+            each chunk
+    """
+    sent_lengths = [len(sent) for sent in doc["sentences"]]
+    tokens = np.concatenate([[0], np.cumsum(sent_lengths)])
+    spans = np.concatenate(
+        [[0], np.cumsum(get_span_counts(sent_lengths, max_span_width))])
+    max_tokens = np.inf if max_tokens is None else max_tokens
+    max_spans = np.inf if max_spans is None else max_spans
+
+    bounds = []
+    start = end = 0
+    for block_end in get_sentence_blocks(doc):
+        fits = (tokens[block_end] - tokens[start] <= max_tokens
+                and spans[block_end] - spans[start] <= max_spans)
+        if not fits and end > start:
+            bounds.append((start, end))
+            start = end
+        end = block_end
+    if end > start or len(bounds) == 0:
+        bounds.append((start, end))
+
+    return bounds
+
+
+def chunk_doc(doc, max_tokens=None, max_spans=None,
+              max_span_width=MAX_SPAN_WIDTH):
+    """
+    Split a document into chunks within a token and/or span budget.
+
+    parameters:
+        doc, dict: dygiepp-formatted document
+        max_tokens, max_spans, max_span_width: see get_chunk_bounds
+
+    returns:
+        chunks, list of dict: the chunks, in order. The document is returned
+            as is if it already fits.
+        offsets, list of dict: for each chunk, its doc_key, the doc_key of
+            the original document, and the indices of the chunk's first
+            sentence and token in the original document
+    """
+    bounds = get_chunk_bounds(doc, max_tokens, max_spans, max_span_width)
+    if len(bounds) == 1:
+        return [doc], [{"doc_key": doc["doc_key"],
+                        "orig_doc_key": doc["doc_key"],
+                        "sent_offset": 0, "token_offset": 0}]
+
+    sent_starts = np.concatenate(
+        [[0], np.cumsum([len(sent) for sent in doc["sentences"]])])
+    chunks = []
+    offsets = []
+    for i, (start, end) in enumerate(bounds):
+        chunk = {key: value for key, value in doc.items()
+                 if key not in SENT_KEYS}
+        chunk["doc_key"] = f'{doc["doc_key"]}_split_{i + 1}'
+        for key in SENT_KEYS:
+            if key in doc:
+                chunk[key] = doc[key][start:end]
+        shift_indices(chunk, -int(sent_starts[start]))
+        chunks.append(chunk)
+        offsets.append({"doc_key": chunk["doc_key"],
+                        "orig_doc_key": doc["doc_key"],
+                        "sent_offset": int(start),
+                        "token_offset": int(sent_starts[start])})
+
+    return chunks, offsets
+
+
+def chunk_docs(dset, max_tokens=None, max_spans=None,
+               max_span_width=MAX_SPAN_WIDTH):
+    """
+    Split every document that's over budget, see chunk_doc.
+
+    parameters:
+        dset, list of dict: dataset to process
+        max_tokens, max_spans, max_span_width: see get_chunk_bounds
+
+    returns:
+        updated_dset, list of dict: dset with large documents split
+        offset_map, list of dict: offsets of every document in updated_dset
+    """
+    updated_dset = []
+    offset_map = []
+    docs_split = []
+    for doc in dset:
+        chunks, offsets = chunk_doc(doc, max_tokens, max_spans,
+                                    max_span_width)
+        updated_dset.extend(chunks)
+        offset_map.extend(offsets)
+        if len(chunks) > 1:
+            docs_split.append(doc["doc_key"])
+            print(f'Split {doc["doc_key"]} into {len(chunks)} chunks')
+
+    print(f'A total of {len(docs_split)} documents were split, with the '
+    f'following doc_keys: {docs_split}')
+
+    return updated_dset, offset_map
+
+
+def reassemble_docs(dset, offset_map):
+    """
+    Put the chunks of split documents back together, with the indices of
+    their annotations and predictions shifted back to the original
+    documents. Documents that weren't split are kept as they are. If some
+    chunks of a document have a per-sentence key that others don't, the
+    others get an empty list for each of their sentences, so that the lists
+    stay aligned with the sentences.
+
+    parameters:
+        dset, list of dict: chunks, e.g. with predictions from DyGIE++
+        offset_map, list of dict: from chunk_docs
+
+    returns:
+        reassembled, list of dict: one document per original doc_key, in
+            the order they first appear in dset
+    """
+    offsets = {offset["doc_key"]: offset for offset in offset_map}
+    grouped = {}
+    for doc in dset:
+        offset = offsets.get(doc["doc_key"],
+                             {"orig_doc_key": doc["doc_key"],
+                              "sent_offset": 0, "token_offset": 0})
+        grouped.setdefault(offset["orig_doc_key"], []).append((offset, doc))
+
+    reassembled = []
+    for orig_doc_key, chunks in grouped.items():
+        if len(chunks) == 1 and chunks[0][1]["doc_key"] == orig_doc_key:
+            reassembled.append(chunks[0][1])
+            continue
+        chunks.sort(key=lambda chunk: chunk[0]["sent_offset"])
+        doc = {key: value for key, value in chunks[0][1].items()
+               if key not in SENT_KEYS}
+        doc["doc_key"] = orig_doc_key
+        doc_keys = [key for key in SENT_KEYS
+                    if any(key in chunk for _, chunk in chunks)]
+        for offset, chunk in chunks:
+            chunk = dict(chunk)
+            shift_indices(chunk, offset["token_offset"])
+            for key in doc_keys:
+                doc.setdefault(key, []).extend(
+                    chunk.get(key, [[] for _ in chunk["sentences"]]))
+        reassembled.append(doc)
+
+    return reassembled
+
 
 def split_docs(dset):
     """
@@ -90,7 +321,8 @@ def split_docs(dset):
     return updated_dset
 
 
-def main(dset_path):
+def main(dset_path, max_tokens=None, max_spans=None,
+         max_span_width=MAX_SPAN_WIDTH, offset_map_path=None):
 
     # Read in the dataset
     print('\nReading in daataset...')
@@ -99,9 +331,27 @@ def main(dset_path):
         for obj in reader:
             dset.append(obj)
 
+    # Put predictions back together
+    if offset_map_path is not None:
+        print('\nReassembling dataset...')
+        with jsonlines.open(offset_map_path) as reader:
+            offset_map = list(reader)
+        reassembled = reassemble_docs(dset, offset_map)
+        outname = (splitext(dset_path)[0] + '_REASSEMBLED' +
+                   splitext(dset_path)[1])
+        with jsonlines.open(outname, 'w') as writer:
+            writer.write_all(reassembled)
+        print(f'Saved reassembled output as {outname}')
+        return
+
     # Process
     print('\nProcessing dataset...')
-    updated_dset = split_docs(dset)
+    offset_map = None
+    if max_tokens is None and max_spans is None:
+        updated_dset = split_docs(dset)
+    else:
+        updated_dset, offset_map = chunk_docs(dset, max_tokens, max_spans,
+                                              max_span_width)
 
     # Save
     print('\nSaving dataset...')
@@ -109,6 +359,11 @@ def main(dset_path):
     with jsonlines.open(outname, 'w') as writer:
         writer.write_all(updated_dset)
     print(f'Saved split output as {outname}')
+    if offset_map is not None:
+        map_name = splitext(dset_path)[0] + '_SPLIT_OFFSETS.jsonl'
+        with jsonlines.open(map_name, 'w') as writer:
+            writer.write_all(offset_map)
+        print(f'Saved offset map as {map_name}')
 
 
 if __name__ == "__main__":
@@ -117,10 +372,27 @@ if __name__ == "__main__":
     parser.add_argument('dset_path', type=str,
             help='Path to dataset to process. Output is saved to same location '
             'with "_SPLIT" appended to the original filename')
+    parser.add_argument('-max_tokens', type=int, default=None,
+            help='Split documents into chunks of at most this many tokens, '
+            'instead of splitting documents with 20 or more sentences in half')
+    parser.add_argument('-max_spans', type=int, default=None,
+            help='Split documents into chunks with at most this many '
+            'candidate spans. Can be combined with -max_tokens.')
+    parser.add_argument('-max_span_width', type=int, default=MAX_SPAN_WIDTH,
+            help='Longest span the model considers, for -max_spans. Default '
+            f'is {MAX_SPAN_WIDTH}, the DyGIE++ default.')
+    parser.add_argument('-reassemble', type=str, default=None,
+            help='Path to the _SPLIT_OFFSETS.jsonl saved when splitting. If '
+            'given, dset_path is instead a split dataset (e.g. predictions) '
+            'to put back together, which is saved with "_REASSEMBLED" '
+            'appended to the filename')
 
     args = parser.parse_args()
 
     args.dset_path = abspath(args.dset_path)
+    if args.reassemble is not None:
+        args.reassemble = abspath(args.reassemble)
 
-    main(args.dset_path)
+    main(args.dset_path, args.max_tokens, args.max_spans,
+         args.max_span_width, args.reassemble)
             
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Read the type hierarchy out of a brat annotation.conf, so that annotations
+and predictions can be scored at coarser levels of the hierarchy as well as
+on their own types.
+
+In annotation.conf, each type is indented with one more tab than its parent,
+and abstract types, which only group other types, start with "!":
+
+    [entities]
+    !Chemical
+    	!Compound
+    		Plant_hormone
+    	Element
+
+The types of each section are interned as integer IDs, and their ancestors
+are kept in a closure table, where row i holds the ID of type i, its parent,
+its grandparent and so on, repeating the root once it's been reached. The
+ancestor IDs of any number of types at any level are then one array lookup.
+Types that aren't in annotation.conf are their own parent and root.
+
+Author: Serena G. Lotreck
+"""
+import numpy as np
+
+# Hierarchy levels that are scored, and the column of the closure table that
+# each one is read from
+LEVELS = ('leaf', 'parent', 'root')
+LEVEL_COLS = [0, 1, -1]
+
+
+class TypeHierarchy:
+    """
+    Interned types of one section of annotation.conf and their ancestors.
+    """
+
+    def __init__(self, names, parents):
+        """
+        parameters:
+            names, list of str: type names, without the "!" of abstract types
+            parents, list of int: index in names of each type's parent, -1
+                for types at the top of the hierarchy
+        """
+        self.names = list(names)
+        self.type_ids = {name: i for i, name in enumerate(self.names)}
+        self.parents = np.array(parents, dtype=np.int64).reshape(-1)
+
+        # Follow parents up until every type has reached its root; roots are
+        # their own parents so that they stay put
+        num_types = len(self.names)
+        up = np.where(self.parents < 0, np.arange(num_types), self.parents)
+        cols = [np.arange(num_types)]
+        while True:
+            next_col = up[cols[-1]]
+            if np.array_equal(next_col, cols[-1]):
+                break
+            cols.append(next_col)
+        if len(cols) == 1:
+            cols.append(cols[0])
+        self.ancestors = np.stack(cols, axis=1)
+
+    def lowercase(self):
+        """
+        Get a copy of the hierarchy with lowercased type names, for matching
+        types case-insensitively.
+        """
+        return TypeHierarchy([name.lower() for name in self.names],
+                             self.parents)
+
+    def get_ids(self, names):
+        """
+        Get the IDs of a list of type names. Names that aren't in the
+        hierarchy are numbered after the ones that are, in the order they
+        first appear.
+
+        parameters:
+            names, list of str: type names
+
+        returns:
+            ids, array of int: ID of each name
+        """
+        unknown = {}
+        ids = []
+        for name in names:
+            type_id = self.type_ids.get(name)
+            if type_id is None:
+                type_id = unknown.setdefault(name,
+                                             len(self.names) + len(unknown))
+            ids.append(type_id)
+
+        return np.array(ids, dtype=np.int64)
+
+    def get_level_ids(self, names):
+        """
+        Get the ID of the ancestor of each type at every level.
+
+        parameters:
+            names, list of str: type names
+
+        returns:
+            level_ids, array of int: shape (len(LEVELS), len(names)), the
+                types at each level of LEVELS. Unknown types keep the ID
+                given by get_ids at every level.
+        """
+        ids = self.get_ids(names)
+        level_ids = np.tile(ids, (len(LEVELS), 1))
+        known = ids < len(self.names)
+        level_ids[:, known] = self.ancestors[ids[known]][:, LEVEL_COLS].T
+
+        return level_ids
+
+    def get_level_names(self, names):
+        """
+        Get the name of the ancestor of each type at every level.
+
+        parameters:
+            names, list of str: type names
+
+        returns:
+            level_names, dict of list: for each level of LEVELS, the name of
+                the ancestor of each type
+        """
+        level_ids = self.get_level_ids(names)
+        all_names = self.names + [
+            name for name in dict.fromkeys(names) if name not in self.type_ids
+        ]
+
+        return {
+            level: [all_names[i] for i in ids]
+            for level, ids in zip(LEVELS, level_ids)
+        }
+
+
+def parse_annotation_conf(conf):
+    """
+    Get the type hierarchy of every section of an annotation.conf. Blank
+    lines, comments and lines that aren't types (e.g. <OVERLAP>) are skipped,
+    and parents are found from indentation alone.
+
+    parameters:
+        conf, str: contents of annotation.conf
+
+    returns:
+        hierarchies, dict of TypeHierarchy: keys are section names, e.g.
+            'entities' and 'relations'
+    """
+    sections = {}
+    names = parents = stack = None
+    for line in conf.split('\n'):
+        line = line.rstrip('\r')
+        stripped = line.strip()
+        if stripped == '' or stripped.startswith('#'):
+            continue
+        if stripped.startswith('[') and stripped.endswith(']'):
+            names, parents = sections.setdefault(stripped[1:-1], ([], []))
+            stack = []
+            continue
+        name = stripped.split()[0]
+        if names is None or name.startswith('<'):
+            continue
+        name = name.lstrip('!')
+
+        # The parent is the closest type above with one less tab
+        depth = len(line) - len(line.lstrip('\t'))
+        del stack[depth:]
+        if name not in names:
+            parents.append(stack[-1] if len(stack) != 0 else -1)
+            names.append(name)
+        stack.append(names.index(name))
+
+    return {
+        section: TypeHierarchy(names, parents)
+        for section, (names, parents) in sections.items()
+    }
+
+
+def read_annotation_conf(path):
+    """
+    Read the type hierarchies of an annotation.conf.
+
+    parameters:
+        path, str: path to annotation.conf
+
+    returns:
+        hierarchies, dict of TypeHierarchy: see parse_annotation_conf
+    """
+    with open(path) as myf:
+        return parse_annotation_conf(myf.read())
@@ -0,0 +1,58 @@
+"""
+Run a function over a list of tasks in a pool of forked processes, or in this
+process when only one worker is asked for or the platform can't fork (e.g.
+Windows).
+
+Arguments that are the same for every task, like a parsed gold standard, are
+put in worker_args for the duration of the run instead of being passed with
+each task. Forked workers inherit them, so they're never pickled. Worker
+functions read them from worker_args, whether they run in a pool or not.
+
+Author: Serena G. Lotreck
+"""
+import multiprocessing
+import warnings
+
+worker_args = {}
+
+
+def can_fork():
+    """
+    Whether worker processes can be forked on this platform.
+    """
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def run_tasks(worker, tasks, workers=1, shared_args=None, chunksize=None):
+    """
+    Run a worker function over a list of tasks.
+
+    parameters:
+        worker, function: takes one task, and reads anything else it needs
+            from worker_args
+        tasks, list: argument for each call of worker
+        workers, int: number of processes to use. A pool is only made if
+            this is more than 1 and there's more than one task.
+        shared_args, dict or None: put in worker_args while the tasks run
+        chunksize, int or None: tasks sent to a worker at a time, default is
+            enough for about four chunks per worker
+
+    returns:
+        results, list: worker output for each task, in order
+    """
+    use_pool = workers > 1 and len(tasks) > 1
+    if use_pool and not can_fork():
+        warnings.warn('Worker processes can\'t be forked on this platform, '
+                      'running in one process instead.')
+        use_pool = False
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (workers * 4))
+
+    worker_args.update(shared_args or {})
+    try:
+        if use_pool:
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                return pool.map(worker, tasks, chunksize=chunksize)
+        return [worker(task) for task in tasks]
+    finally:
+        worker_args.clear()
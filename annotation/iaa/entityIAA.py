@@ -1,10 +1,9 @@
 """
-Use the bratiaa package to get IAA for text-bound annotations.
+Calculate IAA for text-bound annotations, at the instance and token level.
 
-bratiaa asumes the following directory structure:
+Assumes the same directory structure as bratiaa:
 
     example-project/
-    ├── annotation.conf
     ├── annotator-1
     │   ├── doc-1.ann
     │   ├── doc-1.txt
@@ -22,58 +21,639 @@ bratiaa asumes the following directory structure:
             ├── doc-2.ann
             └── doc-2.txt
 
-In the specific structure that I have been using to coordinate annotators, the
-brat annotation.conf file must be moved to /mnt/research/ShiuLab/serena_kg/annotators_done/
-in order for this script to work.
+IAA is calculated on the documents that every annotator has (here, doc-3 and
+second/doc-2). Like bratiaa, F1 is calculated for each pair of annotators by
+adding up agreements over documents and/or labels, and the report gives the
+mean and SD of those F1's over the annotator pairs:
 
-The bratiaa package doesn't provide a direct way to write the report to a file,
-so this script should be run on the command line as
+    (1) INSTANCE. an entity is the same only if the type and all span
+        boundaries are the same.
+    (2) TOKEN. each entity is split into the tokens it overlaps, and a token
+        is the same if both annotators gave it the same type.
 
-    python entityIAA.py <project_dir> > <my_file>
+Tokens come from the scispaCy tokenizer, which is loaded once with the rest of
+the pipeline left out. Token offsets are cached by the hash of each .txt
+file's contents, in memory and, if -token_cache is given, on disk, so
+neither the copies of a document in each annotator's directory nor repeated
+runs tokenize the same text twice.
 
-in order to save the results to a file instead of printing.
+With --multi, the report also gives one chance-corrected agreement score
+across all annotators at once: Krippendorff's alpha and Fleiss' kappa, both
+nominal, overall and for each entity type. Every token of every shared
+document is a unit, labelled by each annotator with the type of the entity
+it's in, or with no type. Overall, a token in overlapping entities of
+different types gets the first type alphabetically. For each type, the
+label is just whether the token is in an entity of that type. Both scores
+come from the (units x labels) table of how many annotators gave each
+label, built from a (documents x tokens x annotators x types) array.
 
+The report is written to -out_file if given, and printed otherwise.
 
 Author: Serena G. Lotreck
 """
 import os
+import sys
 import argparse
+import hashlib
+import itertools
 
-import bratiaa as biaa
-import spacy
+import numpy as np
+import pandas as pd
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../abstract_scripts'))
+from brat_parser import read_ann
+from iaa_cache import IAACache, atomic_write, hash_file, watch
 
+# Everything in the scispaCy pipelines but the tokenizer
+NON_TOKENIZER_PIPES = [
+    'tok2vec', 'tagger', 'attribute_ruler', 'lemmatizer', 'parser', 'ner'
+]
 
-def tokenizer(text):
+
+def load_tokenizer(model='en_core_sci_sm'):
+    """
+    Load a spaCy model with only its tokenizer.
+
+    parameters:
+        model, str: name of the spaCy model
+
+    returns:
+        tokenize, function: takes a str and returns an array of the start
+            and end character offsets of its tokens
+    """
+    # Only needed for token-level IAA
+    import spacy
+
+    nlp = spacy.load(model, exclude=NON_TOKENIZER_PIPES)
+
+    def tokenize(text):
+        doc = nlp.make_doc(text)
+        return np.array([(tok.idx, tok.idx + len(tok)) for tok in doc],
+                        dtype=np.int64).reshape(-1, 2)
+
+    return tokenize
+
+
+class TokenCache:
+    """
+    Token offsets for texts, keyed by the hash of the text and the name of
+    the tokenizer, so that each distinct text is only tokenized once.
+    """
+
+    def __init__(self, tokenize, name, cache_dir=None):
+        """
+        parameters:
+            tokenize, function: see load_tokenizer
+            name, str: name of the tokenizer, part of the cache key
+            cache_dir, str: directory to keep offsets in between runs, or
+                None to only keep them in memory
+        """
+        self.tokenize = tokenize
+        self.name = name
+        self.cache_dir = cache_dir
+        self.offsets = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, text):
+        """
+        Get the token offsets for a text.
+
+        parameters:
+            text, str: text to tokenize
+
+        returns:
+            offsets, array of int: shape (num_tokens, 2)
+        """
+        key = hashlib.sha256(
+            f'{self.name}\0{text}'.encode('utf-8')).hexdigest()
+        if key in self.offsets:
+            return self.offsets[key]
+
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, f'{key}.npy')
+            if os.path.exists(path):
+                self.offsets[key] = np.load(path)
+                return self.offsets[key]
+
+        offsets = self.tokenize(text)
+        if path is not None:
+            with atomic_write(path, 'wb') as myf:
+                np.save(myf, offsets)
+        self.offsets[key] = offsets
+
+        return offsets
+
+
+def get_project_docs(project_dir):
+    """
+    Get the annotators in a project and the documents they all have.
+
+    parameters:
+        project_dir, str: path to the project
+
+    returns:
+        annotators, list of str: annotator directory names
+        docs, list of str: paths of the shared documents relative to each
+            annotator's directory, without the extension
+    """
+    annotators = sorted(f.name for f in os.scandir(project_dir) if f.is_dir())
+
+    doc_sets = []
+    for annotator in annotators:
+        annotator_path = os.path.join(project_dir, annotator)
+        docs = set()
+        for root, _, files in os.walk(annotator_path):
+            for f in files:
+                stem, ext = os.path.splitext(f)
+                if ext == '.ann' and f'{stem}.txt' in files:
+                    docs.add(
+                        os.path.relpath(os.path.join(root, stem),
+                                        annotator_path))
+        doc_sets.append(docs)
+    docs = sorted(set.intersection(*doc_sets)) if doc_sets else []
+
+    return annotators, docs
+
+
+def get_token_instances(entities, token_offsets):
+    """
+    Split entities into the tokens they overlap.
+
+    parameters:
+        entities, iterable of tuple: (type, offsets) for each entity
+        token_offsets, array of int: shape (num_tokens, 2)
+
+    returns:
+        instances, set of tuple: (type, token index)
+    """
+    instances = set()
+    for ent_type, offsets in entities:
+        for start, end in offsets:
+            # Tokens that end after the fragment starts and start before it
+            # ends
+            first = np.searchsorted(token_offsets[:, 1], start, side='right')
+            last = np.searchsorted(token_offsets[:, 0], end, side='left')
+            instances.update((ent_type, i) for i in range(first, last))
+
+    return instances
+
+
+def count_doc_pair(instances1, instances2):
+    """
+    Count agreements between two annotators on one document, for each label.
+
+    parameters:
+        instances1, set of tuple: annotation instances of annotator 1, where
+            the first element of each instance is its label
+        instances2, set of tuple: same for annotator 2
+
+    returns:
+        label_counts, dict of list: for each label, the number of instances
+            both annotators have, annotator 1 has and annotator 2 has
+    """
+    label_counts = {}
+    for col, instances in enumerate(
+        (instances1 & instances2, instances1, instances2)):
+        for inst in instances:
+            label_counts.setdefault(inst[0], [0, 0, 0])[col] += 1
+
+    return label_counts
+
+
+def stack_agreement_counts(doc_pair_counts, num_pairs, num_docs, labels):
+    """
+    Put per-document agreement counts for every pair of annotators into one
+    array.
+
+    parameters:
+        doc_pair_counts, dict: count_doc_pair output for each (pair index,
+            doc index)
+        num_pairs, int: number of annotator pairs
+        num_docs, int: number of documents
+        labels, list of str: labels to count
+
+    returns:
+        counts, array of int: shape (num_pairs, num_docs, num_labels, 3),
+            where the last axis is the number of instances both annotators
+            have, annotator 1 has and annotator 2 has
+    """
+    label_idxs = {label: i for i, label in enumerate(labels)}
+    counts = np.zeros((num_pairs, num_docs, len(labels), 3), dtype=np.int64)
+    for (p, d), label_counts in doc_pair_counts.items():
+        for label, label_count in label_counts.items():
+            counts[p, d, label_idxs[label]] = label_count
+
+    return counts
+
+
+def summarize_f1(counts, axis):
+    """
+    Sum agreement counts over the given axes, get the F1 for each annotator
+    pair, and take the mean and SD over pairs.
+
+    parameters:
+        counts, array of int: from stack_agreement_counts
+        axis, tuple of int: axes of counts to add up, not including the pair
+            or count axes
+
+    returns:
+        mean, array of float: mean F1 for each remaining index
+        sd, array of float: SD of F1 for each remaining index
+    """
+    summed = counts.sum(axis=axis)
+    both, total = summed[..., 0], summed[..., 1] + summed[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f1 = np.where(total > 0, 2 * both / total, np.nan)
+
+    return f1.mean(axis=0), f1.std(axis=0)
+
+
+def calculate_agreement(counts, docs, labels):
+    """
+    Get per-document, per-label and overall agreement.
+
+    parameters:
+        counts, array of int: from stack_agreement_counts
+        docs, list of str: document names
+        labels, list of str: labels
+
+    returns:
+        agreement, dict of df: 'per_doc', 'per_label' and 'overall'
+            dataframes with columns mean_F1 and SD_F1
+    """
+    agreement = {}
+    for name, axis, index in [('per_doc', (2, ), docs),
+                              ('per_label', (1, ), labels),
+                              ('overall', (1, 2), ['overall'])]:
+        mean, sd = summarize_f1(counts, axis)
+        agreement[name] = pd.DataFrame({
+            'mean_F1': np.atleast_1d(mean),
+            'SD_F1': np.atleast_1d(sd)
+        },
+                                       index=index)
+
+    return agreement
+
+
+def format_report(agreement, level, annotators, docs):
+    """
+    Format an agreement report.
+
+    parameters:
+        agreement, dict of df: from calculate_agreement
+        level, str: 'Instance' or 'Token'
+        annotators, list of str: annotator names
+        docs, list of str: document names
+
+    returns:
+        report, str: the report
+    """
+    lines = [
+        f'# {level}-level Inter-Annotator Agreement Report', '',
+        f'{len(annotators)} annotators: {", ".join(annotators)}',
+        f'{len(docs)} documents annotated by all annotators', '',
+        '## Agreement per Document',
+        agreement['per_doc'].to_string(), '', '## Agreement per Label',
+        agreement['per_label'].to_string(), '', '## Overall Agreement',
+        agreement['overall'].to_string(), ''
+    ]
+
+    return '\n'.join(lines)
+
+
+def read_doc(project_dir, annotator, doc, token_cache=None):
+    """
+    Read the entities in one annotator's copy of a document.
+
+    parameters:
+        project_dir, str: path to the project
+        annotator, str: annotator name
+        doc, str: document name
+        token_cache, TokenCache: tokenizer to split entities into tokens
+            with, or None to skip it
+
+    returns:
+        instances, set of tuple: (type, offsets) for each entity
+        tokens, set of tuple: (type, token index) for each token in an
+            entity, None without a token cache
+        num_tokens, int: number of tokens in the document, 0 without a
+            token cache
+    """
+    path = os.path.join(project_dir, annotator, doc)
+    entities = [(ent.type, ent.offsets)
+                for ent in read_ann(f'{path}.ann').entities.values()]
+    tokens = None
+    num_tokens = 0
+    if token_cache is not None:
+        with open(f'{path}.txt') as myf:
+            token_offsets = token_cache.get(myf.read())
+        tokens = get_token_instances(entities, token_offsets)
+        num_tokens = len(token_offsets)
+
+    return set(entities), tokens, num_tokens
+
+
+def get_entity_iaa(project_dir, token_cache=None, multi=False,
+                   iaa_cache=None):
+    """
+    Calculate instance- and, if a token cache is given, token-level entity
+    IAA for a project. Each annotator's copy of each document is only read
+    once, and with an IAA cache, only documents that aren't stored with the
+    same .ann (and .txt, for tokens) contents are read at all.
+
+    parameters:
+        project_dir, str: path to the project
+        token_cache, TokenCache: tokenizer to use for token-level IAA, or
+            None to skip it
+        multi, bool: whether to also calculate multi-annotator agreement,
+            needs a token cache
+        iaa_cache, IAACache: stored results to reuse and add to, or None
+
+    returns:
+        annotators, list of str: annotator names
+        docs, list of str: document names
+        agreements, dict: calculate_agreement output for 'Instance' and, if
+            requested, 'Token', and get_multi_annotator_agreement output for
+            'Multi' if requested
+    """
+    annotators, docs = get_project_docs(project_dir)
+    pairs = list(itertools.combinations(range(len(annotators)), 2))
+    levels = ['Instance'] if token_cache is None else ['Instance', 'Token']
+    doc_pairs = [(p, d) for p in range(len(pairs)) for d in range(len(docs))]
+
+    # Look up stored results
+    doc_pair_counts = {}
+    cache_keys = {}
+    if iaa_cache is not None:
+        settings = {
+            'script': 'entityIAA',
+            'tokenizer': None if token_cache is None else token_cache.name
+        }
+        exts = ['.ann'] if token_cache is None else ['.ann', '.txt']
+        file_hashes = {(a, d): [
+            hash_file(os.path.join(project_dir, annotators[a], docs[d]) + ext)
+            for ext in exts
+        ]
+                       for a in range(len(annotators))
+                       for d in range(len(docs))}
+        for p, d in doc_pairs:
+            ann1, ann2 = pairs[p]
+            key = iaa_cache.make_key(
+                settings, file_hashes[(ann1, d)] + file_hashes[(ann2, d)])
+            cache_keys[(p, d)] = key
+            stored = iaa_cache.get(key)
+            if stored is not None:
+                doc_pair_counts[(p, d)] = stored
+    missing = [doc_pair for doc_pair in doc_pairs
+               if doc_pair not in doc_pair_counts]
+
+    # Read what's needed for the rest
+    if multi:
+        to_read = {(a, d) for a in range(len(annotators))
+                   for d in range(len(docs))}
+    else:
+        to_read = {(a, d) for p, d in missing for a in pairs[p]}
+    read = {(a, d): read_doc(project_dir, annotators[a], docs[d],
+                             token_cache)
+            for a, d in sorted(to_read)}
+
+    # Compare
+    for p, d in missing:
+        ann1, ann2 = pairs[p]
+        doc_pair_counts[(p, d)] = {
+            level: count_doc_pair(read[(ann1, d)][i], read[(ann2, d)][i])
+            for i, level in enumerate(levels)
+        }
+        if iaa_cache is not None:
+            iaa_cache.set(cache_keys[(p, d)], doc_pair_counts[(p, d)])
+
+    labels = sorted({
+        label
+        for level_counts in doc_pair_counts.values()
+        for label_counts in level_counts.values() for label in label_counts
+    })
+    agreements = {}
+    for level in levels:
+        counts = stack_agreement_counts(
+            {
+                doc_pair: level_counts[level]
+                for doc_pair, level_counts in doc_pair_counts.items()
+            }, len(pairs), len(docs), labels)
+        agreements[level] = calculate_agreement(counts, docs, labels)
+
+    if multi and token_cache is not None:
+        token_sets = [[read[(a, d)][1] for d in range(len(docs))]
+                      for a in range(len(annotators))]
+        num_tokens = np.array(
+            [
+                max([read[(a, d)][2] for a in range(len(annotators))],
+                    default=0) for d in range(len(docs))
+            ],
+            dtype=np.int64)
+        agreements['Multi'] = get_multi_annotator_agreement(
+            token_sets, num_tokens, labels)
+
+    return annotators, docs, agreements
+
+
+def get_label_array(token_sets, num_tokens, labels):
+    """
+    Build an array of which tokens each annotator put in each type of
+    entity.
+
+    parameters:
+        token_sets, list of list of set: (type, token index) instances for
+            each annotator and document
+        num_tokens, array of int: number of tokens in each document
+        labels, list of str: entity types
+
+    returns:
+        label_array, array of bool: shape (num_docs, max_tokens,
+            num_annotators, num_labels)
+        valid, array of bool: shape (num_docs, max_tokens), False for the
+            padding after the end of each document
+    """
+    label_idxs = {label: i for i, label in enumerate(labels)}
+    max_tokens = int(num_tokens.max()) if len(num_tokens) else 0
+    label_array = np.zeros(
+        (len(num_tokens), max_tokens, len(token_sets), len(labels)),
+        dtype=bool)
+
+    # Indices of every (doc, token, annotator, label) that was annotated
+    idxs = [(d, tok, a, label_idxs[label])
+            for a, annotator_sets in enumerate(token_sets)
+            for d, instances in enumerate(annotator_sets)
+            for label, tok in instances]
+    if idxs:
+        label_array[tuple(np.array(idxs).T)] = True
+    valid = np.arange(max_tokens) < num_tokens[:, None]
+
+    return label_array, valid
+
+
+def fleiss_kappa(counts):
+    """
+    Calculate Fleiss' kappa.
+
+    parameters:
+        counts, array of int: shape (num_units, num_labels), how many
+            annotators gave each unit each label. Every unit must have the
+            same number of annotators.
+
+    returns:
+        kappa, float: Fleiss' kappa, NaN if only one label was ever used
     """
-    Tokenizer function to use for token-level IAA.
+    counts = np.asarray(counts, dtype=float)
+    num_units = counts.shape[0]
+    raters = counts[0].sum()
+    p_unit = ((counts**2).sum(axis=1) - raters) / (raters * (raters - 1))
+    p_label = counts.sum(axis=0) / (num_units * raters)
+    p_obs = p_unit.mean()
+    p_exp = (p_label**2).sum()
+    if p_exp == 1:
+        return np.nan
+
+    return (p_obs - p_exp) / (1 - p_exp)
 
-    Yields a generator with the start and end character offsets for the
-    tokens in the doc.
+
+def krippendorff_alpha(counts):
     """
-    nlp = spacy.load("en_core_sci_sm")
-    doc = nlp(text)
+    Calculate nominal Krippendorff's alpha.
 
-    # Make each token into a Span object
-    spans = []
-    for i, token in enumerate(doc):
-        spans.append(doc[i:i + 1])
+    parameters:
+        counts, array of int: shape (num_units, num_labels), how many
+            annotators gave each unit each label. Units can have different
+            numbers of annotators; units with fewer than two are ignored.
 
-    doc.spans['token_spans'] = spans
+    returns:
+        alpha, float: Krippendorff's alpha, NaN if only one label was ever
+            used
+    """
+    counts = np.asarray(counts, dtype=float)
+    pairable = counts.sum(axis=1)
+    counts = counts[pairable > 1]
+    pairable = pairable[pairable > 1]
 
-    # Get character offsets from Span objects
-    for span in doc.spans['token_spans']:
-        yield span.start_char, span.end_char
+    # Coincidence matrix
+    weighted = counts / (pairable - 1)[:, None]
+    coincidences = weighted.T @ counts - np.diag(weighted.sum(axis=0))
+    label_totals = coincidences.sum(axis=0)
+    total = label_totals.sum()
 
+    expected = total**2 - (label_totals**2).sum()
+    if expected == 0:
+        return np.nan
+    observed = total - np.trace(coincidences)
 
-def main(project_dir):
+    return 1 - (total - 1) * observed / expected
 
-    # Instance-level agreement
-    instance_f1 = biaa.compute_f1_agreement(project_dir)
-    biaa.iaa_report(instance_f1)
 
-    # Token-level agreement
-    token_f1 = biaa.compute_f1_agreement(project_dir, token_func=tokenizer)
-    biaa.iaa_report(token_f1)
+def get_multi_annotator_agreement(token_sets, num_tokens, labels):
+    """
+    Calculate Krippendorff's alpha and Fleiss' kappa across all annotators,
+    overall and for each entity type.
+
+    parameters:
+        token_sets, list of list of set: (type, token index) instances for
+            each annotator and document
+        num_tokens, array of int: number of tokens in each document
+        labels, list of str: entity types
+
+    returns:
+        multi_df, df: columns are krippendorff_alpha and fleiss_kappa, index
+            is the entity types and 'overall'
+    """
+    label_array, valid = get_label_array(token_sets, num_tokens, labels)
+
+    # Units are the real tokens, shape (num_units, num_annotators,
+    # num_labels)
+    units = label_array[valid]
+    num_annotators = units.shape[1]
+
+    rows = []
+    # Each type on its own, as present vs. absent
+    in_type = units.sum(axis=1)
+    for k in range(len(labels)):
+        type_counts = np.stack(
+            [num_annotators - in_type[:, k], in_type[:, k]], axis=1)
+        rows.append((krippendorff_alpha(type_counts),
+                     fleiss_kappa(type_counts)))
+
+    # All types together, 0 is no type and the first type wins for
+    # overlapping entities
+    overall_labels = np.where(units.any(axis=2), units.argmax(axis=2) + 1, 0)
+    overall_counts = (overall_labels[:, :, None] == np.arange(
+        len(labels) + 1)).sum(axis=1)
+    rows.append((krippendorff_alpha(overall_counts),
+                 fleiss_kappa(overall_counts)))
+
+    return pd.DataFrame(rows,
+                        columns=['krippendorff_alpha', 'fleiss_kappa'],
+                        index=labels + ['overall'])
+
+
+def format_multi_report(multi_df, annotators, docs):
+    """
+    Format a multi-annotator agreement report.
+
+    parameters:
+        multi_df, df: from get_multi_annotator_agreement
+        annotators, list of str: annotator names
+        docs, list of str: document names
+
+    returns:
+        report, str: the report
+    """
+    lines = [
+        '# Multi-annotator Token-level Agreement Report', '',
+        f'{len(annotators)} annotators: {", ".join(annotators)}',
+        f'{len(docs)} documents annotated by all annotators', '',
+        multi_df.to_string(), ''
+    ]
+
+    return '\n'.join(lines)
+
+
+def main(project_dir, out_file=None, model='en_core_sci_sm', token_cache=None,
+         skip_tokens=False, multi=False, cache_file=None, watch_interval=None):
+
+    # Load the tokenizer once for all documents
+    cache = None
+    if not skip_tokens:
+        print(f'\nLoading tokenizer from {model}...')
+        cache = TokenCache(load_tokenizer(model), model, token_cache)
+    iaa_cache = IAACache(cache_file) if cache_file is not None else None
+
+    def run():
+        print('\nCalculating entity IAA...')
+        annotators, docs, agreements = get_entity_iaa(project_dir, cache,
+                                                      multi, iaa_cache)
+        if iaa_cache is not None:
+            iaa_cache.save()
+        reports = []
+        for level, agreement in agreements.items():
+            if level == 'Multi':
+                reports.append(
+                    format_multi_report(agreement, annotators, docs))
+            else:
+                reports.append(
+                    format_report(agreement, level, annotators, docs))
+        report = '\n'.join(reports)
+
+        if out_file is not None:
+            with open(out_file, 'w') as myf:
+                myf.write(report)
+            print(f'\nSaved report as {out_file}')
+        else:
+            print(report)
+
+    if watch_interval is not None:
+        watch(project_dir, run, watch_interval)
+    else:
+        run()
 
 
 if __name__ == '__main__':
@@ -85,9 +665,57 @@ if __name__ == '__main__':
         type=str,
         help='Path to brat annotated files of multiple annotators, with '
         'the directory structure required by bratiaa')
+    parser.add_argument('-out_file',
+                        type=str,
+                        help='Path to save the report. If not given, the '
+                        'report is printed.',
+                        default=None)
+    parser.add_argument('-model',
+                        type=str,
+                        help='spaCy model to take the tokenizer from. '
+                        'Default is en_core_sci_sm.',
+                        default='en_core_sci_sm')
+    parser.add_argument(
+        '-token_cache',
+        type=str,
+        help='Directory to keep token offsets in, so that texts that have '
+        'already been tokenized in an earlier run are not tokenized again.',
+        default=None)
+    parser.add_argument('--skip_tokens',
+                        action='store_true',
+                        help='Only calculate instance-level IAA.')
+    parser.add_argument(
+        '--multi',
+        action='store_true',
+        help='Also report token-level Krippendorff\'s alpha and Fleiss\' '
+        'kappa across all annotators, overall and per entity type.')
+    parser.add_argument(
+        '-cache_file',
+        type=str,
+        help='JSON file to store per-document results in. Reruns with the '
+        'same file only reread documents whose annotations changed.',
+        default=None)
+    parser.add_argument(
+        '-watch',
+        type=float,
+        help='Keep running, and update the report whenever an annotation '
+        'file changes, checking every this many seconds. Best used with '
+        '-cache_file.',
+        default=None)
 
     args = parser.parse_args()
 
     args.project_dir = os.path.abspath(args.project_dir)
+    if args.out_file is not None:
+        args.out_file = os.path.abspath(args.out_file)
+    if args.token_cache is not None:
+        args.token_cache = os.path.abspath(args.token_cache)
+    if args.cache_file is not None:
+        args.cache_file = os.path.abspath(args.cache_file)
+
+    if args.multi and args.skip_tokens:
+        parser.error('--multi needs tokens, so it can\'t be used with '
+                     '--skip_tokens')
 
-    main(args.project_dir)
+    main(args.project_dir, args.out_file, args.model, args.token_cache,
+         args.skip_tokens, args.multi, args.cache_file, args.watch)
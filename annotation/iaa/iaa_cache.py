@@ -0,0 +1,192 @@
+"""
+Persistent store of per-(annotator pair, document) IAA results, so that
+reruns of relationIAA and entityIAA only recompare documents whose
+annotations have changed.
+
+Each result is keyed by the settings of the run (tolerance, alignment,
+tokenizer, ...) and the hashes of the files it was calculated from, so an
+edited .ann file or a different setting simply misses the cache. The store is
+a JSON file that's rewritten atomically when the run is done, keeping only
+the results that the run looked up or made, so that results for old versions
+of the files don't pile up.
+
+Also has the polling loop for the scripts' watch mode.
+
+Author: Serena G. Lotreck
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import time
+
+# Bump when the layout of the stored results changes
+CACHE_VERSION = 1
+
+
+def hash_file(path):
+    """
+    Get the sha256 hash of a file's contents.
+
+    parameters:
+        path, str: path to the file
+
+    returns:
+        digest, str: hex digest
+    """
+    with open(path, 'rb') as myf:
+        return hashlib.sha256(myf.read()).hexdigest()
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Open a temporary file next to path for writing, and move it to path once
+    the block is done, so that an interrupted write never leaves a partial
+    file behind. If the block raises, the temporary file is removed and path
+    is left as it was.
+
+    parameters:
+        path, str: file to write
+        mode, str: 'w' or 'wb'
+
+    yields:
+        myf, file object: open temporary file
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, mode) as myf:
+            yield myf
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class IAACache:
+    """
+    Results of earlier IAA comparisons, keyed by settings and file hashes.
+    """
+
+    def __init__(self, path):
+        """
+        parameters:
+            path, str: JSON file to keep the results in, made if it doesn't
+                exist yet
+        """
+        self.path = path
+        self.entries = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path) as myf:
+                stored = json.load(myf)
+            if stored.get('version') == CACHE_VERSION:
+                self.entries = stored['entries']
+
+    @staticmethod
+    def make_key(settings, file_hashes):
+        """
+        Make the key for one comparison.
+
+        parameters:
+            settings, dict: everything besides the files that the result
+                depends on; must be JSON serializable
+            file_hashes, list of str: hashes of the files compared, in order
+
+        returns:
+            key, str: cache key
+        """
+        key_str = json.dumps([settings, file_hashes], sort_keys=True)
+        return hashlib.sha256(key_str.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a result, None if it isn't stored.
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used.add(key)
+        return value
+
+    def set(self, key, value):
+        """
+        Store a JSON serializable result.
+        """
+        self.entries[key] = value
+        self.used.add(key)
+
+    def save(self):
+        """
+        Write the results that were looked up or stored since the last save
+        to the JSON file, dropping the rest.
+        """
+        self.entries = {key: value for key, value in self.entries.items()
+                        if key in self.used}
+        cache_dir = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(cache_dir, exist_ok=True)
+        with atomic_write(self.path) as myf:
+            json.dump({'version': CACHE_VERSION, 'entries': self.entries},
+                      myf)
+        print(f'\nReused {self.hits} stored comparisons and made '
+              f'{self.misses} new ones; saved to {self.path}')
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+
+def get_snapshot(project_dir, exts=('.ann', '.txt')):
+    """
+    Get the modification time and size of every annotation file in a
+    project.
+
+    parameters:
+        project_dir, str: path to the project
+        exts, tuple of str: file extensions to include
+
+    returns:
+        snapshot, dict: (mtime, size) for each file path
+    """
+    snapshot = {}
+    for root, _, files in os.walk(project_dir):
+        for f in files:
+            if os.path.splitext(f)[1] in exts:
+                path = os.path.join(root, f)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Deleted while we were looking
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+
+    return snapshot
+
+
+def watch(project_dir, run, interval=30):
+    """
+    Call run, and again every time an annotation file in the project is
+    saved, until interrupted.
+
+    parameters:
+        project_dir, str: path to the project
+        run, function: called with no arguments to update the report
+        interval, float: seconds between checks for changes
+    """
+    snapshot = get_snapshot(project_dir)
+    run()
+    print(f'\nWatching {project_dir} for changes, press Ctrl-C to stop...')
+    try:
+        while True:
+            time.sleep(interval)
+            current = get_snapshot(project_dir)
+            if current != snapshot:
+                snapshot = current
+                print(f'\nAnnotations changed at {time.strftime("%H:%M:%S")}, '
+                      'updating...')
+                run()
+    except KeyboardInterrupt:
+        print('\nStopped watching.')
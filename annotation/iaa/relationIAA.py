@@ -32,10 +32,23 @@ Author: Serena G. Lotreck
 """
 import argparse
 import os
+import sys
 
 import re
 import itertools
+import warnings
+import numpy as np
 import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                 '../abstract_scripts'))
+from brat_parser import read_ann
+from type_hierarchy import LEVELS, TypeHierarchy, read_annotation_conf
+from iaa_cache import IAACache, hash_file, watch
+from worker_pool import run_tasks, worker_args
 
 
 def get_iaa_stats(annotator_pairs_iaas, out_loc, prefix):
@@ -56,10 +69,6 @@ def get_iaa_stats(annotator_pairs_iaas, out_loc, prefix):
                 for outerKey, innerDict in annotator_pairs_iaas.items()
                 for innerKey, values in innerDict.items()}
     iaas_df = pd.DataFrame(reformed).T.rename({0: 'iaa'}, axis=1)
-    print('\n\n\n\n\n HELLO HELLO HELLO \n\n\n\n\n\n')
-    val_lens = [len(v) for v in annotator_pairs_iaas.values()]
-    print(f'input dict dimensions are {len(annotator_pairs_iaas.keys())} keys and for each key there are {set(val_lens)}')
-    print(iaas_df.index)
     # Get the per-document iaa
     per_doc = iaas_df.groupby(level=1).agg({'iaa': ['mean', 'std']})
 
@@ -80,6 +89,144 @@ def get_iaa_stats(annotator_pairs_iaas, out_loc, prefix):
     overall.to_csv(f'{out_loc}/{prefix}_overall.csv')
 
 
+def get_type_stats(pair_type_counts, out_loc, prefix, num_boot=1000,
+                   rng=None):
+    """
+    Calculate the F1 for each relation type, pooled over all annotator pairs
+    and documents, with bootstrap CIs from resampling documents.
+
+    parameters:
+        pair_type_counts, dict of dict: from get_pair_type_counts
+        out_loc, str: Path to save output
+        prefix, str: prefix for saved files
+        num_boot, int: number of bootstrap samples, 0 for no CIs
+        rng, numpy Generator or None: source of randomness, a new unseeded
+            generator is used if None
+
+    returns:
+        type_df, df: a, b, c, F1 and CI bounds for each type and overall
+
+    Prints the per-type table and saves it as {prefix}_per_type.csv
+    """
+    type_df = get_type_df(pair_type_counts, num_boot, rng)
+
+    # Print report
+    print('Per-Type Relation IAA:')
+    print(type_df)
+
+    # Save output
+    type_df.to_csv(f'{out_loc}/{prefix}_per_type.csv', index=False)
+
+    return type_df
+
+
+def get_level_stats(pair_level_counts, out_loc, prefix, num_boot=1000,
+                    rng=None):
+    """
+    Calculate the F1 for each relation type at every level of the type
+    hierarchy, as in get_type_stats.
+
+    parameters:
+        pair_level_counts, dict of dict: from get_pair_type_counts with a
+            hierarchy
+        out_loc, str: Path to save output
+        prefix, str: prefix for saved files
+        num_boot, int: number of bootstrap samples, 0 for no CIs
+        rng, numpy Generator or None: source of randomness, a new unseeded
+            generator is used if None
+
+    returns:
+        level_df, df: get_type_df for each level, with a level column
+
+    Prints the table and saves it as {prefix}_per_level.csv
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    level_dfs = []
+    for level in LEVELS:
+        level_df = get_type_df(select_level(pair_level_counts, level),
+                               num_boot, rng)
+        level_df.insert(0, 'level', level)
+        level_dfs.append(level_df)
+    level_df = pd.concat(level_dfs, ignore_index=True)
+
+    # Print report
+    print('Relation IAA by Hierarchy Level:')
+    print(level_df)
+
+    # Save output
+    level_df.to_csv(f'{out_loc}/{prefix}_per_level.csv', index=False)
+
+    return level_df
+
+
+def get_type_df(pair_type_counts, num_boot=1000, rng=None):
+    """
+    Helper for get_type_stats and get_level_stats.
+
+    The per-type counts of each document are added up over annotator pairs
+    into a (documents x types x counts) array, so each bootstrap sample's
+    totals are just a product of its document weights with that array.
+
+    parameters:
+        pair_type_counts, dict of dict: from get_pair_type_counts
+        num_boot, int: number of bootstrap samples, 0 for no CIs
+        rng, numpy Generator or None: source of randomness, a new unseeded
+            generator is used if None
+
+    returns:
+        type_df, df: a, b, c, F1 and CI bounds for each type and overall
+    """
+    rng = np.random.default_rng() if rng is None else rng
+
+    # Per-document counts, added up over annotator pairs
+    doc_idxs = {}
+    type_idxs = {}
+    rows = []
+    for docs in pair_type_counts.values():
+        for f, doc_counts in docs.items():
+            doc_idx = doc_idxs.setdefault(f, len(doc_idxs))
+            for rel_type, counts in doc_counts.items():
+                rows.append((doc_idx,
+                             type_idxs.setdefault(rel_type, len(type_idxs)),
+                             *counts))
+    rows = np.array(rows, dtype=np.int64).reshape(-1, 6)
+    types = sorted(type_idxs, key=type_idxs.get)
+    counts = np.zeros((len(doc_idxs), len(types) + 1, 4), dtype=np.int64)
+    np.add.at(counts, (rows[:, 0], rows[:, 1]), rows[:, 2:])
+    counts[:, -1] = counts[:, :-1].sum(axis=1)
+
+    def pooled_f1(totals):
+        a1, a2, n1, n2 = np.moveaxis(totals, -1, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(n1 + n2 > 0, (a1 + a2) / (n1 + n2), np.nan)
+
+    totals = counts.sum(axis=0)
+    type_df = pd.DataFrame({
+        'rel_type': types + ['overall'],
+        'a': (totals[:, 0] + totals[:, 1]) / 2,
+        'b': totals[:, 2] - totals[:, 0],
+        'c': totals[:, 3] - totals[:, 1],
+        'F1': pooled_f1(totals)
+    })
+
+    # Resample documents
+    if num_boot > 0 and len(doc_idxs) > 0:
+        num_docs = len(doc_idxs)
+        weights = rng.multinomial(num_docs,
+                                  np.full(num_docs, 1 / num_docs),
+                                  size=num_boot)
+        boot_totals = (weights @ counts.reshape(num_docs, -1)).reshape(
+            num_boot, -1, 4)
+        boot_f1 = pooled_f1(boot_totals)
+        with warnings.catch_warnings():
+            # Types that are missing from some samples
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            type_df['F1_CI_low'] = np.nanpercentile(boot_f1, 2.5, axis=0)
+            type_df['F1_CI_high'] = np.nanpercentile(boot_f1, 97.5, axis=0)
+
+    return type_df
+
+
 def calculate_f1(a, b, c):
     """
     Calculate balanced F1 score for a pair of docs.
@@ -98,77 +245,213 @@ def calculate_f1(a, b, c):
         return 1
 
 
-def compare_offsets(offsets_1, offsets_2):
+def get_arg_index(rels):
+    """
+    Build an interval index over the argument offsets of a list of relations.
+    Every offset of every argument is one interval, sorted by start, so the
+    intervals that could overlap a query are a prefix found by binary search.
+
+    parameters:
+        rels, list of namedtuple: relations with fields Type, Arg1 and Arg2,
+            as given by ann_df.itertuples()
+
+    returns:
+        arg_index, tuple of array: starts, ends, relation indices and
+            argument numbers (1 or 2) of the intervals, sorted by start
+    """
+    rows = []
+    for rel_idx, rel in enumerate(rels):
+        for arg_num, arg in ((1, rel.Arg1), (2, rel.Arg2)):
+            for start, end in arg[0]:
+                rows.append((int(start), int(end), rel_idx, arg_num))
+    rows = np.array(rows, dtype=np.int64).reshape(-1, 4)
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+
+    return rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3]
+
+
+def query_arg_index(arg_index, offsets):
     """
-    Helper for compare_relations. Determines if there is
-    a set of overlapping offsets for two entities.
+    Find the arguments in an index that overlap any of a list of offsets.
+    Two offsets overlap if either one starts between the start and end of
+    the other, inclusive of both ends.
 
     parameters:
-        offsets_1, list of tuple: offsets from first arg
-        offsets_2, list of tuple: offsets from second arg
+        arg_index, tuple of array: output of get_arg_index
+        offsets, list of tuple: (start, end) offsets of one argument
 
     returns:
-        True if the args overlap, False otherwise
+        hits, set of tuple: (relation index, argument number) of every
+            overlapping argument
     """
-    overlap = False
-    for offset_1 in offsets_1:
-        for offset_2 in offsets_2:
-            if ((int(offset_1[0]) <= int(offset_2[0]) <= int(offset_1[1])) or
-                (int(offset_2[0]) <= int(offset_1[0]) <= int(offset_2[1]))):
-                overlap = True
+    starts, ends, rel_idxs, arg_nums = arg_index
+    hits = set()
+    for start, end in offsets:
+        prefix = np.searchsorted(starts, int(end), 'right')
+        overlapping = ends[:prefix] >= int(start)
+        hits.update(
+            zip(rel_idxs[:prefix][overlapping].tolist(),
+                arg_nums[:prefix][overlapping].tolist()))
 
-    return overlap
+    return hits
 
 
-def compare_relations(rel_1, rel_2, symm=False, tolerance='STRICT'):
+def get_compatible_pairs(rels_1, rels_2, symm=False):
     """
-    Helper function for the two agreement_table functions.
+    Find every pair of relations from two annotators whose arguments overlap.
+    Without symmetry, Arg1 has to overlap Arg1 and Arg2 has to overlap Arg2;
+    with it, each argument can overlap either of the other relation's
+    arguments. An argument overlaps another if any of their offsets do, see
+    query_arg_index. Candidates come from an interval index over the second
+    annotator's arguments, so only relations that share an overlapping
+    argument are ever looked at. Types aren't compared; bucket the relations
+    by type first for STRICT tolerance.
 
     parameters:
-        rel_1, df row: first relation to compare
-        rel_2, df row: second relation to compare
+        rels_1, list of namedtuple: relations from the first annotator
+        rels_2, list of namedtuple: relations from the second annotator
         symm, bool: whether or not relation order matters, default False
-        tolerance, str: 'STRICT' or 'LOOSE', default 'STRICT'
 
     returns:
-        True if the relations are equivalent under the given
-            tolerance, False otherwise
+        pairs, list of tuple: (index in rels_1, index in rels_2) of every
+            compatible pair
     """
-    offset_match = False
-    # Compare offsets
-    arg1_ann1_offsets = rel_1.Arg1[0]
-    arg2_ann1_offsets = rel_1.Arg2[0]
-    arg1_ann2_offsets = rel_2.Arg1[0]
-    arg2_ann2_offsets = rel_2.Arg2[0]
+    if len(rels_1) == 0 or len(rels_2) == 0:
+        return []
+    arg_index = get_arg_index(rels_2)
+    pairs = []
+    for i, rel in enumerate(rels_1):
+        arg1_hits = query_arg_index(arg_index, rel.Arg1[0])
+        if len(arg1_hits) == 0:
+            continue
+        arg2_hits = query_arg_index(arg_index, rel.Arg2[0])
+
+        # Without symmetry each argument has to overlap the one in the same
+        # position, with it either argument can overlap either
+        if not symm:
+            matches = {j for j, arg_num in arg1_hits if arg_num == 1} & {
+                j for j, arg_num in arg2_hits if arg_num == 2
+            }
+        else:
+            matches = {j for j, _ in arg1_hits} & {j for j, _ in arg2_hits}
+        pairs.extend((i, j) for j in sorted(matches))
 
-    if not symm:
-        arg1_compare = compare_offsets(arg1_ann1_offsets, arg1_ann2_offsets)
-        arg2_compare = compare_offsets(arg2_ann1_offsets, arg2_ann2_offsets)
+    return pairs
 
-        if arg1_compare and arg2_compare:
-            offset_match = True
 
-    else:
-        arg1_compare1 = compare_offsets(arg1_ann1_offsets, arg1_ann2_offsets)
-        arg1_compare2 = compare_offsets(arg1_ann1_offsets, arg2_ann2_offsets)
-        arg2_compare2 = compare_offsets(arg2_ann1_offsets, arg2_ann2_offsets)
-        arg2_compare1 = compare_offsets(arg2_ann1_offsets, arg1_ann2_offsets)
-
-        if (arg1_compare1 or arg1_compare2) and (arg2_compare2
-                                                 or arg2_compare1):
-            offset_match = True
-
-    # If matching offsets and tolerance is STRICT, compare types
-    if offset_match and tolerance == 'STRICT':
-        if rel_1.Type == rel_2.Type:
-            return True
-    elif offset_match and tolerance == 'LOOSE':
-        return True
-    else:
-        return False
+def align_pairs(pairs, alignment='all'):
+    """
+    Choose which compatible pairs count as agreements.
+
+    With 'all', every pair counts, so a relation that overlaps several
+    others is counted several times. 'greedy' and 'optimal' only let each
+    relation be in one pair: 'greedy' takes pairs in order as long as
+    neither relation has been used, and 'optimal' finds a maximum matching.
+    The matching is solved separately for each connected component of the
+    compatibility graph, so its cost depends on how tangled the relations
+    are rather than on the size of the document.
 
+    parameters:
+        pairs, list of tuple: (index in rels_1, index in rels_2) of every
+            compatible pair, as returned by get_compatible_pairs
+        alignment, str: 'all', 'greedy' or 'optimal', default 'all'
 
-def get_loose_agreement_table(ann_df1, ann_df2):
+    returns:
+        aligned, list of tuple: the pairs that count as agreements
+    """
+    if alignment == 'all' or len(pairs) == 0:
+        return pairs
+
+    if alignment == 'greedy':
+        used_1, used_2 = set(), set()
+        aligned = []
+        for i, j in pairs:
+            if i not in used_1 and j not in used_2:
+                used_1.add(i)
+                used_2.add(j)
+                aligned.append((i, j))
+        return aligned
+
+    # Relabel both sides compactly, then put them in one graph with the
+    # second annotator's relations after the first's
+    pairs = np.array(pairs, dtype=np.int64)
+    nodes_1, rows = np.unique(pairs[:, 0], return_inverse=True)
+    nodes_2, cols = np.unique(pairs[:, 1], return_inverse=True)
+    num_1 = len(nodes_1)
+    num_nodes = num_1 + len(nodes_2)
+    graph = coo_matrix((np.ones(len(pairs)), (rows, cols + num_1)),
+                       shape=(num_nodes, num_nodes))
+    _, labels = connected_components(graph, directed=False)
+
+    aligned = []
+    edge_labels = labels[rows]
+    for label in np.unique(edge_labels):
+        comp_rows = rows[edge_labels == label]
+        comp_cols = cols[edge_labels == label]
+
+        # A single edge is its own matching
+        if len(comp_rows) == 1:
+            aligned.append((nodes_1[comp_rows[0]], nodes_2[comp_cols[0]]))
+            continue
+
+        # Otherwise maximize the number of edges used
+        row_ids, row_pos = np.unique(comp_rows, return_inverse=True)
+        col_ids, col_pos = np.unique(comp_cols, return_inverse=True)
+        cost = np.zeros((len(row_ids), len(col_ids)))
+        cost[row_pos, col_pos] = -1
+        match_rows, match_cols = linear_sum_assignment(cost)
+        for r, c in zip(match_rows, match_cols):
+            if cost[r, c] != 0:
+                aligned.append((nodes_1[row_ids[r]], nodes_2[col_ids[c]]))
+
+    return sorted((int(i), int(j)) for i, j in aligned)
+
+
+def get_aligned_pairs(rels_1, rels_2, symm_rels, tolerance='STRICT',
+                      alignment='all'):
+    """
+    Find the pairs of relations that count as agreements between two
+    documents.
+
+    parameters:
+        rels_1, list of namedtuple: relations from the first annotator
+        rels_2, list of namedtuple: relations from the second annotator
+        symm_rels, list of str: relations for which order doesn't matter,
+            only used for STRICT tolerance
+        tolerance, str: STRICT or LOOSE
+        alignment, str: how to count relations that match more than one
+            other relation, see align_pairs. Default is 'all'
+
+    returns:
+        aligned, list of tuple: (index in rels_1, index in rels_2) of the
+            agreeing pairs
+    """
+    # All relations are in one bucket, and order never matters
+    if tolerance == 'LOOSE':
+        pairs = get_compatible_pairs(rels_1, rels_2, symm=True)
+        return align_pairs(pairs, alignment)
+
+    # Only relations with the same type can match, so bucket by type
+    buckets_1 = {}
+    for i, rel in enumerate(rels_1):
+        buckets_1.setdefault(rel.Type, []).append(i)
+    buckets_2 = {}
+    for j, rel in enumerate(rels_2):
+        buckets_2.setdefault(rel.Type, []).append(j)
+
+    aligned = []
+    for rel_type, idxs_1 in buckets_1.items():
+        idxs_2 = buckets_2.get(rel_type, [])
+        pairs = get_compatible_pairs([rels_1[i] for i in idxs_1],
+                                     [rels_2[j] for j in idxs_2],
+                                     symm=rel_type in symm_rels)
+        aligned.extend((idxs_1[i], idxs_2[j])
+                       for i, j in align_pairs(pairs, alignment))
+
+    return aligned
+
+
+def get_loose_agreement_table(ann_df1, ann_df2, alignment='all'):
     """
     Get the values in the agreement table for two documents according to
     the loose tolerance.
@@ -176,36 +459,16 @@ def get_loose_agreement_table(ann_df1, ann_df2):
     parameters:
         ann_df1, df: df of .ann file for rater 1
         ann_df2, df: df of .ann file for rater 2
+        alignment, str: how to count relations that match more than one
+            other relation, see align_pairs. Default is 'all'
 
     returns:
         a, b, c: ints, the values from the agreement table
     """
-    a = 0
-    # Get combinations of indices to compare
-    with_id = list(
-        itertools.combinations(([f'{i}_df1' for i in ann_df1.index.tolist()] +
-                                [f'{i}_df2' for i in ann_df2.index.tolist()]),
-                               2))
-
-    # Only want to compare relations across dataframes, so eliminate ones
-    # with the same tag
-    to_compare = []
-    for i in with_id:
-        if i[0][-4:] != i[1][-4:]:
-            to_compare.append((int(i[0][:-4]), int(i[1][:-4])))
-
-    # Assumes that the first element in the tuple is always from df1, this
-    # appears to be the case upon observation
-    for rel_pair_idx in to_compare:
-
-        rel_1 = ann_df1.loc[rel_pair_idx[0], :]
-        rel_2 = ann_df2.loc[rel_pair_idx[1], :]
-
-        comparison = compare_relations(rel_1,
-                                       rel_2,
-                                       symm=True,
-                                       tolerance='LOOSE')
-        if comparison: a += 1
+    a = len(
+        get_aligned_pairs(list(ann_df1.itertuples()),
+                          list(ann_df2.itertuples()), [], 'LOOSE',
+                          alignment))
 
     # Get the remaining (different) relations in the two annotator dfs,
     # These are b and c
@@ -215,7 +478,7 @@ def get_loose_agreement_table(ann_df1, ann_df2):
     return a, b, c
 
 
-def get_strict_agreement_table(ann_df1, ann_df2, symm_rels):
+def get_strict_agreement_table(ann_df1, ann_df2, symm_rels, alignment='all'):
     """
     Get the values in the agreement table for two documents according to
     the strict tolerance.
@@ -224,49 +487,15 @@ def get_strict_agreement_table(ann_df1, ann_df2, symm_rels):
         ann_df1, df: df of .ann file for rater 1
         ann_df2, df: df of .ann file for rater 2
         symm_rels, list of str: relations for which order doesn't matter
+        alignment, str: how to count relations that match more than one
+            other relation, see align_pairs. Default is 'all'
     returns:
         a, b, c: ints, the values from the agreement table
     """
-    # Compare all relations with same type
-    rel_types = set(ann_df1.Type.values.tolist() +
-                    ann_df2.Type.values.tolist())
-    a = 0
-    for rel_type in rel_types:
-
-        # Determine if order matters for this relation type
-        if rel_type in symm_rels:
-            symm = True
-        else:
-            symm = False
-
-        # Subset dataframes by type
-        type_df1 = ann_df1.loc[ann_df1['Type'] == rel_type]
-        type_df2 = ann_df2.loc[ann_df2['Type'] == rel_type]
-
-        # Get combinations of indices to compare
-        with_id = list(
-            itertools.combinations(
-                ([f'{i}_df1' for i in type_df1.index.tolist()] +
-                 [f'{i}_df2' for i in type_df2.index.tolist()]), 2))
-
-        # Only want to compare relations across dataframes, so eliminate ones
-        # with the same tag
-        to_compare = []
-        for i in with_id:
-            if i[0][-4:] != i[1][-4:]:
-                to_compare.append((int(i[0][:-4]), int(i[1][:-4])))
-
-        # Assumes that the first element in the tuple is always from df1, this
-        # appears to be the case upon observation
-        for rel_pair_idx in to_compare:
-            rel_1 = type_df1.loc[rel_pair_idx[0], :]
-            rel_2 = type_df2.loc[rel_pair_idx[1], :]
-
-            comparison = compare_relations(rel_1,
-                                           rel_2,
-                                           symm=symm,
-                                           tolerance='STRICT')
-            if comparison: a += 1
+    a = len(
+        get_aligned_pairs(list(ann_df1.itertuples()),
+                          list(ann_df2.itertuples()), symm_rels, 'STRICT',
+                          alignment))
 
     # Get the remaining (different) relations in the two annotator dfs,
     # These are b and c
@@ -276,7 +505,131 @@ def get_strict_agreement_table(ann_df1, ann_df2, symm_rels):
     return a, b, c
 
 
-def calculate_iaa(ann_df1, ann_df2, symm_rels, tolerance='STRICT'):
+def get_type_agreement_table(ann_df1, ann_df2, symm_rels, tolerance='STRICT',
+                             alignment='all'):
+    """
+    Get agreement counts for each relation type in a pair of documents.
+
+    Each agreement is credited to the type of the relation on each side,
+    which for LOOSE tolerance can be two different types. So for each type
+    the counts are:
+
+        a1, int: agreements where annotator 1's relation has this type
+        a2, int: agreements where annotator 2's relation has this type
+        n1, int: relations of this type from annotator 1
+        n2, int: relations of this type from annotator 2
+
+    and the type's F1 is (a1 + a2) / (n1 + n2). Over all types, a1 and a2
+    are both a from the agreement table, so the counts add up to the
+    document's F1, and b and c are n1 - a1 and n2 - a2.
+
+    parameters:
+        ann_df1, df: df of .ann file for rater 1
+        ann_df2, df: df of .ann file for rater 2
+        symm_rels, list of str: relations for which order doesn't matter
+        tolerance, str: STRICT or LOOSE
+        alignment, str: see align_pairs
+
+    returns:
+        type_counts, dict of list: [a1, a2, n1, n2] for each relation type
+    """
+    rels_1 = list(ann_df1.itertuples())
+    rels_2 = list(ann_df2.itertuples())
+    type_counts = {}
+    for rel in rels_1:
+        type_counts.setdefault(rel.Type, [0, 0, 0, 0])[2] += 1
+    for rel in rels_2:
+        type_counts.setdefault(rel.Type, [0, 0, 0, 0])[3] += 1
+    for i, j in get_aligned_pairs(rels_1, rels_2, symm_rels, tolerance,
+                                  alignment):
+        type_counts[rels_1[i].Type][0] += 1
+        type_counts[rels_2[j].Type][1] += 1
+
+    return type_counts
+
+
+def get_level_agreement_table(ann_df1, ann_df2, symm_rels, hierarchy,
+                              alignment='all'):
+    """
+    Get agreement counts for each relation type in a pair of documents at
+    every level of the type hierarchy, with STRICT tolerance.
+
+    The compatible pairs of relations are found once, ignoring type and
+    direction, and then at each level a pair agrees if the ancestors of its
+    two types at that level are the same, looked up together in the
+    hierarchy's closure table. Direction has to match unless both
+    relations' own types are symmetric. At the leaf level this gives the
+    same counts as get_type_agreement_table.
+
+    parameters:
+        ann_df1, df: df of .ann file for rater 1
+        ann_df2, df: df of .ann file for rater 2
+        symm_rels, list of str: relations for which order doesn't matter
+        hierarchy, TypeHierarchy: relation type hierarchy
+        alignment, str: see align_pairs
+
+    returns:
+        level_counts, dict of dict: for each level of LEVELS, [a1, a2, n1,
+            n2] for each relation type at that level, as in
+            get_type_agreement_table
+    """
+    rels_1 = list(ann_df1.itertuples())
+    rels_2 = list(ann_df2.itertuples())
+    num_1 = len(rels_1)
+    rel_types = [rel.Type for rel in rels_1 + rels_2]
+    level_ids = hierarchy.get_level_ids(rel_types)
+    level_names = hierarchy.get_level_names(rel_types)
+    symm = np.array([rel_type in symm_rels for rel_type in rel_types],
+                    dtype=bool)
+
+    # Pairs that overlap in either direction, and which of them are in order
+    pairs = get_compatible_pairs(rels_1, rels_2, symm=True)
+    in_order = set(get_compatible_pairs(rels_1, rels_2, symm=False))
+    pair_idxs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    idxs_1 = pair_idxs[:, 0]
+    idxs_2 = pair_idxs[:, 1] + num_1
+    direction_ok = np.array([pair in in_order for pair in pairs],
+                            dtype=bool) | (symm[idxs_1] & symm[idxs_2])
+    agree = (level_ids[:, idxs_1] == level_ids[:, idxs_2]) & direction_ok
+
+    level_counts = {}
+    for level, level_agree in zip(LEVELS, agree):
+        names = level_names[level]
+        type_counts = {}
+        for name in names[:num_1]:
+            type_counts.setdefault(name, [0, 0, 0, 0])[2] += 1
+        for name in names[num_1:]:
+            type_counts.setdefault(name, [0, 0, 0, 0])[3] += 1
+        level_pairs = [pairs[k] for k in np.flatnonzero(level_agree)]
+        for i, j in align_pairs(level_pairs, alignment):
+            type_counts[names[i]][0] += 1
+            type_counts[names[num_1 + j]][1] += 1
+        level_counts[level] = type_counts
+
+    return level_counts
+
+
+def get_type_f1(type_counts):
+    """
+    Get the F1 for a document from its per-type agreement counts, the same
+    as calculate_f1 on its agreement table.
+
+    parameters:
+        type_counts, dict of list: from get_type_agreement_table
+
+    returns:
+        f1, float: balanced F1 score, 1 if neither document has relations
+    """
+    a1, a2, n1, n2 = (sum(counts[i] for counts in type_counts.values())
+                      for i in range(4))
+    if n1 + n2 != 0:
+        return (a1 + a2) / (n1 + n2)
+    else:
+        return 1
+
+
+def calculate_iaa(ann_df1, ann_df2, symm_rels, tolerance='STRICT',
+                  alignment='all', verbose=True):
     """
     Calculate IAA for a pair of documents. The default tolerance for the
     calculation is STRICT, where entities must have the same span boundaries
@@ -289,180 +642,291 @@ def calculate_iaa(ann_df1, ann_df2, symm_rels, tolerance='STRICT'):
         symm_rels, list of str: list of relation types for which order doesn't matter.
         tolerance, str: tolerance with which to calculate IAA. Options are
             STRICT, SEMI-STRICT, RELATION-LOOSE, ENTITY-LOOSE
+        alignment, str: 'all', 'greedy' or 'optimal', see align_pairs
+        verbose, bool: whether to print progress
     """
-    print('\nCalculating IAA for document pair...')
+    if verbose:
+        print('\nCalculating IAA for document pair...')
     # Get agreement values
     if tolerance == 'STRICT':
-        a, b, c = get_strict_agreement_table(ann_df1, ann_df2, symm_rels)
+        a, b, c = get_strict_agreement_table(ann_df1, ann_df2, symm_rels,
+                                             alignment)
     elif tolerance == 'LOOSE':
-        a, b, c = get_loose_agreement_table(ann_df1, ann_df2)
+        a, b, c = get_loose_agreement_table(ann_df1, ann_df2, alignment)
 
     # Calculate F1
     return calculate_f1(a, b, c)
 
 
-def get_offsets(ent_str, offsets):
+def make_ann_df(ann, verbose=True):
     """
-    Helper for format_relation.
-
-    Recursive function that gets all character offsets for a given entity,
-    accounting for the fact that there may be multiple character offsets for
-    a given entity, separated by semicolons.
-
-    parameters:
-        ent_str, str: string with character offsets, where first character is
-            the start of the first offset (e.g. no tab or space beginning)
-        offsets, list: list of two-tuples, where each tuple is
-            (start_offset, end_offset). On the first call this will be empty.
-
-    returns:
-        offsets, list of two-tuples: list of (start_offset, end_offset)
-    """
-    # Base case
-    if ';' not in ent_str:
-        start_offset = ent_str[:ent_str.index(' ')]
-        end_offset = ent_str[ent_str.index(' ') + 1:ent_str.index('\t')]
-        offsets.append((start_offset, end_offset))
-        return offsets
-    # Recursive case
-    else:
-        start_offset = ent_str[:ent_str.index(' ')]
-        end_offset = ent_str[ent_str.index(' ') + 1:ent_str.index(';')]
-        offsets.append((start_offset, end_offset))
-        return get_offsets(ent_str[ent_str.index(';') + 1:], offsets)
+    Converts a brat standoff formatted .ann  file into a dataframe of the form:
 
+    |  Type  |  Arg1  |  Arg2  |
 
-def format_relation(entry, line_dict):
-    """
-    Helper for make_ann_df.
+    where Arg1 and Arg2 are entities of the form
+        ([(start_offset, end_offset), ...], TYPE)
+    The list of tuples is to account for the fact that some entities
+    may have multiple start and end offsets if the annotator labeled
+    the same exact span multiple times in the same document.
 
     parameters:
-        entry, str: the relation line from the .ann file, starting with the
-            first tab character
-        line_dict, dict: keys are ID's from the .ann file, values are the
-            lines starting with the first tab character
+        ann, str: path to .ann file to convert
+        verbose, bool: whether to print progress and a snapshot of the df
 
     returns:
-        relation, list: relation with components as list elements
-
-    I'm sorry world for writing such an ugly function >.<
+        ann_df, df: dataframe version of the .ann file
     """
-    relation = []
+    if verbose:
+        print('\nMaking annotator dataframe...')
 
-    # Get index of first space, this is the end of the type
-    type_end_idx = entry.index(' ')
+    # Read in file
+    brat_ann = read_ann(ann)
 
-    # Put type in relation list
-    relation.append(entry[:type_end_idx].strip())
+    # Format relations for df, looking their arguments up by ID
+    df_lines = []
+    for rel in brat_ann.relations.values():
+        relation = [rel.type]
+        for arg_id in (rel.arg1, rel.arg2):
+            ent = brat_ann.entities[arg_id]
+            offsets = [(str(start), str(end)) for start, end in ent.offsets]
+            relation.append((offsets, ent.type))
+        df_lines.append(relation)
 
-    # Look for first argument in dict
-    arg1_start_idx = type_end_idx + 6
-    arg1_end_idx = entry.index(' ', type_end_idx + 1)
-    arg1_id = entry[arg1_start_idx:arg1_end_idx]
-    arg1_entry = line_dict[arg1_id]
+    # Make dataframe
+    ann_df = pd.DataFrame(df_lines, columns=['Type', 'Arg1', 'Arg2'])
+
+    if verbose:
+        print(f'Snapshot of annotator df: \n{ann_df.head()}')
+    return ann_df
 
-    # Look for second argument in dict
-    arg2_start_idx = arg1_end_idx + 6
-    arg2_id = entry[arg2_start_idx:].strip()
-    arg2_entry = line_dict[arg2_id]
 
-    # Format args
-    for arg_entry in (arg1_entry, arg2_entry):
+def get_annotator_docs(annotator_paths, iaa_dir_name):
+    """
+    Get the .ann files each annotator has in their iaa_dir.
 
-        # Get type
-        first_space = arg_entry.index(' ')
-        ent_type = arg_entry[:first_space].strip()
+    parameters:
+        annotator_paths, list of str: paths to annotator directories
+        iaa_dir_name, str: name of the iaa_dir
 
-        # Drop all characters from string before the first offset
-        offsets_str = arg_entry[first_space + 1:]
+    returns:
+        annotator_docs, dict of set: .ann file names for each annotator
+    """
+    annotator_docs = {}
+    for annotator in annotator_paths:
+        ann_path = os.path.join(annotator, iaa_dir_name)
+        annotator_docs[annotator] = {
+            f
+            for f in os.listdir(ann_path)
+            if f[-4:] == '.ann' and os.path.isfile(os.path.join(ann_path, f))
+        }
 
-        # Get entity offsets
-        offsets = []
-        offsets = get_offsets(offsets_str, offsets)
+    return annotator_docs
 
-        # Make tuple and add to relation entry
-        relation.append((offsets, ent_type))
 
-    return relation
+def parse_doc_worker(task):
+    """
+    Pool worker that parses one annotator's copy of a document.
 
+    parameters:
+        task, tuple of str: annotator path and .ann file name
 
-def make_ann_df(ann):
+    returns:
+        ann_df, df: dataframe version of the .ann file
     """
-    Converts a brat standoff formatted .ann  file into a dataframe of the form:
+    annotator, f = task
+    return make_ann_df(f'{annotator}/{worker_args["iaa_dir_name"]}/{f}',
+                       verbose=False)
 
-    |  Type  |  Arg1  |  Arg2  |
 
-    where Arg1 and Arg2 are entities of the form
-        ([(start_offset, end_offset), ...], TYPE)
-    The list of tuples is to account for the fact that some entities
-    may have multiple start and end offsets if the annotator labeled
-    the same exact span multiple times in the same document.
+def compare_doc_worker(task):
+    """
+    Pool worker that gets the per-type agreement counts for one pair of
+    annotators on one document, using the parsed documents in worker_args.
 
     parameters:
-        ann, str: path to .ann file to convert
+        task, tuple: (annotator 1, annotator 2) and .ann file name
 
     returns:
-        ann_df, df: dataframe version of the .ann file
+        type_counts, dict of list: see get_type_agreement_table, or dict of
+            dict from get_level_agreement_table if there's a hierarchy
+    """
+    (annotator1, annotator2), f = task
+    ann_dfs = worker_args['ann_dfs']
+    if worker_args['hierarchy'] is not None:
+        return get_level_agreement_table(ann_dfs[(annotator1, f)],
+                                         ann_dfs[(annotator2, f)],
+                                         worker_args['symm_rels'],
+                                         worker_args['hierarchy'],
+                                         alignment=worker_args['alignment'])
+    return get_type_agreement_table(ann_dfs[(annotator1, f)],
+                                    ann_dfs[(annotator2, f)],
+                                    worker_args['symm_rels'],
+                                    tolerance=worker_args['tolerance'],
+                                    alignment=worker_args['alignment'])
+
+
+def get_pair_type_counts(annotator_paths,
+                         iaa_dir_name,
+                         symm_rels,
+                         tolerance,
+                         alignment='all',
+                         workers=1,
+                         iaa_cache=None,
+                         hierarchy=None):
     """
-    print('\nMaking annotator dataframe...')
+    Get the per-type agreement counts for every pair of annotators on every
+    document they have in common. Each annotator's copy of a document is
+    only parsed once,
+    no matter how many pairs it's in, and the parsing and the comparisons
+    are both spread over a pool of workers. With an IAA cache, only the
+    comparisons whose .ann files or settings have changed since they were
+    stored are done again, and only the documents they need are parsed.
 
-    # Read in file
-    with open(ann) as myf:
-        file_lines = myf.readlines()
+    parameters:
+        annotator_paths, list of str: paths to annotator directories
+        iaa_dir_name, str: name of the iaa_dir
+        symm_rels, list of str: relation types for which order doesn't matter
+        tolerance, str: STRICT or LOOSE
+        alignment, str: 'all', 'greedy' or 'optimal', see align_pairs
+        workers, int: number of processes to use
+        iaa_cache, IAACache: stored results to reuse and add to, or None
+        hierarchy, TypeHierarchy or None: relation type hierarchy. If given,
+            documents are compared with get_level_agreement_table, which
+            only uses STRICT tolerance.
 
-    # Make a dict where the ID (T1, R2, etc) are keys and the rest of the line
-    # minus the leading \t are values
-    line_dict = {}
-    for line in file_lines:
-        # Get the index of the tab character
-        ID_end_idx = line.index('\t')
-        line_dict[line[:ID_end_idx]] = line[ID_end_idx:]
+    returns:
+        pair_type_counts, dict of dict: key is annotator pair, value is a
+            dict where key is document name and value is the output of
+            get_type_agreement_table for that document, or of
+            get_level_agreement_table if hierarchy is given
+    """
+    annotator_docs = get_annotator_docs(annotator_paths, iaa_dir_name)
+    pair_docs = {
+        pair: sorted(annotator_docs[pair[0]] & annotator_docs[pair[1]])
+        for pair in itertools.combinations(annotator_paths, 2)
+    }
+    compare_tasks = [(pair, f) for pair, docs in pair_docs.items()
+                     for f in docs]
+
+    # Look up stored results
+    type_counts = {}
+    cache_keys = {}
+    if iaa_cache is not None:
+        settings = {
+            'script': 'relationIAA',
+            'result': 'type_counts',
+            'tolerance': tolerance,
+            'alignment': alignment,
+            'symm_rels': sorted(symm_rels)
+        }
+        if hierarchy is not None:
+            settings['result'] = 'level_counts'
+            settings['hierarchy'] = [hierarchy.names,
+                                     hierarchy.parents.tolist()]
+        ann_hashes = {(annotator, f):
+                      hash_file(f'{annotator}/{iaa_dir_name}/{f}')
+                      for pair, f in compare_tasks for annotator in pair}
+        for pair, f in compare_tasks:
+            key = iaa_cache.make_key(
+                settings, [ann_hashes[(pair[0], f)], ann_hashes[(pair[1], f)]])
+            cache_keys[(pair, f)] = key
+            stored = iaa_cache.get(key)
+            if stored is not None:
+                type_counts[(pair, f)] = stored
+    compare_tasks = [
+        task for task in compare_tasks if task not in type_counts
+    ]
 
-    # Format relations for df
-    df_lines = []
-    for ID, entry in line_dict.items():
-        if ID[0] == 'R':
+    # Parse every document that's in at least one comparison
+    parse_tasks = sorted({(annotator, f)
+                          for pair, f in compare_tasks for annotator in pair})
+    print(f'\nParsing {len(parse_tasks)} annotated documents...')
+    ann_dfs = dict(
+        zip(parse_tasks,
+            run_tasks(parse_doc_worker, parse_tasks, workers,
+                      {'iaa_dir_name': iaa_dir_name})))
+
+    # Compare every pair on every document they share
+    print(f'\nCalculating IAA for {len(compare_tasks)} document pairs from '
+          f'{len(pair_docs)} annotator pairs...')
+    new_counts = run_tasks(
+        compare_doc_worker, compare_tasks, workers, {
+            'ann_dfs': ann_dfs,
+            'symm_rels': symm_rels,
+            'tolerance': tolerance,
+            'alignment': alignment,
+            'hierarchy': hierarchy
+        })
+    for task, doc_counts in zip(compare_tasks, new_counts):
+        type_counts[task] = doc_counts
+        if iaa_cache is not None:
+            iaa_cache.set(cache_keys[task], doc_counts)
+
+    return {
+        pair: {f: type_counts[(pair, f)]
+               for f in docs}
+        for pair, docs in pair_docs.items()
+    }
+
+
+def get_pair_iaas(annotator_paths, iaa_dir_name, symm_rels, tolerance,
+                  alignment='all', workers=1, iaa_cache=None):
+    """
+    Calculate the IAA for every pair of annotators on every document they
+    have in common. See get_pair_type_counts for the parameters.
 
-            # Format relation
-            relation = format_relation(entry, line_dict)
+    returns:
+        annotator_pairs_iaas, dict of dict: the input for get_iaa_stats
+    """
+    pair_type_counts = get_pair_type_counts(annotator_paths, iaa_dir_name,
+                                            symm_rels, tolerance, alignment,
+                                            workers, iaa_cache)
 
-            # Add relation to overall list
-            df_lines.append(relation)
+    return get_iaas_from_type_counts(pair_type_counts)
 
-    # Make dataframe
-    ann_df = pd.DataFrame(df_lines, columns=['Type', 'Arg1', 'Arg2'])
 
-    print(f'Snapshot of annotator df: \n{ann_df.head()}')
-    return ann_df
+def select_level(pair_level_counts, level):
+    """
+    Get the per-type agreement counts at one level of the type hierarchy.
 
+    parameters:
+        pair_level_counts, dict of dict: from get_pair_type_counts with a
+            hierarchy
+        level, str: one of LEVELS
 
-def get_overlapping_docs(annotator1, annotator2, iaa_dir_name):
-    """
-    Get the file names for the files that the two annotators have done in common,
-    that are found in the iaa_dir_name directory.
+    returns:
+        pair_type_counts, dict of dict: as from get_pair_type_counts without
+            a hierarchy
     """
-    from os.path import isfile, join
+    return {
+        pair: {f: doc_counts[level]
+               for f, doc_counts in docs.items()}
+        for pair, docs in pair_level_counts.items()
+    }
 
-    # Get full paths to docs
-    ann1_path = join(annotator1, iaa_dir_name)
-    ann2_path = join(annotator2, iaa_dir_name)
 
-    ann1_files = [
-        f for f in os.listdir(ann1_path) if isfile(join(ann1_path, f))
-    ]
-    ann2_files = [
-        f for f in os.listdir(ann2_path) if isfile(join(ann2_path, f))
-    ]
+def get_iaas_from_type_counts(pair_type_counts):
+    """
+    Get the F1 for every pair of annotators on every document from their
+    per-type agreement counts.
 
-    files_in_common = [
-        f for f in ann1_files if f in ann2_files if f[-4:] == '.ann'
-    ]
+    parameters:
+        pair_type_counts, dict of dict: from get_pair_type_counts
 
-    return files_in_common
+    returns:
+        annotator_pairs_iaas, dict of dict: the input for get_iaa_stats
+    """
+    return {
+        pair: {f: [get_type_f1(doc_counts)]
+               for f, doc_counts in docs.items()}
+        for pair, docs in pair_type_counts.items()
+    }
 
 
 def main(project_root, iaa_dir_name, annotation_conf, tolerance, out_loc,
-         prefix):
+         prefix, alignment='all', workers=1, cache_file=None,
+         watch_interval=None, num_boot=1000, levels=False):
 
     # Get annotators
     print('\nSearching for annotators...')
@@ -470,10 +934,6 @@ def main(project_root, iaa_dir_name, annotation_conf, tolerance, out_loc,
             if f.is_dir() and iaa_dir_name in os.listdir(f)]
     print(f'Annotator directories are: {annotator_paths}')
 
-    # Get all combinations of pairs
-    print('\nGetting all combinations of annotators..')
-    annotator_pairs = itertools.combinations(annotator_paths, 2)
-
     # Read annotation_conf to look for symmetric relations
     print('\nSearching for symmetric relations in annotation.conf...')
     with open(annotation_conf) as myf:
@@ -491,37 +951,47 @@ def main(project_root, iaa_dir_name, annotation_conf, tolerance, out_loc,
     print(
         f'Found {len(symm_rels)} symmetric relations. They are:\n{symm_rels}')
 
-    # Get IAA for each pair of annotators
-    print('\nCalculating IAA for all annotator pairs...')
-    annotator_pairs_iaas = {}
-    for pair in annotator_pairs:
-        print(f'\nCalculating IAA for pair {pair}')
-        # Get overlapping docs for the annotators
-        print('\nGetting overlapping documents between annotators...')
-        files_in_common = get_overlapping_docs(pair[0], pair[1], iaa_dir_name)
-        print(f'Files in common are: {files_in_common}')
-
-        # Get IAA for files
-        iaas = {}
-        for f in files_in_common:
-            print(f)
-            # Get df for each one
-            ann_df1 = make_ann_df(f'{pair[0]}/{iaa_dir_name}/{f}')
-            ann_df2 = make_ann_df(f'{pair[1]}/{iaa_dir_name}/{f}')
-
-            # Calculate f1 for this doc pair
-            iaa = calculate_iaa(ann_df1,
-                                ann_df2,
-                                symm_rels,
-                                tolerance=tolerance)
-            iaas[f] = [iaa]
-
-        # Put the pairs' per-doc scores in the dict
-        annotator_pairs_iaas[pair] = iaas
-
-    # Calculate statistics
-    print('\nCalculating overall statistics...')
-    get_iaa_stats(annotator_pairs_iaas, out_loc, prefix)
+    # Types are only compared with STRICT tolerance, so only then do the
+    # levels of the hierarchy give different scores
+    hierarchy = None
+    if levels:
+        if tolerance == 'STRICT':
+            hierarchy = read_annotation_conf(annotation_conf).get(
+                'relations', TypeHierarchy([], []))
+        else:
+            print('\nRelation types aren\'t compared with LOOSE tolerance, '
+                  'so scores are the same at every level of the hierarchy. '
+                  'Skipping the per-level report.')
+
+    iaa_cache = IAACache(cache_file) if cache_file is not None else None
+
+    def run():
+        # Get per-type agreement for each pair of annotators, at every level
+        # of the hierarchy if requested
+        pair_type_counts = get_pair_type_counts(annotator_paths,
+                                                iaa_dir_name, symm_rels,
+                                                tolerance, alignment, workers,
+                                                iaa_cache, hierarchy)
+        if iaa_cache is not None:
+            iaa_cache.save()
+        if hierarchy is not None:
+            pair_level_counts = pair_type_counts
+            pair_type_counts = select_level(pair_level_counts, 'leaf')
+
+        # Calculate statistics
+        print('\nCalculating overall statistics...')
+        get_iaa_stats(get_iaas_from_type_counts(pair_type_counts), out_loc,
+                      prefix)
+        print('-----------------------------------------')
+        get_type_stats(pair_type_counts, out_loc, prefix, num_boot)
+        if hierarchy is not None:
+            print('-----------------------------------------')
+            get_level_stats(pair_level_counts, out_loc, prefix, num_boot)
+
+    if watch_interval is not None:
+        watch(project_root, run, watch_interval)
+    else:
+        run()
 
     print('\nDone!')
 
@@ -550,12 +1020,58 @@ if __name__ == '__main__':
         'STRICT, LOOSE')
     parser.add_argument('out_loc', type=str, help='Path to save the output')
     parser.add_argument('prefix', type=str, help='Prefix for saved files')
+    parser.add_argument(
+        '-alignment',
+        type=str,
+        choices=['all', 'greedy', 'optimal'],
+        help='How to count relations that match more than one relation from '
+        'the other annotator. "all" counts every matching pair, so b and c '
+        'can go negative; "greedy" and "optimal" only let each relation '
+        'match once, with "optimal" finding the largest possible set of '
+        'one-to-one matches. Default is all.',
+        default='all')
+    parser.add_argument(
+        '-workers',
+        type=int,
+        help='Number of processes to use for parsing and comparing '
+        'documents. Default is 1.',
+        default=1)
+    parser.add_argument(
+        '-cache_file',
+        type=str,
+        help='JSON file to store per-document results in. Reruns with the '
+        'same file only recompare documents whose annotations changed.',
+        default=None)
+    parser.add_argument(
+        '-watch',
+        type=float,
+        help='Keep running, and update the output whenever an annotation '
+        'file changes, checking every this many seconds. Best used with '
+        '-cache_file.',
+        default=None)
+    parser.add_argument(
+        '-num_boot',
+        type=int,
+        help='Number of bootstrap samples of documents to take for the CIs '
+        'of the per-type F1 scores, 0 for no CIs. Default is 1000.',
+        default=1000)
+    parser.add_argument(
+        '--levels',
+        action='store_true',
+        help='Also calculate the per-type F1 with relation types compared at '
+        'each level of the type hierarchy in annotation_conf (leaf, parent '
+        'and root), and save it as {prefix}_per_level.csv. Only used with '
+        'STRICT tolerance.')
 
     args = parser.parse_args()
 
     args.project_root = os.path.abspath(args.project_root)
     args.annotation_conf = os.path.abspath(args.annotation_conf)
     args.out_loc = os.path.abspath(args.out_loc)
+    if args.cache_file is not None:
+        args.cache_file = os.path.abspath(args.cache_file)
 
     main(args.project_root, args.iaa_dir_name, args.annotation_conf,
-         args.tolerance, args.out_loc, args.prefix)
+         args.tolerance, args.out_loc, args.prefix, args.alignment,
+         args.workers, args.cache_file, args.watch, args.num_boot,
+         args.levels)
@@ -11,24 +11,198 @@ annotations with all of them in sight.
 
 Annotations that are exactly the same (same start, end, type and text for
 entities, type and args for relations) will be reduced to one annotation.
+Duplicates are found by looking up a canonical key for each annotation in a
+set, so it doesn't matter how the annotators numbered them. Unified IDs count
+every annotation read in, including duplicates, so they show which annotator
+each annotation came from in the order the annotators were read.
+
+When unifying relations, the entities of all annotators are unified first,
+and the arguments of each annotator's relations are remapped from that
+annotator's entity IDs to the unified ones. Relations between the same
+entities in different annotators' files are therefore recognized as the same
+even if the annotators' entity IDs differ.
+
+With --group_overlaps, entities are written in groups of overlapping spans
+(from any annotator), ordered by where each group starts, so that competing
+versions of the same mention are next to each other.
 
 Makes a new directory within out_loc of f'{iaa_dir_name}_unified' for the
 new unity annotation.
 
 NOTE: Given that the workflow of this project involves unifying entity
 annotations before returning them to annotators to be marked up with
-relations, this script is designed to only unify one type of annotation
-at a time, while ignoring anything that is not that kind of annotation.
-
-TODO: Write the relation unification code
+relations, "ent" mode writes only the unified entities and ignores any
+relations. "rel" mode writes the unified entities of all annotators as well
+as the unified relations, since the relations need their arguments in the
+same file.
 
 Author: Serena G. Lotreck
 """
 import argparse
 from os import scandir, listdir, mkdir
-from os.path import abspath, splitext
+from os.path import abspath, dirname, exists, join, splitext
 import shutil
-import pdb
+import sys
+
+import numpy as np
+sys.path.append(join(dirname(abspath(__file__)), '../abstract_scripts'))
+from brat_parser import read_ann, format_ann_line
+from worker_pool import run_tasks, worker_args
+
+
+def get_ent_key(ent):
+    """
+    Get the canonical key of an entity, everything but its ID.
+
+    parameters:
+        ent, Entity: entity record
+
+    returns:
+        key, tuple: (type, offsets, text)
+    """
+    return (ent.type, ent.offsets, ent.text)
+
+
+def unify_entities(brat_anns):
+    """
+    Unify the entities of several annotators' copies of a document.
+
+    parameters:
+        brat_anns, list of BratAnn: one per annotator, in order
+
+    returns:
+        ents, list of Entity: unique entities with their unified IDs
+        id_maps, list of dict: for each annotator, the unified ID of each of
+            their entity IDs
+    """
+    ents = []
+    unified_ids = {}
+    id_maps = []
+    ent_num = 0
+    for brat_ann in brat_anns:
+        id_map = {}
+        for ent in brat_ann.entities.values():
+            ent_num += 1
+            key = get_ent_key(ent)
+            if key not in unified_ids:
+                unified_ids[key] = f'T{ent_num}'
+                ents.append(ent._replace(id=unified_ids[key]))
+            id_map[ent.id] = unified_ids[key]
+        id_maps.append(id_map)
+
+    return ents, id_maps
+
+
+def unify_relations(brat_anns, id_maps):
+    """
+    Unify the relations of several annotators' copies of a document, after
+    remapping their arguments to unified entity IDs.
+
+    parameters:
+        brat_anns, list of BratAnn: one per annotator, in order
+        id_maps, list of dict: from unify_entities
+
+    returns:
+        rels, list of Relation: unique relations with their unified IDs
+    """
+    rels = []
+    seen = set()
+    rel_num = 0
+    for brat_ann, id_map in zip(brat_anns, id_maps):
+        for rel in brat_ann.relations.values():
+            rel_num += 1
+            args = tuple(
+                (role, id_map.get(arg_id, arg_id)) for role, arg_id in rel.args)
+            key = (rel.type, args)
+            if key in seen:
+                continue
+            seen.add(key)
+            rels.append(rel._replace(id=f'R{rel_num}', args=args))
+
+    return rels
+
+
+def group_overlaps(ents):
+    """
+    Order entities so that overlapping ones are next to each other.
+
+    Entities are sorted by where they start, and a sweep over them starts a
+    new group whenever an entity starts at or after the furthest end seen so
+    far in the current group. Discontinuous entities are treated as covering
+    everything from their first start to their last end.
+
+    parameters:
+        ents, list of Entity: entities to order
+
+    returns:
+        grouped, list of Entity: the same entities, grouped and in order of
+            where each group starts, keeping the original order of the
+            entities in each group
+    """
+    if len(ents) == 0:
+        return []
+    starts = np.array([min(s for s, _ in ent.offsets) for ent in ents])
+    ends = np.array([max(e for _, e in ent.offsets) for ent in ents])
+    order = np.argsort(starts, kind='stable')
+
+    # A group ends where no earlier entity reaches past the next start
+    reach = np.maximum.accumulate(ends[order])
+    new_group = np.ones(len(ents), dtype=bool)
+    new_group[1:] = starts[order][1:] >= reach[:-1]
+    groups = np.empty(len(ents), dtype=np.int64)
+    groups[order] = np.cumsum(new_group)
+
+    grouped = np.lexsort((np.arange(len(ents)), groups))
+    return [ents[i] for i in grouped]
+
+
+def unify_doc(brat_anns, unify_type, group=False):
+    """
+    Unify the annotations of several annotators' copies of a document.
+
+    parameters:
+        brat_anns, list of BratAnn: one per annotator, in order
+        unify_type, str: "ent" or "rel"
+        group, bool: whether to group overlapping entities, see
+            group_overlaps
+
+    returns:
+        records, list of namedtuple: unified entities, followed by unified
+            relations if unify_type is "rel"
+    """
+    ents, id_maps = unify_entities(brat_anns)
+    if group:
+        ents = group_overlaps(ents)
+    if unify_type == 'rel':
+        return ents + unify_relations(brat_anns, id_maps)
+    return ents
+
+
+def unify_file(f, annotator_paths, iaa_dir_name, out_path, unify_type,
+               group=False):
+    """
+    Unify and write the annotations for one document. Annotators that don't
+    have a .ann file for the document are skipped.
+
+    parameters:
+        f, str: name of the document's .txt file
+        annotator_paths, list of str: paths for each annotator
+        iaa_dir_name, str: name of the dire annotators have in common
+        out_path, str: where to save the unified files
+        unify_type, str: "ent" or "rel"
+        group, bool: whether to group overlapping entities
+    """
+    f_root = splitext(f)[0]
+    brat_anns = []
+    for annotator_path in annotator_paths:
+        ann_path = f'{annotator_path}/{iaa_dir_name}/{f_root}.ann'
+        if exists(ann_path):
+            brat_anns.append(read_ann(ann_path))
+
+    # Write each line as it's formatted instead of building the whole file
+    with open(f'{out_path}/{f_root}.ann', 'w') as myf:
+        for record in unify_doc(brat_anns, unify_type, group):
+            myf.write(format_ann_line(record) + '\n')
 
 
 def unify_ents(overlap, annotator_paths, iaa_dir_name, out_path):
@@ -44,46 +218,15 @@ def unify_ents(overlap, annotator_paths, iaa_dir_name, out_path):
         iaa_dir_name, str: name of the dire annotators have in common
         out_path, str: where to save the unified files
     """
-    # Make a .ann file for each .txt doc with all of the annotations
     for f in overlap:
-        ann_str = ''
-        ent_num = 0
-        for i, annotator_path in enumerate(annotator_paths):
-            f_root = splitext(f)[0]
-            with open(f'{annotator_path}/{iaa_dir_name}/{f_root}.ann') as myf:
-                current_ann_lines = myf.readlines()
-            for line in current_ann_lines:
-                line_elts = line.split('\t')
-                if line_elts[0][0] == 'T':
-                    # Replace the entity number in the ID
-                    ent_num += 1
-                    line_elts[0] = f'T{ent_num}'
-                    line = '\t'.join(line_elts)
-                    # Check if this entity already exists in the same form
-                    form = '\t'.join(line_elts[1:]) # Ignore the ID
-                    if form in ann_str:
-                        continue
-                    else:
-                    # Make sure the previous one ended with a newline
-                        if ent_num > 1:
-                            try:
-                                assert ann_str[-1] == '\n'
-                            except AssertionError:
-                                ann_str += '\n'
-                        ann_str += line
-        with open(f'{out_path}/{f_root}.ann', 'w') as myf:
-            myf.write(ann_str)
+        unify_file(f, annotator_paths, iaa_dir_name, out_path, 'ent')
 
 
 def unify_rels(overlap, annotator_paths, iaa_dir_name, out_path):
     """
-    Function to unify relation annotations. Importantly, assumes that the Arg
-    numbers (the ID's of the entities) are the same across all documents. If
-    they aren't, semantically identical relations where the entities just have
-    different ID's will all appear in the final document. Copies entity
-    annotations over from the first annotator, so if entities are not the same
-    across all annotators, may result in relations pointing to non-existent
-    entities in the final documents.
+    Function to unify relation annotations. Entities are unified as in
+    unify_ents, and relation arguments are remapped to the unified entity
+    IDs, so the annotators' entity IDs don't need to match.
 
     parameters:
         overlap, set of str: a set of the files to unify
@@ -91,44 +234,20 @@ def unify_rels(overlap, annotator_paths, iaa_dir_name, out_path):
         iaa_dir_name, str: name of the dire annotators have in common
         out_path, str: where to save the unified files
     """
-    # Make a .ann file for each .txt doc with all of the annotations
     for f in overlap:
-        ann_str = ''
-        rel_num = 0
-        for i, annotator_path in enumerate(annotator_paths):
-            f_root = splitext(f)[0]
-            with open(f'{annotator_path}/{iaa_dir_name}/{f_root}.ann') as myf:
-                current_ann_lines = myf.readlines()
-            ent_str = ''
-            for line in current_ann_lines:
-                line_elts = line.split('\t')
-                if line_elts[0][0] == 'T':
-                    if i == 0:
-                        ent_str += line
-                elif line_elts[0][0] == 'R':
-                    # Replace the entity number in the ID
-                    rel_num += 1
-                    line_elts[0] = f'R{rel_num}'
-                    line = '\t'.join(line_elts)
-                    # Check if this relation already exists in the same form
-                    form = '\t'.join(line_elts[1:]) # Ignore the ID
-                    if form in ann_str:
-                        continue
-                    else:
-                    # Make sure the previous one ended with a newline
-                        if rel_num > 1:
-                            try:
-                                assert ann_str[-1] == '\n'
-                            except AssertionError:
-                                ann_str += '\n'
-                        ann_str += line
-            ann_str += ent_str
-
-        with open(f'{out_path}/{f_root}.ann', 'w') as myf:
-            myf.write(ann_str)
-
-
-def main(project_root, iaa_dir_name, unify_type, out_loc):
+        unify_file(f, annotator_paths, iaa_dir_name, out_path, 'rel')
+
+
+def unify_file_worker(f):
+    """
+    Pool worker for unify_file, reads everything but the file name from
+    worker_args.
+    """
+    unify_file(f, **worker_args)
+
+
+def main(project_root, iaa_dir_name, unify_type, out_loc, workers=1,
+         group=False):
 
     # Get paths to relevant folders
     annotator_paths = [f.path for f in scandir(project_root)
@@ -148,10 +267,13 @@ def main(project_root, iaa_dir_name, unify_type, out_loc):
         fullpath = f'{annotator_paths[0]}/{iaa_dir_name}/{f}'
         shutil.copy(fullpath, out_path)
 
-    if unify_type == "ent":
-        unify_ents(overlap, annotator_paths, iaa_dir_name, out_path)
-    else:
-        unify_rels(overlap, annotator_paths, iaa_dir_name, out_path)
+    run_tasks(unify_file_worker, sorted(overlap), workers, {
+        'annotator_paths': annotator_paths,
+        'iaa_dir_name': iaa_dir_name,
+        'out_path': out_path,
+        'unify_type': unify_type,
+        'group': group
+    })
 
 
 if __name__ == "__main__":
@@ -167,10 +289,17 @@ if __name__ == "__main__":
             'unified')
     parser.add_argument('out_loc', type=str,
             help='Path to save the new annotations')
+    parser.add_argument('-workers', type=int,
+            help='Number of processes to unify documents with. Default is 1.',
+            default=1)
+    parser.add_argument('--group_overlaps', action='store_true',
+            help='Write overlapping entities from all annotators next to '
+            'each other, in order of where they start')
 
     args = parser.parse_args()
 
     args.project_root = abspath(args.project_root)
     args.out_loc = abspath(args.out_loc)
 
-    main(args.project_root, args.iaa_dir_name, args.unify_type, args.out_loc)
+    main(args.project_root, args.iaa_dir_name, args.unify_type, args.out_loc,
+         args.workers, args.group_overlaps)
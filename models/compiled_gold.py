@@ -0,0 +1,263 @@
+"""
+Compile a dygiepp-formatted gold standard into a compact binary form that
+later evaluation runs can memory-map instead of parsing the jsonl again.
+
+A compiled gold standard is a directory containing:
+
+    meta.json           doc_keys, interned entity and relation types
+    ner_sents.npy       number of ner sentences in each doc
+    rel_sents.npy       number of relation sentences in each doc
+    ents.npy            int32 rows of (sent, start, end, type id)
+    ent_offsets.npy     row offsets of each doc in ents.npy
+    rels.npy            int32 rows of (sent, start1, end1, start2, end2,
+                        type id)
+    rel_offsets.npy     row offsets of each doc in rels.npy
+
+Entity types are stored lowercased, since entities are always compared
+case-insensitively. The directory name includes a hash of the gold standard
+file's contents, so editing the gold standard makes a new cache entry rather
+than reusing a stale one. Nothing in the cache depends on the evaluation
+options: type checking, symmetric relations and type maps are all applied
+when predictions are compared, so the same compiled gold standard serves
+every kind of run.
+
+Author: Serena G. Lotreck
+"""
+from collections.abc import Mapping
+import hashlib
+import json
+from os import makedirs, replace
+from os.path import basename, exists, join, splitext
+import shutil
+import tempfile
+import jsonlines
+import numpy as np
+
+# Bump when the layout of the compiled files changes
+CACHE_VERSION = 1
+
+
+def hash_file(path):
+    """
+    Get the sha256 hash of a file's contents.
+
+    parameters:
+        path, str: path to the file
+
+    returns:
+        digest, str: hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as myf:
+        for block in iter(lambda: myf.read(2**20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_cache_path(gold_std_file, cache_dir):
+    """
+    Get the directory that the compiled version of a gold standard is kept in.
+
+    parameters:
+        gold_std_file, str: path to the gold standard jsonl
+        cache_dir, str: directory where compiled gold standards are kept
+
+    returns:
+        cache_path, str: path to the compiled gold standard
+    """
+    name = splitext(basename(gold_std_file))[0]
+    file_hash = hash_file(gold_std_file)[:16]
+
+    return join(cache_dir, f'{name}_{file_hash}_v{CACHE_VERSION}')
+
+
+def compile_gold_standard(gold_std_file, out_path):
+    """
+    Compile a gold standard jsonl into the binary layout described at the top
+    of this module.
+
+    parameters:
+        gold_std_file, str: path to the gold standard jsonl
+        out_path, str: directory to write the compiled files to
+    """
+    doc_keys = []
+    ner_sents = []
+    rel_sents = []
+    ent_rows = []
+    ent_offsets = [0]
+    rel_rows = []
+    rel_offsets = [0]
+    ent_types = {}
+    rel_types = {}
+    with jsonlines.open(gold_std_file) as reader:
+        for doc in reader:
+            doc_keys.append(doc['doc_key'])
+            ner_sents.append(len(doc['ner']))
+            rel_sents.append(len(doc['relations']))
+            for sent_num, sent in enumerate(doc['ner']):
+                for ent in sent:
+                    ent_type = ent[2].lower()
+                    ent_types.setdefault(ent_type, len(ent_types))
+                    ent_rows.append(
+                        (sent_num, ent[0], ent[1], ent_types[ent_type]))
+            for sent_num, sent in enumerate(doc['relations']):
+                for rel in sent:
+                    rel_types.setdefault(rel[4], len(rel_types))
+                    rel_rows.append((sent_num, rel[0], rel[1], rel[2], rel[3],
+                                     rel_types[rel[4]]))
+            ent_offsets.append(len(ent_rows))
+            rel_offsets.append(len(rel_rows))
+
+    arrays = {
+        'ner_sents': np.array(ner_sents, dtype=np.int32),
+        'rel_sents': np.array(rel_sents, dtype=np.int32),
+        'ents': np.array(ent_rows, dtype=np.int32).reshape(-1, 4),
+        'ent_offsets': np.array(ent_offsets, dtype=np.int64),
+        'rels': np.array(rel_rows, dtype=np.int32).reshape(-1, 6),
+        'rel_offsets': np.array(rel_offsets, dtype=np.int64)
+    }
+    for name, arr in arrays.items():
+        np.save(join(out_path, f'{name}.npy'), arr)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'source': basename(gold_std_file),
+        'doc_keys': doc_keys,
+        'ent_types': sorted(ent_types, key=ent_types.get),
+        'rel_types': sorted(rel_types, key=rel_types.get)
+    }
+    with open(join(out_path, 'meta.json'), 'w') as myf:
+        json.dump(meta, myf)
+
+
+def load_compiled_gold(gold_std_file, cache_dir):
+    """
+    Load the compiled version of a gold standard, compiling it first if it
+    isn't in the cache yet.
+
+    parameters:
+        gold_std_file, str: path to the gold standard jsonl
+        cache_dir, str: directory where compiled gold standards are kept
+
+    returns:
+        gold, CompiledGold: memory-mapped gold standard
+    """
+    cache_path = get_cache_path(gold_std_file, cache_dir)
+    if not exists(cache_path):
+        # The entry is a directory, so it's compiled in a temporary one and
+        # renamed into place
+        makedirs(cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=cache_dir)
+        try:
+            compile_gold_standard(gold_std_file, tmp_path)
+            replace(tmp_path, cache_path)
+        except OSError:
+            # Another process got there first
+            if not exists(cache_path):
+                raise
+        finally:
+            if exists(tmp_path):
+                shutil.rmtree(tmp_path)
+
+    return CompiledGold(cache_path)
+
+
+class CompiledGold(Mapping):
+    """
+    Read-only, memory-mapped gold standard. Behaves like a dict of dygiepp
+    docs keyed by doc_key, building each doc's "ner" and "relations" from
+    the arrays when it's looked up; get_ent_arrays gives the entity rows of
+    many docs at once without building any lists.
+    """
+
+    def __init__(self, cache_path):
+        with open(join(cache_path, 'meta.json')) as myf:
+            meta = json.load(myf)
+        self.cache_path = cache_path
+        self.doc_keys = meta['doc_keys']
+        self.ent_types = meta['ent_types']
+        self.rel_types = meta['rel_types']
+        self.doc_idxs = {key: i for i, key in enumerate(self.doc_keys)}
+        for name in ['ner_sents', 'rel_sents', 'ents', 'ent_offsets', 'rels',
+                     'rel_offsets']:
+            setattr(self, name,
+                    np.load(join(cache_path, f'{name}.npy'), mmap_mode='r'))
+
+    def __getitem__(self, doc_key):
+        return self.get_doc(doc_key)
+
+    def __iter__(self):
+        return iter(self.doc_keys)
+
+    def __len__(self):
+        return len(self.doc_keys)
+
+    def __contains__(self, doc_key):
+        return doc_key in self.doc_idxs
+
+    def get_doc(self, doc_key, fields=('ner', 'relations')):
+        """
+        Build the dygiepp dict for one doc.
+
+        parameters:
+            doc_key, str: doc to build
+            fields, iterable of str: which of "ner" and "relations" to build
+
+        returns:
+            doc, dict: doc_key plus the requested fields
+        """
+        i = self.doc_idxs[doc_key]
+        doc = {'doc_key': doc_key}
+        if 'ner' in fields:
+            doc['ner'] = [[] for _ in range(self.ner_sents[i])]
+            ents = self.ents[self.ent_offsets[i]:self.ent_offsets[i + 1]]
+            for sent_num, start, end, type_id in ents.tolist():
+                doc['ner'][sent_num].append(
+                    [start, end, self.ent_types[type_id]])
+        if 'relations' in fields:
+            doc['relations'] = [[] for _ in range(self.rel_sents[i])]
+            rels = self.rels[self.rel_offsets[i]:self.rel_offsets[i + 1]]
+            for sent_num, s1, e1, s2, e2, type_id in rels.tolist():
+                doc['relations'][sent_num].append(
+                    [s1, e1, s2, e2, self.rel_types[type_id]])
+
+        return doc
+
+    def has_relations(self):
+        """
+        Whether there are any relation annotations in the gold standard.
+        """
+        return self.rels.shape[0] != 0
+
+    def get_ent_arrays(self, doc_keys):
+        """
+        Get the entity rows for a list of docs in the layout made by
+        evaluate_model_output.flatten_ents, where the first column is the
+        position of the doc in doc_keys.
+
+        parameters:
+            doc_keys, list of str: docs to get entities for
+
+        returns:
+            ent_arr, array of int: shape (num_ents, 5)
+            scores, array of float: shape (num_ents, 2), all NaN
+            ent_types, list of str: type names, indexed by type ID
+            ner_sents, array of int: number of ner sentences in each doc
+        """
+        idxs = np.array([self.doc_idxs[key] for key in doc_keys],
+                        dtype=np.int64)
+        starts = self.ent_offsets[idxs]
+        lengths = self.ent_offsets[idxs + 1] - starts
+
+        # Row numbers of every doc's block of entities, end to end
+        block_starts = np.cumsum(lengths) - lengths
+        rows = np.repeat(starts - block_starts, lengths) + np.arange(
+            lengths.sum())
+
+        ent_arr = np.empty((len(rows), 5), dtype=np.int64)
+        ent_arr[:, 0] = np.repeat(np.arange(len(idxs)), lengths)
+        ent_arr[:, 1:] = self.ents[rows]
+        scores = np.full((len(rows), 2), np.nan)
+
+        return ent_arr, scores, self.ent_types, self.ner_sents[idxs]
@@ -0,0 +1,264 @@
+"""
+Estimate how much memory DyGIE++ needs for each document of a jsonl dataset,
+flag the documents that are over a memory budget, and pack the rest into
+shards that each fit in the budget, so that jobs can be sized before they're
+run.
+
+DyGIE++ enumerates every span of up to max_span_width tokens in each
+sentence, embeds all of them, and then scores every pair of the spans that
+are kept after pruning (spans_per_word times the sentence length) for
+relations. The estimate is the size of those span and pair activations, from
+the sentence lengths of each document and the span settings of the training
+configs. It's meant for comparing documents and sizing shards, not as an
+exact number of bytes; pass -span_bytes and -pair_bytes to calibrate it
+against a run that's been measured.
+
+The plan is saved as <dataset>_memory_plan.csv, with the estimate and shard
+of every document. Shards are packed first fit decreasing, and documents over
+the budget get a shard of their own. With --write_shards, each shard is also
+saved as its own jsonl file.
+
+Author: Serena G. Lotreck
+"""
+import argparse
+from glob import glob
+from os.path import abspath, basename, dirname, join, splitext
+import re
+import sys
+sys.path.append(
+    join(dirname(abspath(__file__)), '../annotation/abstract_scripts'))
+from split_docs_for_memory import MAX_SPAN_WIDTH, get_span_counts
+import jsonlines
+import numpy as np
+import pandas as pd
+
+# DyGIE++ defaults for the settings that aren't in our configs
+SPANS_PER_WORD = 0.5
+BERT_DIM = 768
+FEATURE_SIZE = 20
+FFNN_DIM = 150
+
+# float32 activations of a span embedding (both endpoints and a width
+# embedding) and of a relation pair embedding (both spans and their product),
+# each with two hidden FFNN layers
+SPAN_EMB_DIM = 2 * BERT_DIM + FEATURE_SIZE
+SPAN_BYTES = 4 * (SPAN_EMB_DIM + 2 * FFNN_DIM)
+PAIR_BYTES = 4 * (3 * SPAN_EMB_DIM + 2 * FFNN_DIM)
+
+CONFIG_SETTINGS = {
+    'max_span_width': re.compile(r'max_span_width\s*:\s*(\d+)'),
+    'spans_per_word': re.compile(r'spans_per_word\s*:\s*([\d.]+)')
+}
+
+
+def read_config_settings(config_paths):
+    """
+    Get the span settings from a set of DyGIE++ training configs. Settings
+    a config doesn't have are the DyGIE++ defaults, and the largest value of
+    each setting across configs is used, so that the estimates hold for all
+    of them.
+
+    parameters:
+        config_paths, list of str: paths to .jsonnet configs
+
+    returns:
+        settings, dict: max_span_width and spans_per_word
+    """
+    settings = {'max_span_width': MAX_SPAN_WIDTH,
+                'spans_per_word': SPANS_PER_WORD}
+    for path in config_paths:
+        with open(path) as myf:
+            config = myf.read()
+        for setting, pattern in CONFIG_SETTINGS.items():
+            for value in pattern.findall(config):
+                value = type(settings[setting])(value)
+                settings[setting] = max(settings[setting], value)
+
+    return settings
+
+
+def estimate_doc_cost(sent_lengths, max_span_width=MAX_SPAN_WIDTH,
+                      spans_per_word=SPANS_PER_WORD, span_bytes=SPAN_BYTES,
+                      pair_bytes=PAIR_BYTES):
+    """
+    Estimate the span enumeration cost of one document.
+
+    parameters:
+        sent_lengths, list of int: number of tokens in each sentence
+        max_span_width, int: longest span the model considers
+        spans_per_word, float: spans kept per token for relation scoring
+        span_bytes, int: bytes per candidate span
+        pair_bytes, int: bytes per pair of kept spans
+
+    returns:
+        cost, dict: number of tokens, candidate spans and span pairs, and the
+            estimated bytes
+    """
+    lengths = np.asarray(sent_lengths, dtype=np.int64)
+    spans = get_span_counts(lengths, max_span_width)
+    kept = np.minimum(np.ceil(spans_per_word * lengths).astype(np.int64),
+                      spans)
+    num_spans = int(spans.sum())
+    num_pairs = int((kept**2).sum())
+
+    return {
+        'num_sents': len(lengths),
+        'num_tokens': int(lengths.sum()),
+        'num_spans': num_spans,
+        'num_pairs': num_pairs,
+        'est_bytes': num_spans * span_bytes + num_pairs * pair_bytes
+    }
+
+
+def estimate_costs(dset_path, **kwargs):
+    """
+    Estimate the cost of every document in a dataset, reading it one
+    document at a time.
+
+    parameters:
+        dset_path, str: path to a dygiepp-formatted jsonl dataset
+        kwargs: settings for estimate_doc_cost
+
+    returns:
+        cost_df, df: one row per document, with the doc_key and the columns
+            of estimate_doc_cost
+    """
+    rows = []
+    with jsonlines.open(dset_path) as reader:
+        for doc in reader:
+            cost = estimate_doc_cost([len(sent) for sent in doc['sentences']],
+                                     **kwargs)
+            cost['doc_key'] = doc['doc_key']
+            rows.append(cost)
+
+    return pd.DataFrame(rows, columns=['doc_key', 'num_sents', 'num_tokens',
+                                       'num_spans', 'num_pairs', 'est_bytes'])
+
+
+def plan_shards(costs, budget, max_docs=None):
+    """
+    Pack documents into shards whose total cost is within the budget, first
+    fit decreasing. Documents over the budget get a shard of their own.
+
+    parameters:
+        costs, array of int: cost of each document
+        budget, int: largest total cost of a shard
+        max_docs, int or None: most documents in a shard
+
+    returns:
+        shards, array of int: shard of each document, numbered from 0 in
+            order of each shard's largest document
+    """
+    costs = np.asarray(costs)
+    shards = np.empty(len(costs), dtype=np.int64)
+    space = []
+    sizes = []
+    for i in np.argsort(-costs, kind='stable'):
+        fits = [s for s, left in enumerate(space)
+                if costs[i] <= left and (max_docs is None
+                                         or sizes[s] < max_docs)]
+        if len(fits) == 0 or costs[i] > budget:
+            space.append(budget - costs[i])
+            sizes.append(0)
+            shard = len(space) - 1
+        else:
+            shard = fits[0]
+            space[shard] -= costs[i]
+        sizes[shard] += 1
+        shards[i] = shard
+
+    return shards
+
+
+def write_shards(dset_path, plan_df, out_prefix):
+    """
+    Write each shard of a plan as its own jsonl file, in a second pass over
+    the dataset.
+
+    parameters:
+        dset_path, str: path to the dataset the plan is for
+        plan_df, df: plan with the columns doc_key and shard
+        out_prefix, str: path to save to, each shard is saved as
+            f'{out_prefix}_shard_{shard}.jsonl'
+    """
+    doc_shards = dict(zip(plan_df.doc_key, plan_df.shard))
+    writers = {}
+    try:
+        with jsonlines.open(dset_path) as reader:
+            for doc in reader:
+                shard = doc_shards[doc['doc_key']]
+                if shard not in writers:
+                    writers[shard] = jsonlines.open(
+                        f'{out_prefix}_shard_{shard}.jsonl', 'w')
+                writers[shard].write(doc)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+
+def main(dset_path, out_loc, budget_mb, config_paths, max_docs=None,
+         span_bytes=SPAN_BYTES, pair_bytes=PAIR_BYTES, shards=False):
+
+    # Get span settings
+    settings = read_config_settings(config_paths)
+    print(f'\nUsing max_span_width = {settings["max_span_width"]} and '
+          f'spans_per_word = {settings["spans_per_word"]} from '
+          f'{len(config_paths)} configs')
+
+    # Estimate
+    print('\nEstimating memory use...')
+    plan_df = estimate_costs(dset_path, span_bytes=span_bytes,
+                             pair_bytes=pair_bytes, **settings)
+    budget = int(budget_mb * 2**20)
+    plan_df['est_mb'] = plan_df.est_bytes / 2**20
+    plan_df['over_budget'] = plan_df.est_bytes > budget
+    plan_df['shard'] = plan_shards(plan_df.est_bytes, budget, max_docs)
+
+    over = plan_df[plan_df.over_budget]
+    print(f'{len(over)} of {len(plan_df)} documents are over the budget of '
+          f'{budget_mb} MB, with the following doc_keys: '
+          f'{over.doc_key.tolist()}')
+    print(f'Documents were packed into {plan_df.shard.nunique()} shards')
+
+    # Save
+    out_prefix = join(out_loc, splitext(basename(dset_path))[0])
+    out_name = f'{out_prefix}_memory_plan.csv'
+    plan_df.to_csv(out_name, index=False)
+    print(f'\nSaved plan as {out_name}')
+    if shards:
+        write_shards(dset_path, plan_df, out_prefix)
+        print(f'Saved shards as {out_prefix}_shard_<shard>.jsonl')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Estimate DyGIE++ memory '
+            'use and plan shards')
+
+    parser.add_argument('dset_path', type=str,
+            help='Path to dygiepp-formatted jsonl dataset')
+    parser.add_argument('out_loc', type=str,
+            help='Path to save the plan')
+    parser.add_argument('budget_mb', type=float,
+            help='Memory budget for one document or shard, in MB')
+    parser.add_argument('-configs', type=str, nargs='+',
+            default=sorted(glob(join(dirname(abspath(__file__)),
+                                     'training_config', '*.jsonnet'))),
+            help='Training configs to read span settings from. Default is '
+            'every config in models/training_config')
+    parser.add_argument('-max_docs', type=int, default=None,
+            help='Most documents in a shard, default is no limit')
+    parser.add_argument('-span_bytes', type=int, default=SPAN_BYTES,
+            help=f'Bytes per candidate span, default is {SPAN_BYTES}')
+    parser.add_argument('-pair_bytes', type=int, default=PAIR_BYTES,
+            help=f'Bytes per pair of kept spans, default is {PAIR_BYTES}')
+    parser.add_argument('--write_shards', action='store_true',
+            help='Also save each shard as its own jsonl file')
+
+    args = parser.parse_args()
+
+    args.dset_path = abspath(args.dset_path)
+    args.out_loc = abspath(args.out_loc)
+    args.configs = [abspath(config) for config in args.configs]
+
+    main(args.dset_path, args.out_loc, args.budget_mb, args.configs,
+         args.max_docs, args.span_bytes, args.pair_bytes, args.write_shards)
@@ -5,18 +5,25 @@ calculate precision, recall and F1 for entity and relation prediction.
 Author: Serena G. Lotreck
 """
 import argparse
-from os.path import abspath, basename, join, splitext
+from itertools import combinations
+from os.path import abspath, basename, dirname, join, splitext
 from os import listdir
 import warnings
 import sys
 sys.path.append('../annotation/abstract_scripts')
-from map_dataset_types import map_jsonl
+from map_dataset_types import map_jsonl_view
+from compiled_gold import CompiledGold, load_compiled_gold
+from type_hierarchy import LEVELS, TypeHierarchy, read_annotation_conf
+from worker_pool import run_tasks, worker_args
 from dygie.training.f1 import compute_f1  # Must have dygiepp developed in env
 import jsonlines
 import json
 import pandas as pd
 import numpy as np
 
+# Position of each score among the values that follow a prediction's type
+SCORE_COLS = {'logit': 0, 'softmax': 1}
+
 
 def calculate_CI(prec_samples, rec_samples, f1_samples):
     """
@@ -48,6 +55,83 @@ def calculate_CI(prec_samples, rec_samples, f1_samples):
     return [CIs['prec_CI'], CIs['rec_CI'], CIs['f1_CI']]
 
 
+def get_rel_key(rel, check_types=False, sym_rels=None):
+    """
+    Get the canonical key used to look a relation up in a relation index.
+
+    The key is a tuple of the two entity spans followed by the relation type.
+    If types aren't being checked, or the relation type is symmetric, the two
+    spans are put in sorted order so that both directions of the relation get
+    the same key. If types aren't being checked, the type element is None,
+    except for symmetric relations, whose type is always compared.
+
+    parameters:
+        rel, list: 4 integers (entity bounds) and a string (relation type),
+            with optional softmax and logit scores
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+
+    returns:
+        key, tuple: (ent1_start, ent1_end, ent2_start, ent2_end, type)
+    """
+    ent1 = (rel[0], rel[1])
+    ent2 = (rel[2], rel[3])
+    in_sym = sym_rels is not None and rel[4] in sym_rels
+    rel_type = rel[4] if check_types or in_sym else None
+
+    # Order only matters when we check types and the type isn't symmetric
+    if (not check_types) or in_sym:
+        ent1, ent2 = min(ent1, ent2), max(ent1, ent2)
+
+    return ent1 + ent2 + (rel_type,)
+
+
+def get_rel_index_keys(rel, check_types=False, sym_rels=None):
+    """
+    Get every key a relation is found under in a relation index. When types
+    aren't checked, a relation whose own type isn't symmetric matches any
+    relation between the same entities, so symmetric relations are also
+    indexed under their untyped key.
+
+    parameters:
+        rel, list: relation representation, as for get_rel_key
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+
+    returns:
+        keys, list of tuple: the relation's key, followed by its untyped key
+            if it has a different one
+    """
+    key = get_rel_key(rel, check_types, sym_rels)
+    if check_types or key[4] is None:
+        return [key]
+    return [key, key[:4] + (None,)]
+
+
+def build_rel_index(sent, check_types=False, sym_rels=None):
+    """
+    Build a lookup index for the relations in a single sentence.
+
+    parameters:
+        sent, list of list: relation representations, each with 4 integers
+            (entity bounds) and a string (relation type), with optional
+            softmax and logit scores
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+
+    returns:
+        rel_index, set of tuple: canonical keys for the relations in sent
+    """
+    return {
+        key
+        for rel in sent
+        for key in get_rel_index_keys(rel, check_types, sym_rels)
+    }
+
+
 def check_rel_matches(pred, gold_sent, check_types=False, sym_rels=None):
     """
     Checks for matches of pred in gold_sent, order-agnostically if check_types
@@ -55,7 +139,11 @@ def check_rel_matches(pred, gold_sent, check_types=False, sym_rels=None):
 
     Note that pred/gold are relative, can be swapped to get false negatives by
     comparing a "pred" from the gold standard against the "gold_sent" of
-    predictions from the model, as is done in get_doc_rel_counts.
+    predictions from the model.
+
+    When checking many relations against the same sentence, build the index
+    once with build_rel_index and look keys up directly, as is done in
+    get_doc_rel_counts.
 
     parameters:
         pred, list: 4 integers (entity bounds) and a string (relation type),
@@ -69,60 +157,341 @@ def check_rel_matches(pred, gold_sent, check_types=False, sym_rels=None):
     returns:
         True if a match exists in gold_sent, False otherwise
     """
-    # Make sym_rels an empty list if there are None
-    sym_rels = [] if sym_rels is None else sym_rels
+    gold_index = build_rel_index(gold_sent, check_types, sym_rels)
 
-    # Checking when order matters is straighforweard
-    if check_types and pred[4] not in sym_rels:
-        gold_sent = [g[:5] for g in gold_sent] # In case there are softmax/logit
-        if pred[:5] in gold_sent:
-            return True
-        else:
-            return False
-
-    # If we don't care about types, or if the type is symmetric, check order-agnostically
-    elif not check_types or pred[4] in sym_rels:
-
-        # Need to mark down whether or not we care about type
-        if pred[4] in sym_rels:
-            vals_compare = 5
-        else: vals_compare = 4
-
-        # Make all gold rels into strings to make it easier to search for ent idx pairs
-        gold_rel_strs = []
-        for rel in gold_sent:
-            rel_str = ' '.join([str(i) for i in rel[:vals_compare]])
-            gold_rel_strs.append(rel_str)
-
-        # Make each ent and type in pred into separate string so we can search order-agnostically
-        pred_ent_1_str = ' '.join([str(i) for i in pred[:2]])
-        pred_ent_2_str = ' '.join([str(i) for i in pred[2:4]])
-        pred_rel_type = pred[4]
-
-        # Check if ent 1 is in one of the relations
-        ent1_list = [True if pred_ent_1_str in i else False for i in gold_rel_strs]
-        # Check if ent 2 is in one of the relations
-        ent2_list = [True if pred_ent_2_str in i else False for i in gold_rel_strs]
-        # Check if the relation type is in one of the relations
-        type_list = [True if pred_rel_type in i else False for i in gold_rel_strs]
-
-        # Indices that all have True in them are matches
-        if pred[4] in sym_rels:
-             matches_list = [
-                True if (ent1_list[i] & ent2_list[i] & type_list[i]) else False
-                for i in range(len(gold_rel_strs))
-                ]
-        else:
-            matches_list = [
-                True if (ent1_list[i] & ent2_list[i]) else False
-                for i in range(len(gold_rel_strs))
-                ]
-
-        # Determine return type
-        if matches_list.count(True) >= 1:
-            return True
-        else:
-            return False
+    return get_rel_key(pred, check_types, sym_rels) in gold_index
+
+
+def intern_type(type_ids, type_name):
+    """
+    Get the integer ID for a type name, adding it to type_ids if it hasn't
+    been seen before.
+
+    parameters:
+        type_ids, dict: keys are type names, values are integer IDs
+        type_name, str: type to look up
+
+    returns:
+        type_id, int: ID of type_name
+    """
+    if type_name not in type_ids:
+        type_ids[type_name] = len(type_ids)
+
+    return type_ids[type_name]
+
+
+def flatten_ents(docs, ner_key, type_ids, sent_limits):
+    """
+    Flatten the entities of a list of documents into integer arrays. Types
+    are lowercased before they are interned. The caller's data isn't modified.
+
+    parameters:
+        docs, list of dict: dygiepp-formatted documents
+        ner_key, str: 'ner' or 'predicted_ner'
+        type_ids, dict: type interning table, updated in place
+        sent_limits, list of int: number of sentences to read from each doc
+
+    returns:
+        ent_arr, array of int: shape (num_ents, 5), columns are the index of
+            the doc in docs, sentence number, start, end and type ID
+        scores, array of float: shape (num_ents, 2), the logit and softmax
+            scores of each entity, NaN where they aren't present
+    """
+    rows = []
+    score_rows = []
+    for doc_num, (doc, sent_limit) in enumerate(zip(docs, sent_limits)):
+        for sent_num, sent in enumerate(doc[ner_key][:sent_limit]):
+            for ent in sent:
+                rows.append((doc_num, sent_num, ent[0], ent[1],
+                             intern_type(type_ids, ent[2].lower())))
+                ent_scores = list(ent[3:5])
+                score_rows.append(ent_scores + [np.nan] * (2 - len(ent_scores)))
+
+    ent_arr = np.array(rows, dtype=np.int64).reshape(-1, 5)
+    scores = np.array(score_rows, dtype=float).reshape(-1, 2)
+
+    return ent_arr, scores
+
+
+def join_keys(pred_keys, gold_keys):
+    """
+    Sort-merge join of prediction and gold standard key rows. Rows are equal
+    if all of their columns are equal.
+
+    All rows are lexsorted together and labeled with the run of equal rows
+    they fall into; gold rows are then sorted by label so that the gold
+    matches of each prediction are a contiguous block found by searchsorted.
+
+    parameters:
+        pred_keys, array of int: shape (num_pred, num_cols)
+        gold_keys, array of int: shape (num_gold, num_cols)
+
+    returns:
+        pred_matches, array of int: number of gold rows equal to each
+            prediction row
+        gold_matched, array of bool: whether each gold row is equal to at
+            least one prediction row
+        gold_order, array of int: gold row indices sorted by key
+        match_starts, array of int: for each prediction row, the position in
+            gold_order of its first matching gold row
+    """
+    num_pred = pred_keys.shape[0]
+    all_keys = np.concatenate([pred_keys, gold_keys])
+    if all_keys.shape[0] == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, np.zeros(0, dtype=bool), empty, empty
+
+    # Label each row with the run of identical keys it belongs to
+    order = np.lexsort(all_keys.T[::-1])
+    sorted_keys = all_keys[order]
+    new_run = np.ones(len(order), dtype=bool)
+    new_run[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+    labels = np.empty(len(order), dtype=np.int64)
+    labels[order] = np.cumsum(new_run) - 1
+    pred_labels = labels[:num_pred]
+    gold_labels = labels[num_pred:]
+
+    # Find each prediction's block of gold matches
+    gold_order = np.argsort(gold_labels, kind='stable')
+    sorted_gold_labels = gold_labels[gold_order]
+    match_starts = np.searchsorted(sorted_gold_labels, pred_labels, 'left')
+    match_ends = np.searchsorted(sorted_gold_labels, pred_labels, 'right')
+    pred_matches = match_ends - match_starts
+
+    # And whether each gold row was predicted
+    pred_label_counts = np.bincount(pred_labels, minlength=labels.max() + 1)
+    gold_matched = pred_label_counts[gold_labels] > 0
+
+    return pred_matches, gold_matched, gold_order, match_starts
+
+
+def format_ent(ent_row, score_row, type_names):
+    """
+    Helper for get_ent_mismatch_rows. Turn a flattened entity back into its
+    dygiepp list form, with lowercased type.
+
+    parameters:
+        ent_row, array of int: row from an array made by flatten_ents
+        score_row, array of float: matching row of scores
+        type_names, list of str: type names, indexed by type ID
+
+    returns:
+        ent, list: [start, end, type] plus any scores
+    """
+    ent = [int(ent_row[2]), int(ent_row[3]), type_names[ent_row[4]]]
+    ent += [float(score) for score in score_row if not np.isnan(score)]
+
+    return ent
+
+
+def get_ent_mismatch_rows(prediction_dicts, pred_arr, pred_scores, gold_arr,
+                          gold_scores, join, type_ids, mismatch_rows):
+    """
+    Add rows to mismatch_rows for every true positive, false positive and
+    false negative, from the arrays and join made in get_ent_doc_counts.
+    Within each sentence, predictions come first in their original order
+    (one row per matching gold entity for true positives), followed by the
+    gold entities that weren't predicted.
+
+    parameters:
+        prediction_dicts, list of dict: dygiepp formatted predictions
+        pred_arr, pred_scores: flattened predictions from flatten_ents
+        gold_arr, gold_scores: flattened gold standard from flatten_ents
+        join, tuple: output of join_keys for pred_arr and gold_arr
+        type_ids, dict: type interning table used to flatten the arrays
+        mismatch_rows, dict: dict with mismatch_cols as keys and lists as rows
+
+    returns:
+        mismatch_rows, dict: updated mismatch_rows
+    """
+    pred_matches, gold_matched, gold_order, match_starts = join
+    type_names = sorted(type_ids, key=type_ids.get)
+
+    # Put predictions and unmatched gold entities in output order
+    fn_idxs = np.flatnonzero(~gold_matched)
+    sides = np.concatenate([np.zeros(len(pred_arr), dtype=np.int64),
+                            np.ones(len(fn_idxs), dtype=np.int64)])
+    idxs = np.concatenate([np.arange(len(pred_arr)), fn_idxs])
+    docs = np.concatenate([pred_arr[:, 0], gold_arr[fn_idxs, 0]])
+    sents = np.concatenate([pred_arr[:, 1], gold_arr[fn_idxs, 1]])
+    order = np.lexsort((idxs, sides, sents, docs))
+
+    def add_row(doc_num, mismatch_type, sent_num, gold_ent, pred_ent):
+        mismatch_rows['doc_key'].append(prediction_dicts[doc_num]['doc_key'])
+        mismatch_rows['mismatch_type'].append(mismatch_type)
+        mismatch_rows['sent_num'].append(sent_num)
+        mismatch_rows['gold_ent_list'].append(gold_ent)
+        mismatch_rows['gold_ent_type'].append(
+            gold_ent[2] if gold_ent is not np.nan else np.nan)
+        mismatch_rows['pred_ent_list'].append(pred_ent)
+        mismatch_rows['pred_ent_type'].append(
+            pred_ent[2] if pred_ent is not np.nan else np.nan)
+
+    for pos in order:
+        i = idxs[pos]
+        doc_num, sent_num = int(docs[pos]), int(sents[pos])
+        if sides[pos] == 1:
+            gold_ent = format_ent(gold_arr[i], gold_scores[i], type_names)
+            add_row(doc_num, 0, sent_num, gold_ent, np.nan)
+            continue
+        pred_ent = format_ent(pred_arr[i], pred_scores[i], type_names)
+        if pred_matches[i] == 0:
+            add_row(doc_num, 2, sent_num, np.nan, pred_ent)
+        for j in gold_order[match_starts[i]:match_starts[i] + pred_matches[i]]:
+            gold_ent = format_ent(gold_arr[j], gold_scores[j], type_names)
+            add_row(doc_num, 1, sent_num, gold_ent, pred_ent)
+
+    return mismatch_rows
+
+
+def get_ent_level_counts(pred_arr, gold_arr, span_join, level_ids,
+                         num_docs):
+    """
+    Get per-document counts for entity prediction at every level of the type
+    hierarchy from one join on spans. Every pair of entities with the same
+    span is expanded once, and the two types' ancestors at each level are
+    compared by looking them up in level_ids.
+
+    parameters:
+        pred_arr, array of int: flattened predictions, from flatten_ents
+        gold_arr, array of int: flattened gold standard entities
+        span_join, tuple: output of join_keys on the first 4 columns only
+        level_ids, array of int: shape (len(LEVELS), num_types), the ancestor
+            of each type ID at each level, from TypeHierarchy.get_level_ids
+        num_docs, int: number of documents
+
+    returns:
+        level_counts, array of int: shape (num_docs, len(LEVELS), 3), where
+            the last axis is tp, fp and fn, counted as in get_ent_doc_counts
+    """
+    pred_matches, _, gold_order, match_starts = span_join
+
+    # Expand each prediction into one row per gold entity with its span
+    pred_idxs = np.repeat(np.arange(len(pred_arr)), pred_matches)
+    block_pos = np.arange(len(pred_idxs)) - np.repeat(
+        np.cumsum(pred_matches) - pred_matches, pred_matches)
+    gold_idxs = gold_order[np.repeat(match_starts, pred_matches) + block_pos]
+    same_type = (level_ids[:, pred_arr[pred_idxs, 4]] ==
+                 level_ids[:, gold_arr[gold_idxs, 4]])
+
+    level_counts = np.zeros((num_docs, len(level_ids), 3), dtype=np.int64)
+    for level, level_same in enumerate(same_type):
+        pred_tp = np.bincount(pred_idxs, weights=level_same,
+                              minlength=len(pred_arr))
+        gold_matched = np.bincount(gold_idxs, weights=level_same,
+                                   minlength=len(gold_arr)) > 0
+        level_counts[:, level] = np.stack([
+            np.bincount(pred_arr[:, 0], weights=pred_tp, minlength=num_docs),
+            np.bincount(pred_arr[:, 0], weights=pred_tp == 0,
+                        minlength=num_docs),
+            np.bincount(gold_arr[:, 0], weights=~gold_matched,
+                        minlength=num_docs)
+        ], axis=1)
+
+    return level_counts
+
+
+def get_ent_doc_counts(prediction_dicts, gold_dicts, mismatch_rows,
+                       check_types=False, gold_arrays=None, score_matches=None,
+                       score_col=None, hierarchy=None, level_counts=None):
+    """
+    Get the true/false positives and false negatives for entity prediction
+    for every document at once. All entities are flattened into integer
+    arrays of (doc, sentence, start, end, type) and matched with a single
+    sort-merge join.
+
+    Each prediction counts one true positive for every gold entity it
+    matches, or one false positive if it matches none; each gold entity
+    that no prediction matches is a false negative. Types are compared
+    case-insensitively.
+
+    parameters:
+        prediction_dicts, list of dict: dygiepp formatted predictions
+        gold_dicts, list of dict: gold standard for each document in
+            prediction_dicts, in the same order. Not used if gold_arrays is
+            given.
+        mismatch_rows, dict: empty dict or dict with mismatch_cols as keys and
+            lists as rows
+        check_types, bool: Whether or not to consider types in evaluations
+        gold_arrays, tuple or None: gold entities for the same documents that
+            are already flattened, as returned by CompiledGold.get_ent_arrays
+        score_matches, list or None: if given, the output of
+            get_ent_score_matches for these documents is appended to it
+        score_col, str or None: 'logit' or 'softmax', the prediction score
+            to use for score_matches
+        hierarchy, TypeHierarchy or None: lowercased entity type hierarchy,
+            required if level_counts is given
+        level_counts, list or None: if given, the output of
+            get_ent_level_counts for these documents is appended to it.
+            Types are always checked at every level.
+
+    returns:
+        doc_counts, array of int: shape (len(prediction_dicts), 3), where the
+            columns are tp, fp and fn
+        mismatch_rows, dict: empty dict if emtpy dict was passed, otherwise
+            updated mismatch_rows dict
+    """
+    # Only sentences present in both versions of a doc are compared
+    if gold_arrays is None:
+        gold_sent_counts = [len(gold['ner']) for gold in gold_dicts]
+    else:
+        gold_arr, gold_scores, gold_types, gold_sent_counts = gold_arrays
+    sent_limits = [
+        min(len(doc['predicted_ner']), num_sents)
+        for doc, num_sents in zip(prediction_dicts, gold_sent_counts)
+    ]
+
+    # Flatten both sides with the same type IDs
+    if gold_arrays is None:
+        type_ids = {}
+        gold_arr, gold_scores = flatten_ents(gold_dicts, 'ner', type_ids,
+                                             sent_limits)
+    else:
+        type_ids = {ent_type: i for i, ent_type in enumerate(gold_types)}
+        keep = gold_arr[:, 1] < np.array(sent_limits,
+                                         dtype=np.int64)[gold_arr[:, 0]]
+        gold_arr, gold_scores = gold_arr[keep], gold_scores[keep]
+    pred_arr, pred_scores = flatten_ents(prediction_dicts, 'predicted_ner',
+                                         type_ids, sent_limits)
+
+    # Whether or not we care about type determines which columns we compare
+    num_cols = 5 if check_types else 4
+    join = join_keys(pred_arr[:, :num_cols], gold_arr[:, :num_cols])
+    pred_matches, gold_matched = join[0], join[1]
+
+    num_docs = len(prediction_dicts)
+    doc_counts = np.stack([
+        np.bincount(pred_arr[:, 0], weights=pred_matches,
+                    minlength=num_docs),
+        np.bincount(pred_arr[:, 0], weights=pred_matches == 0,
+                    minlength=num_docs),
+        np.bincount(gold_arr[:, 0], weights=~gold_matched,
+                    minlength=num_docs)
+    ], axis=1).astype(np.int64)
+
+    if score_matches is not None:
+        score_matches.append(
+            get_ent_score_matches(pred_scores[:, SCORE_COLS[score_col]],
+                                  join, gold_arr.shape[0]))
+
+    if level_counts is not None:
+        # Levels compare the types of entities with the same span, so they
+        # need a join on spans only, which is the main one without types
+        span_join = join if num_cols == 4 else join_keys(
+            pred_arr[:, :4], gold_arr[:, :4])
+        type_names = sorted(type_ids, key=type_ids.get)
+        level_counts.append(
+            get_ent_level_counts(pred_arr, gold_arr, span_join,
+                                 hierarchy.get_level_ids(type_names),
+                                 num_docs))
+
+    if len(mismatch_rows.keys()) != 0:
+        mismatch_rows = get_ent_mismatch_rows(prediction_dicts, pred_arr,
+                                              pred_scores, gold_arr,
+                                              gold_scores, join, type_ids,
+                                              mismatch_rows)
+
+    return doc_counts, mismatch_rows
 
 
 def get_doc_ent_counts(doc, gold_std, ent_pos_neg, mismatch_rows,
@@ -148,60 +517,10 @@ def get_doc_ent_counts(doc, gold_std, ent_pos_neg, mismatch_rows,
         mismatch_rows, dict: empty dict if emtpy dict was passed, otherwise
             updated mismatch_rows dict
     """
-    # Whether or not we care about type determines what index we compare to
-    vals_compare = 2 if not check_types else 3
-
-    # Go through each sentence for entities
-    sent_num = 0
-    for pred_sent, gold_sent in zip(doc['predicted_ner'], gold_std['ner']):
-
-        # Iterate through predictions and check for them in gold standard
-        for pred_ent in pred_sent:
-            pred_ent[2] = pred_ent[2].lower()
-            found = False
-            for gold_ent in gold_sent:
-                gold_ent[2] = gold_ent[2].lower()
-                if pred_ent[:vals_compare] == gold_ent[:vals_compare]:
-                    ent_pos_neg['tp'] += 1
-                    if len(mismatch_rows.keys()) != 0:
-                        mismatch_rows['doc_key'].append(doc['doc_key'])
-                        mismatch_rows['mismatch_type'].append(1)
-                        mismatch_rows['sent_num'].append(sent_num)
-                        mismatch_rows['gold_ent_list'].append(gold_ent)
-                        mismatch_rows['gold_ent_type'].append(gold_ent[2])
-                        mismatch_rows['pred_ent_list'].append(pred_ent)
-                        mismatch_rows['pred_ent_type'].append(pred_ent[2])
-                    found = True
-            if not found:
-                ent_pos_neg['fp'] += 1
-                if len(mismatch_rows.keys()) != 0:
-                    mismatch_rows['doc_key'].append(doc['doc_key'])
-                    mismatch_rows['mismatch_type'].append(2)
-                    mismatch_rows['sent_num'].append(sent_num)
-                    mismatch_rows['gold_ent_list'].append(np.nan)
-                    mismatch_rows['gold_ent_type'].append(np.nan)
-                    mismatch_rows['pred_ent_list'].append(pred_ent)
-                    mismatch_rows['pred_ent_type'].append(pred_ent[2])
-
-        # Iterate through gold standard and check for them in predictions
-        for gold_ent in gold_sent:
-            gold_ent[2] = gold_ent[2].lower()
-            found = False
-            for pred_ent in pred_sent:
-                pred_ent[2] = pred_ent[2].lower()
-                if gold_ent[:vals_compare] == pred_ent[:vals_compare]:
-                    found = True
-            if not found:
-                ent_pos_neg['fn'] += 1
-                if len(mismatch_rows.keys()) != 0:
-                    mismatch_rows['doc_key'].append(doc['doc_key'])
-                    mismatch_rows['mismatch_type'].append(0)
-                    mismatch_rows['sent_num'].append(sent_num)
-                    mismatch_rows['gold_ent_list'].append(gold_ent)
-                    mismatch_rows['gold_ent_type'].append(gold_ent[2])
-                    mismatch_rows['pred_ent_list'].append(np.nan)
-                    mismatch_rows['pred_ent_type'].append(np.nan)
-        sent_num += 1
+    doc_counts, mismatch_rows = get_ent_doc_counts([doc], [gold_std],
+                                                   mismatch_rows, check_types)
+    for name, count in zip(['tp', 'fp', 'fn'], doc_counts.sum(axis=0)):
+        ent_pos_neg[name] += int(count)
 
     return ent_pos_neg, mismatch_rows
 
@@ -233,20 +552,20 @@ def get_doc_rel_counts(doc, gold_std, rel_pos_neg, doc_key, check_types=False,
     for pred_sent, gold_sent in zip(doc['predicted_relations'],
                                     gold_std['relations']):
 
+        # Index both sides once so each lookup is constant time
+        pred_index = build_rel_index(pred_sent, check_types, sym_rels)
+        gold_index = build_rel_index(gold_sent, check_types, sym_rels)
+
         # Iterate through the predictions and check for them in the gold standard
         for pred in pred_sent:
-            matched = check_rel_matches(pred, gold_sent, check_types, sym_rels)
-            if matched:
+            if get_rel_key(pred, check_types, sym_rels) in gold_index:
                 rel_pos_neg['tp'] += 1
             else:
                 rel_pos_neg['fp'] += 1
 
         # Iterate through gold standard and check for them in predictions
         for gold in gold_sent:
-            matched = check_rel_matches(gold, pred_sent, check_types, sym_rels)
-            if matched:
-                continue
-            else:
+            if get_rel_key(gold, check_types, sym_rels) not in pred_index:
                 rel_pos_neg['fn'] += 1
 
     return rel_pos_neg
@@ -287,18 +606,18 @@ def get_f1_input(gold_standard_dicts,
     # Rearrange gold standard so that it's a dict with keys that are doc_id's
     gold_standard_dict = {d['doc_key']: d for d in gold_standard_dicts}
 
-    # Go through the docs
-    for doc in prediction_dicts:
-
-        # Get the corresponding gold standard
-        gold_std = gold_standard_dict[doc['doc_key']]
-
-        # Get tp/fp/fn counts for this document
-        if input_type == 'ent':
-            pos_neg, mismatch_rows = get_doc_ent_counts(
-                doc, gold_std, pos_neg, mismatch_rows, check_types)
-
-        elif input_type == 'rel':
+    # Entities are matched for all docs at once
+    if input_type == 'ent':
+        gold_dicts = [gold_standard_dict[d['doc_key']] for d in prediction_dicts]
+        doc_counts, mismatch_rows = get_ent_doc_counts(
+            prediction_dicts, gold_dicts, mismatch_rows, check_types)
+        for name, count in zip(['tp', 'fp', 'fn'], doc_counts.sum(axis=0)):
+            pos_neg[name] = int(count)
+
+    # Relations are matched doc by doc
+    elif input_type == 'rel':
+        for doc in prediction_dicts:
+            gold_std = gold_standard_dict[doc['doc_key']]
             pos_neg = get_doc_rel_counts(doc, gold_std, pos_neg,
                                          doc["doc_key"], check_types, sym_rels)
 
@@ -309,10 +628,460 @@ def get_f1_input(gold_standard_dicts,
     return (predicted, gold, matched, mismatch_rows)
 
 
+def get_rel_doc_counts(prediction_dicts, gold_dicts, check_types=False,
+                       sym_rels=None):
+    """
+    Get the true/false positives and false negatives for relation prediction
+    separately for every document.
+
+    parameters:
+        prediction_dicts, list of dict: dygiepp formatted predictions
+        gold_dicts, list of dict: gold standard for each document in
+            prediction_dicts, in the same order
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+
+    returns:
+        doc_counts, array of int: shape (len(prediction_dicts), 3), where the
+            columns are tp, fp and fn
+    """
+    doc_counts = np.zeros((len(prediction_dicts), 3), dtype=np.int64)
+    for i, (doc, gold_std) in enumerate(zip(prediction_dicts, gold_dicts)):
+        pos_neg = get_doc_rel_counts(doc, gold_std, {'tp': 0, 'fp': 0, 'fn': 0},
+                                     doc['doc_key'], check_types, sym_rels)
+        doc_counts[i] = [pos_neg['tp'], pos_neg['fp'], pos_neg['fn']]
+
+    return doc_counts
+
+
+def get_rel_level_doc_counts(prediction_dicts, gold_dicts, hierarchy,
+                             sym_rels=None):
+    """
+    Get the true/false positives and false negatives for relation prediction
+    at every level of the type hierarchy, for every document. Each relation's
+    key at each level has its type replaced by the type's ancestor at that
+    level, so one pass over the sentences scores all levels. The order of the
+    entities is ignored if the relation's own type is symmetric.
+
+    parameters:
+        prediction_dicts, list of dict: dygiepp formatted predictions
+        gold_dicts, list of dict: gold standard for each document in
+            prediction_dicts, in the same order
+        hierarchy, TypeHierarchy: relation type hierarchy
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+
+    returns:
+        level_counts, array of int: shape (len(prediction_dicts),
+            len(LEVELS), 3), where the last axis is tp, fp and fn
+    """
+    # Look up the ancestors of every type in the batch at once
+    rel_types = sorted({
+        rel[4]
+        for docs, rel_key in [(prediction_dicts, 'predicted_relations'),
+                              (gold_dicts, 'relations')] for doc in docs
+        for sent in doc[rel_key] for rel in sent
+    })
+    level_ids = hierarchy.get_level_ids(rel_types).T.tolist()
+    type_levels = dict(zip(rel_types, level_ids))
+    sym_rels = set() if sym_rels is None else set(sym_rels)
+
+    def get_level_keys(sent):
+        keys = []
+        for rel in sent:
+            ent1 = (rel[0], rel[1])
+            ent2 = (rel[2], rel[3])
+            if rel[4] in sym_rels:
+                ent1, ent2 = min(ent1, ent2), max(ent1, ent2)
+            keys.append([ent1 + ent2 + (level_id, )
+                         for level_id in type_levels[rel[4]]])
+        return keys
+
+    level_counts = np.zeros((len(prediction_dicts), len(LEVELS), 3),
+                            dtype=np.int64)
+    for i, (doc, gold_std) in enumerate(zip(prediction_dicts, gold_dicts)):
+        for pred_sent, gold_sent in zip(doc['predicted_relations'],
+                                        gold_std['relations']):
+            pred_keys = get_level_keys(pred_sent)
+            gold_keys = get_level_keys(gold_sent)
+            for level in range(len(LEVELS)):
+                pred_index = {keys[level] for keys in pred_keys}
+                gold_index = {keys[level] for keys in gold_keys}
+                tp = sum(keys[level] in gold_index for keys in pred_keys)
+                fn = sum(keys[level] not in pred_index for keys in gold_keys)
+                level_counts[i, level] += [tp, len(pred_keys) - tp, fn]
+
+    return level_counts
+
+
+def get_doc_counts(gold_standard_dicts, prediction_dicts, input_type,
+                   check_types=False, sym_rels=None):
+    """
+    Get the number of true and false positives and false negatives separately
+    for every document, so that bootstrap samples can be scored without
+    repeating the matching.
+
+    parameters:
+        gold_standard_dicts, list of dict: dygiepp formatted annotations
+        prediction_dicts, list of dict: dygiepp formatted predictions
+        input_type, str: 'ent' or 'rel', determines which of the prediction
+            types will be evaluated
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+
+    returns:
+        doc_counts, array of int: shape (len(prediction_dicts), 3), where the
+            columns are tp, fp and fn, in the order of prediction_dicts
+    """
+    gold_standard_dict = {d['doc_key']: d for d in gold_standard_dicts}
+    gold_dicts = [gold_standard_dict[d['doc_key']] for d in prediction_dicts]
+
+    if input_type == 'ent':
+        doc_counts, _ = get_ent_doc_counts(prediction_dicts, gold_dicts, {},
+                                           check_types)
+    elif input_type == 'rel':
+        doc_counts = get_rel_doc_counts(prediction_dicts, gold_dicts,
+                                        check_types, sym_rels)
+
+    return doc_counts
+
+
+def compute_f1_arrays(predicted, gold, matched):
+    """
+    Elementwise version of compute_f1 for arrays of counts. Divisions by zero
+    give 0, as they do in compute_f1.
+
+    parameters:
+        predicted, array of int: true positives + false positives
+        gold, array of int: true positives + false negatives
+        matched, array of int: true positives
+
+    returns:
+        prec, rec, f1: arrays of float
+    """
+    predicted = np.asarray(predicted, dtype=float)
+    gold = np.asarray(gold, dtype=float)
+    matched = np.asarray(matched, dtype=float)
+
+    prec = np.divide(matched, predicted, out=np.zeros_like(matched),
+                     where=predicted > 0)
+    rec = np.divide(matched, gold, out=np.zeros_like(matched), where=gold > 0)
+    f1 = np.divide(2 * prec * rec, prec + rec, out=np.zeros_like(prec),
+                   where=(prec + rec) > 0)
+
+    return prec, rec, f1
+
+
+def get_ent_score_matches(pred_scores, join, num_gold):
+    """
+    Get what a threshold sweep needs to know about matched entities: the
+    score of each prediction, how many true positives it's worth, and, for
+    each gold entity, the best score of any prediction that matches it.
+
+    parameters:
+        pred_scores, array of float: one score per prediction, NaN where the
+            prediction has no score
+        join, tuple: output of join_keys for these predictions
+        num_gold, int: number of gold entities in the join
+
+    returns:
+        scores, array of float: prediction scores, predictions without a
+            score get inf so that no threshold removes them
+        pred_tp, array of int: true positives for each prediction
+        gold_best, array of float: best matching score for each gold entity,
+            -inf if no prediction matches it
+    """
+    pred_matches, _, gold_order, match_starts = join
+    scores = np.where(np.isnan(pred_scores), np.inf, pred_scores)
+
+    # Positions in gold_order of every prediction's block of matches
+    block_starts = np.cumsum(pred_matches) - pred_matches
+    rows = np.repeat(match_starts - block_starts, pred_matches) + np.arange(
+        pred_matches.sum())
+    gold_best = np.full(num_gold, -np.inf)
+    np.maximum.at(gold_best, gold_order[rows], np.repeat(scores, pred_matches))
+
+    return scores, pred_matches, gold_best
+
+
+def get_rel_score_matches(prediction_dicts, gold_dicts, score_col,
+                          check_types=False, sym_rels=None):
+    """
+    Relation version of get_ent_score_matches. Each prediction is matched
+    once, against an index of its sentence's gold relations.
+
+    parameters:
+        prediction_dicts, list of dict: dygiepp formatted predictions
+        gold_dicts, list of dict: gold standard for each document in
+            prediction_dicts, in the same order
+        score_col, str: 'logit' or 'softmax', the prediction score to use
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+
+    returns:
+        scores, array of float: prediction scores, inf where missing
+        pred_tp, array of int: 1 for predictions that are in the gold
+            standard, 0 otherwise
+        gold_best, array of float: best matching score for each gold
+            relation, -inf if no prediction matches it
+    """
+    score_idx = 5 + SCORE_COLS[score_col]
+    scores = []
+    pred_tp = []
+    gold_best = []
+    for doc, gold_std in zip(prediction_dicts, gold_dicts):
+        for pred_sent, gold_sent in zip(doc['predicted_relations'],
+                                        gold_std['relations']):
+            gold_keys = [
+                get_rel_index_keys(gold, check_types, sym_rels)
+                for gold in gold_sent
+            ]
+            gold_index = {key for keys in gold_keys for key in keys}
+            best = {}
+            for pred in pred_sent:
+                score = pred[score_idx] if len(pred) > score_idx else np.inf
+                key = get_rel_key(pred, check_types, sym_rels)
+                scores.append(score)
+                if key in gold_index:
+                    pred_tp.append(1)
+                    best[key] = max(best.get(key, -np.inf), score)
+                else:
+                    pred_tp.append(0)
+            gold_best.extend(
+                max(best.get(key, -np.inf) for key in keys)
+                for keys in gold_keys)
+
+    return (np.array(scores, dtype=float), np.array(pred_tp, dtype=np.int64),
+            np.array(gold_best, dtype=float))
+
+
+def get_threshold_curve(scores, pred_tp, gold_best):
+    """
+    Get precision, recall and F1 at every score threshold at once. Predictions
+    are sorted by descending score, so the counts for keeping everything
+    scoring at least a given threshold are cumulative sums up to the last
+    prediction with that score.
+
+    parameters:
+        scores, array of float: prediction scores
+        pred_tp, array of int: true positives for each prediction
+        gold_best, array of float: best matching score for each gold
+            annotation
+
+    returns:
+        thresholds, array of float: distinct prediction scores, descending
+        prec, rec, f1: arrays of float, performance when only predictions
+            scoring at least each threshold are kept
+    """
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    tp = np.cumsum(pred_tp[order])
+
+    # A prediction is one false positive if it matches nothing, or as many
+    # true positives as it matches, as in get_ent_doc_counts
+    predicted = np.cumsum(np.maximum(pred_tp, 1)[order])
+
+    # One point per distinct score, at the last prediction with that score
+    last = np.ones(len(scores), dtype=bool)
+    last[:-1] = sorted_scores[1:] != sorted_scores[:-1]
+    thresholds = sorted_scores[last]
+    tp = tp[last]
+    predicted = predicted[last]
+
+    # Gold annotations are found once their best match is kept
+    sorted_gold = np.sort(gold_best)
+    gold_found = len(gold_best) - np.searchsorted(sorted_gold, thresholds,
+                                                  'left')
+    fn = len(gold_best) - gold_found
+
+    prec, rec, f1 = compute_f1_arrays(predicted, tp + fn, tp)
+
+    return thresholds, prec, rec, f1
+
+
+def iter_boot_weights(num_docs, num_boot, rng, max_cells=2**22):
+    """
+    Generate bootstrap resamples as multinomial weight matrices, where entry
+    (b, d) is the number of times document d was drawn in resample b. Draws
+    are yielded in chunks so that memory stays bounded for large corpora.
+
+    parameters:
+        num_docs, int: number of documents to resample
+        num_boot, int: total number of bootstrap samples to draw
+        rng, numpy Generator: source of randomness
+        max_cells, int: maximum number of matrix entries per chunk
+
+    yields:
+        weights, array of int: shape (chunk_size, num_docs)
+    """
+    chunk_size = max(1, max_cells // max(num_docs, 1))
+    probs = np.full(num_docs, 1 / num_docs)
+    for start in range(0, num_boot, chunk_size):
+        size = min(chunk_size, num_boot - start)
+        yield rng.multinomial(num_docs, probs, size=size)
+
+
+def boot_samples_from_counts(doc_counts, num_boot, rng=None):
+    """
+    Draw bootstrap samples from per-document tp/fp/fn counts. Each resample's
+    totals are the product of its weight row with the count matrix.
+
+    parameters:
+        doc_counts, array of int: shape (num_docs, 3), columns tp, fp, fn
+        num_boot, int: number of bootstrap samples to draw
+        rng, numpy Generator or None: source of randomness, a new unseeded
+            generator is used if None
+
+    returns:
+        prec_samples, array of float: precision values for bootstraps
+        rec_samples, array of float: recall values for bootstraps
+        f1_samples, array of float: f1 values for bootstraps
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    num_docs = doc_counts.shape[0]
+
+    # With no documents every sample is empty
+    if num_docs == 0:
+        return tuple(np.zeros(num_boot) for _ in range(3))
+
+    totals = np.concatenate([
+        weights @ doc_counts
+        for weights in iter_boot_weights(num_docs, num_boot, rng)
+    ])
+    tp, fp, fn = totals[:, 0], totals[:, 1], totals[:, 2]
+
+    return compute_f1_arrays(tp + fp, tp + fn, tp)
+
+
+def align_doc_counts(doc_keys, doc_counts, all_doc_keys):
+    """
+    Put per-document counts in the order of all_doc_keys, with zeros for
+    documents that aren't in doc_keys. A document with no counts adds nothing
+    to a resample's totals, just as it adds nothing to the full evaluation.
+
+    parameters:
+        doc_keys, list of str: doc_key of each row of doc_counts
+        doc_counts, array of int: shape (len(doc_keys), 3)
+        all_doc_keys, list of str: documents to align to
+
+    returns:
+        aligned, array of int: shape (len(all_doc_keys), 3)
+    """
+    doc_idxs = {key: i for i, key in enumerate(all_doc_keys)}
+    aligned = np.zeros((len(all_doc_keys), 3), dtype=np.int64)
+    aligned[[doc_idxs[key] for key in doc_keys]] = doc_counts
+
+    return aligned
+
+
+def paired_boot_f1(count_arrays, num_boot, rng=None):
+    """
+    Score the same bootstrap resamples for several sets of per-document
+    counts. The counts are stacked side by side, so every weight matrix is
+    drawn once and multiplied against all of them together.
+
+    parameters:
+        count_arrays, list of array of int: each of shape (num_docs, 3) with
+            columns tp, fp, fn, rows aligned to the same documents
+        num_boot, int: number of bootstrap samples to draw
+        rng, numpy Generator or None: source of randomness, a new unseeded
+            generator is used if None
+
+    returns:
+        f1_samples, array of float: shape (len(count_arrays), num_boot)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    num_docs = count_arrays[0].shape[0]
+
+    # With no documents every sample is empty
+    if num_docs == 0:
+        return np.zeros((len(count_arrays), num_boot))
+
+    stacked = np.concatenate(count_arrays, axis=1)
+    totals = np.concatenate([
+        weights @ stacked
+        for weights in iter_boot_weights(num_docs, num_boot, rng)
+    ]).reshape(num_boot, len(count_arrays), 3)
+    tp, fp, fn = totals[:, :, 0], totals[:, :, 1], totals[:, :, 2]
+
+    return compute_f1_arrays(tp + fp, tp + fn, tp)[2].T
+
+
+def get_paired_comparisons(model_counts, num_boot, rng=None):
+    """
+    Compare every pair of models on the same bootstrap resamples of the
+    documents. For each pair, the win rate is the fraction of resamples in
+    which the first model has the higher F1, and the p-value is two-sided:
+    twice the fraction of resamples in which the difference doesn't have the
+    same sign as it does on the full set of documents.
+
+    parameters:
+        model_counts, list of dict: per-document counts of each model, as
+            returned by get_model_rows
+        num_boot, int: number of bootstrap samples to draw
+        rng, numpy Generator or None: source of randomness
+
+    returns:
+        paired_rows, dict: keys are paired df columns, values are lists
+    """
+    paired_cols = [
+        'pred_file_a', 'pred_file_b', 'pred_type', 'F1_a', 'F1_b',
+        'win_rate', 'p_value'
+    ]
+    paired_rows = {k: [] for k in paired_cols}
+
+    # Every model is resampled over the same documents
+    all_doc_keys = sorted(
+        set(key for counts in model_counts for key in counts['doc_keys']))
+    columns = []
+    count_arrays = []
+    for i, counts in enumerate(model_counts):
+        for pred_type in ['ent', 'rel']:
+            if counts[pred_type] is not None:
+                columns.append((i, pred_type))
+                count_arrays.append(
+                    align_doc_counts(counts['doc_keys'], counts[pred_type],
+                                     all_doc_keys))
+    if len(count_arrays) == 0:
+        return paired_rows
+    f1_samples = paired_boot_f1(count_arrays, num_boot, rng)
+    tp, fp, fn = np.array([arr.sum(axis=0) for arr in count_arrays]).T
+    full_f1 = compute_f1_arrays(tp + fp, tp + fn, tp)[2]
+    col_idxs = {col: j for j, col in enumerate(columns)}
+
+    for a, b in combinations(range(len(model_counts)), 2):
+        for pred_type in ['ent', 'rel']:
+            if (a, pred_type) not in col_idxs or (b,
+                                                  pred_type) not in col_idxs:
+                continue
+            j_a, j_b = col_idxs[(a, pred_type)], col_idxs[(b, pred_type)]
+            diffs = f1_samples[j_a] - f1_samples[j_b]
+            full_diff = full_f1[j_a] - full_f1[j_b]
+            if full_diff > 0:
+                p_value = 2 * np.mean(diffs <= 0)
+            elif full_diff < 0:
+                p_value = 2 * np.mean(diffs >= 0)
+            else:
+                p_value = 1.0
+            paired_rows['pred_file_a'].append(model_counts[a]['pred_file'])
+            paired_rows['pred_file_b'].append(model_counts[b]['pred_file'])
+            paired_rows['pred_type'].append(pred_type)
+            paired_rows['F1_a'].append(full_f1[j_a])
+            paired_rows['F1_b'].append(full_f1[j_b])
+            paired_rows['win_rate'].append(np.mean(diffs > 0))
+            paired_rows['p_value'].append(min(p_value, 1.0))
+
+    return paired_rows
+
+
 def draw_boot_samples(pred_dicts, gold_std_dicts, num_boot, input_type,
-                        check_types=False, sym_rels=None):
+                        check_types=False, sym_rels=None, rng=None):
     """
-    Draw bootstrap samples.
+    Draw bootstrap samples. Matching is only done once; the resamples are
+    scored from the per-document counts.
 
     parameters:
         pred_dicts, list of dict: dicts of model predictions
@@ -322,47 +1091,323 @@ def draw_boot_samples(pred_dicts, gold_std_dicts, num_boot, input_type,
         check_types, bool: Whether or not to consider types in evaluations
         sym_rels, list of str or None: whether any of the relations to be
             checked are symmetrical
+        rng, numpy Generator or None: source of randomness
 
     returns:
-        prec_samples, list of float: list of precision values for bootstraps
-        rec_samples, list of float: list of recall values for bootstraps
-        f1_samples, list of float: list of f1 values for bootstraps
+        prec_samples, array of float: precision values for bootstraps
+        rec_samples, array of float: recall values for bootstraps
+        f1_samples, array of float: f1 values for bootstraps
     """
-    prec_samples = []
-    rec_samples = []
-    f1_samples = []
+    doc_counts = get_doc_counts(gold_std_dicts, pred_dicts, input_type,
+                                check_types, sym_rels)
+
+    return boot_samples_from_counts(doc_counts, num_boot, rng)
 
-    # Draw the boot samples
-    for _ in range(num_boot):
 
-        # Sample prediction dicts with replacement
-        pred_samp = np.random.choice(pred_dicts,
-                                     size=len(pred_dicts),
-                                     replace=True)
+def load_gold_standard(gold_std_file, cache_dir=None):
+    """
+    Read in the gold standard and index it by doc_key. Warns if there are no
+    relation annotations.
+
+    parameters:
+        gold_std_file, str: path to the gold standard jsonl
+        cache_dir, str or None: if given, the gold standard is compiled into
+            this directory the first time it's used, and memory-mapped from
+            there on later runs instead of being parsed
+
+    returns:
+        gold_std_dict, dict or CompiledGold: keys are doc_keys, values are
+            the gold standard dicts for each doc
+    """
+    if cache_dir is not None:
+        gold_std_dict = load_compiled_gold(gold_std_file, cache_dir)
+        gold_rels = gold_std_dict.has_relations()
+    else:
+        gold_std_dict = {}
+        with jsonlines.open(gold_std_file) as reader:
+            for obj in reader:
+                gold_std_dict[obj['doc_key']] = obj
+        gold_rels = any(
+            len(sent) != 0 for doc in gold_std_dict.values()
+            for sent in doc['relations'])
+
+    # Check if there are any relations in the gold standard
+    if not gold_rels:
+        warnings.warn(
+            '\n\nThere are no gold standard relation annotations. '
+            'Performance values and CIs will be 0 for models that predict '
+            'relations, please disregard.')
 
-        # Get indices of the sampled instances in the pred_dicts list
-        idx_list = [pred_dicts.index(i) for i in pred_samp]
+    return gold_std_dict
 
-        # Since the lists are sorted the same, can use indices to get equivalent
-        # docs in gold std
-        gold_samp = np.array([gold_std_dicts[i] for i in idx_list])
 
-        # Calculate performance for the sample
-        pred, gold, match, _ = get_f1_input(gold_samp, pred_samp, input_type,
-                                            check_types=check_types, sym_rels=sym_rels)
-        prec, rec, f1 = compute_f1(pred, gold, match)
+def load_hierarchy(annotation_conf):
+    """
+    Read the entity and relation type hierarchies from an annotation.conf.
+    Entity types are lowercased to match the way they're compared.
 
-        # Append each of the performance values to their respective sample lists
-        prec_samples.append(prec)
-        rec_samples.append(rec)
-        f1_samples.append(f1)
+    parameters:
+        annotation_conf, str: path to annotation.conf
 
-    return (prec_samples, rec_samples, f1_samples)
+    returns:
+        hierarchy, dict of TypeHierarchy: keys are 'entities' and
+            'relations'
+    """
+    hierarchies = read_annotation_conf(annotation_conf)
+    empty = TypeHierarchy([], [])
+    return {
+        'entities': hierarchies.get('entities', empty).lowercase(),
+        'relations': hierarchies.get('relations', empty)
+    }
+
+
+def iter_pred_batches(pred_file, batch_size=None):
+    """
+    Read in a prediction file in batches of documents.
+
+    parameters:
+        pred_file, str: path to the prediction jsonl
+        batch_size, int or None: number of documents per batch. If None, the
+            whole file is read in as one batch, sorted by doc_key.
+
+    yields:
+        pred_dicts, list of dict: a batch of prediction dicts
+    """
+    with jsonlines.open(pred_file) as reader:
+        if batch_size is None:
+            yield sorted(reader, key=lambda d: d['doc_key'])
+            return
+        batch = []
+        for obj in reader:
+            batch.append(obj)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) != 0:
+            yield batch
+
+
+def get_batch_counts(pred_dicts, gold_std_dict, mismatch_rows,
+                     check_types=False, sym_rels=None, score_matches=None,
+                     score_col='softmax', hierarchy=None, level_counts=None):
+    """
+    Match a batch of prediction documents against the gold standard and get
+    per-document counts for entities and relations. Documents that aren't in
+    the gold standard are skipped.
+
+    parameters:
+        pred_dicts, list of dict: dygiepp formatted predictions
+        gold_std_dict, dict or CompiledGold: gold standard read in by
+            load_gold_standard
+        mismatch_rows, dict: if save_mismatches, keys are mismatch col names,
+            values are lists. Else, empty dict
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+        score_matches, dict or None: see get_pred_file_counts
+        score_col, str: 'logit' or 'softmax', the score used for
+            score_matches
+        hierarchy, dict or None: type hierarchies from load_hierarchy,
+            required if level_counts is given
+        level_counts, dict or None: see get_pred_file_counts
+
+    returns:
+        ent_counts, array of int: shape (num_docs, 3), tp/fp/fn per doc
+        rel_counts, array of int or None: same as ent_counts for relations,
+            None if the predictions don't include relations
+        doc_keys, list of str: doc_key of each row of the counts
+        mismatch_rows, dict: updated mismatch_rows
+    """
+    # Make sure all prediction files are also in the gold standard
+    for doc in pred_dicts:
+        if doc['doc_key'] not in gold_std_dict:
+            verboseprint(
+                f'Document {doc["doc_key"]} is not in the gold standard. '
+                'Skipping this document for performance calculation.')
+    pred_dicts = [doc for doc in pred_dicts if doc['doc_key'] in gold_std_dict]
+    doc_keys = [d['doc_key'] for d in pred_dicts]
+
+    # A compiled gold standard already has its entities flattened, so
+    # only relations need to be built as lists
+    if isinstance(gold_std_dict, CompiledGold):
+        gold_arrays = gold_std_dict.get_ent_arrays(doc_keys)
+        gold_dicts = [gold_std_dict.get_doc(k, ['relations']) for k in doc_keys]
+    else:
+        gold_arrays = None
+        gold_dicts = [gold_std_dict[k] for k in doc_keys]
+
+    ent_counts, mismatch_rows = get_ent_doc_counts(
+        pred_dicts, gold_dicts, mismatch_rows, check_types, gold_arrays,
+        None if score_matches is None else score_matches['ent'], score_col,
+        None if level_counts is None else hierarchy['entities'],
+        None if level_counts is None else level_counts['ent'])
+    if all('predicted_relations' in d for d in pred_dicts):
+        rel_counts = get_rel_doc_counts(pred_dicts, gold_dicts, check_types,
+                                        sym_rels)
+        if score_matches is not None:
+            score_matches['rel'].append(
+                get_rel_score_matches(pred_dicts, gold_dicts, score_col,
+                                      check_types, sym_rels))
+        if level_counts is not None:
+            level_counts['rel'].append(
+                get_rel_level_doc_counts(pred_dicts, gold_dicts,
+                                         hierarchy['relations'], sym_rels))
+    else:
+        rel_counts = None
+
+    return ent_counts, rel_counts, doc_keys, mismatch_rows
+
+
+def get_map_set_counts(pred_file, map_sets, check_types=False, sym_rels=None,
+                       stream_batch=None, score_col='softmax', hierarchy=None):
+    """
+    Match every document in a prediction file against one or more gold
+    standards, each with its own type maps, and get per-document counts for
+    entities and relations. The prediction file is only read once; each map
+    set evaluates a mapped view of the predictions, so the predictions
+    themselves are never modified.
+
+    If stream_batch is given, predictions are read and matched that many
+    documents at a time, so only the current batch and the per-document
+    counts are held in memory.
+
+    parameters:
+        pred_file, str: path to the prediction jsonl
+        map_sets, list of dict: each has the keys 'name', 'gold_std_dict',
+            'entity_map' and 'relation_map' (maps are '' to leave types as
+            they are), plus 'mismatch_rows', 'score_matches' and
+            optionally 'level_counts' as described in get_pred_file_counts,
+            which are updated in place
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+        stream_batch, int or None: number of documents per batch, or None to
+            read the whole file at once
+        score_col, str: 'logit' or 'softmax', the score used for
+            score_matches
+        hierarchy, dict or None: type hierarchies from load_hierarchy, for
+            map sets with level_counts
+
+    returns:
+        set_counts, list of tuple: for each map set, ent_counts, rel_counts
+            and doc_keys as returned by get_pred_file_counts
+    """
+    counts = [{'ent': [], 'rel': [], 'doc_keys': []} for _ in map_sets]
+    pred_rels = [True for _ in map_sets]
+    dropped = [[0, 0] for _ in map_sets]
+    for pred_dicts in iter_pred_batches(pred_file, stream_batch):
+        for i, map_set in enumerate(map_sets):
+
+            # Map types if requested
+            if map_set['entity_map'] != '':
+                set_dicts, de, dr = map_jsonl_view(pred_dicts,
+                                                   map_set['entity_map'],
+                                                   map_set['relation_map'])
+                dropped[i][0] += de
+                dropped[i][1] += dr
+            else:
+                set_dicts = pred_dicts
+
+            # Get counts for this batch
+            ent_counts, rel_counts, doc_keys, map_set[
+                'mismatch_rows'] = get_batch_counts(
+                    set_dicts, map_set['gold_std_dict'],
+                    map_set['mismatch_rows'], check_types, sym_rels,
+                    map_set['score_matches'], score_col, hierarchy,
+                    map_set.get('level_counts'))
+            counts[i]['ent'].append(ent_counts)
+            counts[i]['doc_keys'].extend(doc_keys)
+            if pred_rels[i] and rel_counts is not None:
+                counts[i]['rel'].append(rel_counts)
+            else:
+                pred_rels[i] = False
+
+    set_counts = []
+    empty = [np.zeros((0, 3), dtype=np.int64)]
+    for map_set, set_count, set_rels, (de, dr) in zip(map_sets, counts,
+                                                      pred_rels, dropped):
+        if map_set['entity_map'] != '':
+            name = '' if map_set['name'] is None else f' ({map_set["name"]})'
+            verboseprint(
+                f'{de} entities were dropped{name} because their types '
+                f'didn\'t have an equivalent, and {dr} relations were dropped '
+                'for the same reason or because they relied on a dropped '
+                'entity.')
+        ent_counts = np.concatenate(set_count['ent'] + empty)
+        rel_counts = np.concatenate(set_count['rel'] +
+                                    empty) if set_rels else None
+        set_counts.append((ent_counts, rel_counts, set_count['doc_keys']))
+
+    return set_counts
+
+
+def get_pred_file_counts(pred_file, gold_std_dict, mismatch_rows,
+                         map_types=False, entity_map='', relation_map='',
+                         check_types=False, sym_rels=None, stream_batch=None,
+                         score_matches=None, score_col='softmax',
+                         hierarchy=None, level_counts=None):
+    """
+    Match every document in a prediction file against the gold standard and
+    get per-document counts for entities and relations.
+
+    If stream_batch is given, predictions are read and matched that many
+    documents at a time, so only the current batch and the per-document
+    counts are held in memory.
+
+    parameters:
+        pred_file, str: path to the prediction jsonl
+        gold_std_dict, dict: gold standard read in by load_gold_standard
+        mismatch_rows, dict: if save_mismatches, keys are mismatch col names,
+            values are lists. Else, empty dict
+        map_types, bool: whether or not to may prediction types to new ontology
+        entity_map, dict: entity map if map_types, else ''
+        relation_map, dict: relation map if map_types, else ''
+        check_types, bool: Whether or not to consider types in evaluations
+        sym_rels, list of str or None: whether any of the relations to be
+            checked are symmetrical
+        stream_batch, int or None: number of documents per batch, or None to
+            read the whole file at once
+        score_matches, dict or None: if given, keys are 'ent' and 'rel', and
+            the scores and matches of every prediction are appended to the
+            lists under them, to be concatenated for get_threshold_curve
+        score_col, str: 'logit' or 'softmax', the score used for
+            score_matches
+        hierarchy, dict or None: type hierarchies from load_hierarchy,
+            required if level_counts is given
+        level_counts, dict or None: if given, keys are 'ent' and 'rel', and
+            the per-document counts at every level of the type hierarchy
+            are appended to the lists under them, see get_ent_level_counts
+
+    returns:
+        ent_counts, array of int: shape (num_docs, 3), tp/fp/fn per doc
+        rel_counts, array of int or None: same as ent_counts for relations,
+            None if the predictions don't include relations
+        mismatch_rows, dict: updated mismatch_rows
+        doc_keys, list of str: doc_key of each row of the counts
+    """
+    map_set = {
+        'name': None,
+        'gold_std_dict': gold_std_dict,
+        'entity_map': entity_map if map_types else '',
+        'relation_map': relation_map if map_types else '',
+        'mismatch_rows': mismatch_rows,
+        'score_matches': score_matches,
+        'level_counts': level_counts
+    }
+    ent_counts, rel_counts, doc_keys = get_map_set_counts(
+        pred_file, [map_set], check_types, sym_rels, stream_batch,
+        score_col, hierarchy)[0]
+
+    return ent_counts, rel_counts, map_set['mismatch_rows'], doc_keys
 
 
 def get_performance_row(pred_file, gold_std_file, bootstrap,
                         num_boot, df_rows, mismatch_rows, map_types=False, entity_map='',
-                        relation_map='', check_types=False, sym_rels=None):
+                        relation_map='', check_types=False, sym_rels=None,
+                        gold_std_dict=None, stream_batch=None,
+                        curve_rows=None, score_col='softmax',
+                        doc_counts=None, counts=None, hierarchy=None,
+                        level_rows=None):
     """
     Gets performance metrics and returns as a list.
 
@@ -381,6 +1426,28 @@ def get_performance_row(pred_file, gold_std_file, bootstrap,
         check_types, bool: Whether or not to consider types in evaluations
         sym_rels, list of str or None: whether any of the relations to be
             checked are symmetrical
+        gold_std_dict, dict or None: gold standard already read in by
+            load_gold_standard. If None, gold_std_file is read in.
+        stream_batch, int or None: if given, the prediction file is evaluated
+            this many documents at a time instead of being read in all at
+            once
+        curve_rows, dict or None: if given, keys are curve col names, and the
+            precision/recall curve over score thresholds is appended to the
+            lists in place
+        score_col, str: 'logit' or 'softmax', the prediction score that
+            thresholds are applied to
+        doc_counts, dict or None: if given, the per-document counts are
+            stored in it in place under 'doc_keys', 'ent' and 'rel', for
+            paired comparisons between models
+        counts, tuple or None: if the predictions have already been matched
+            by get_map_set_counts, a tuple of the ent_counts, rel_counts,
+            doc_keys, score_matches and level_counts to use instead of
+            reading pred_file
+        hierarchy, dict or None: type hierarchies from load_hierarchy,
+            required if level_rows is given and counts isn't
+        level_rows, dict or None: if given, keys are level col names, and
+            the performance at every level of the type hierarchy is appended
+            to the lists in place
 
 
     returns:
@@ -388,69 +1455,72 @@ def get_performance_row(pred_file, gold_std_file, bootstrap,
         mismatch_rows, dict: mismtach_updated if save_mismatches, else empty
             dict
     """
-    # Read in the files
-    gold_std_dicts = []
-    with jsonlines.open(gold_std_file) as reader:
-        for obj in reader:
-            gold_std_dicts.append(obj)
-    pred_dicts = []
-    with jsonlines.open(pred_file) as reader:
-        for obj in reader:
-            pred_dicts.append(obj)
-
-    # Map types if requested
-    if map_types:
-        verboseprint(
-            '\nMapping entity and relation types to chosen ontologies...')
-        de, dr = map_jsonl(pred_dicts, entity_map, relation_map)
-        verboseprint(
-            f'{de} entities were dropped because their types didn\'t '
-            f'have an equivalent, and {dr} relations were dropped for the same '
-            'reason or because they relied on a dropped entity.')
+    # Read in the gold standard if it wasn't passed
+    if gold_std_dict is None and counts is None:
+        gold_std_dict = load_gold_standard(gold_std_file)
 
-    # Make sure all prediction files are also in the gold standard
-    gold_doc_keys = [g['doc_key'] for g in gold_std_dicts]
-    for doc in pred_dicts:
-        if doc['doc_key'] in gold_doc_keys:
-            continue
-        else:
+    # Match the predictions
+    if counts is not None:
+        ent_counts, rel_counts, doc_keys, score_matches, level_counts = counts
+    else:
+        if map_types:
             verboseprint(
-                f'Document {doc["doc_key"]} is not in the gold standard. '
-                'Skipping this document for performance calculation.')
-            _ = pred_dicts.remove(doc)
-
-    # Sort pred and gold lists by doc key to ensure they're in the same order
-    gold_std_dicts = sorted(gold_std_dicts, key=lambda d: d['doc_key'])
-    pred_dicts = sorted(pred_dicts, key=lambda d: d['doc_key'])
-
-    # Check if the predictions include relations
-    pred_rels = True
-    try:
-        [d['predicted_relations'] for d in pred_dicts]
-    except KeyError:
-        pred_rels = False
+                '\nMapping entity and relation types to chosen ontologies...')
+        score_matches = None if curve_rows is None else {'ent': [], 'rel': []}
+        level_counts = None if level_rows is None else {'ent': [], 'rel': []}
+        ent_counts, rel_counts, mismatch_rows, doc_keys = get_pred_file_counts(
+            pred_file, gold_std_dict, mismatch_rows, map_types, entity_map,
+            relation_map, check_types, sym_rels, stream_batch, score_matches,
+            score_col, hierarchy, level_counts)
+    pred_rels = rel_counts is not None
+    if doc_counts is not None:
+        doc_counts.update({
+            'doc_keys': doc_keys,
+            'ent': ent_counts,
+            'rel': rel_counts
+        })
+
+    # Precision/recall at every score threshold
+    if curve_rows is not None:
+        for pred_type in ['ent', 'rel']:
+            if pred_type == 'rel' and not pred_rels:
+                continue
 
-    # Check if there are any relations in the gold standard
-    gold_rels = False
-    for doc in gold_std_dicts:
-        for sent in doc['relations']:
-            if len(sent) != 0:
-                gold_rels = True
-    if not gold_rels:
-        warnings.warn(
-            '\n\nThere are no gold standard relation annotations. '
-            'Performance values and CIs will be 0 for models that predict '
-            'relations, please disregard.')
+            # No curve for prediction files without any documents
+            if len(score_matches[pred_type]) == 0:
+                continue
+            scores, pred_tp, gold_best = [
+                np.concatenate(arrs) for arrs in zip(*score_matches[pred_type])
+            ]
+            curve = get_threshold_curve(scores, pred_tp, gold_best)
+            curve_rows['pred_file'].extend([basename(pred_file)] *
+                                           len(curve[0]))
+            curve_rows['pred_type'].extend([pred_type] * len(curve[0]))
+            for col, vals in zip(['threshold', 'precision', 'recall', 'F1'],
+                                 curve):
+                curve_rows[col].extend(vals.tolist())
+
+    # Performance at each level of the type hierarchy
+    if level_rows is not None:
+        for pred_type in ['ent', 'rel']:
+            if pred_type == 'rel' and not pred_rels:
+                continue
+            tp, fp, fn = np.concatenate(
+                level_counts[pred_type] +
+                [np.zeros((0, len(LEVELS), 3), dtype=np.int64)]).sum(axis=0).T
+            level_rows['pred_file'].extend([basename(pred_file)] *
+                                           len(LEVELS))
+            level_rows['pred_type'].extend([pred_type] * len(LEVELS))
+            level_rows['level'].extend(LEVELS)
+            for col, vals in zip(['precision', 'recall', 'F1'],
+                                 compute_f1_arrays(tp + fp, tp + fn, tp)):
+                level_rows[col].extend(vals.tolist())
 
     # Bootstrap sampling
     if bootstrap:
-        ent_boot_samples = draw_boot_samples(pred_dicts, gold_std_dicts,
-                                             num_boot, 'ent', check_types,
-                                             sym_rels)
+        ent_boot_samples = boot_samples_from_counts(ent_counts, num_boot)
         if pred_rels:
-            rel_boot_samples = draw_boot_samples(pred_dicts, gold_std_dicts,
-                                                 num_boot, 'rel', check_types,
-                                                 sym_rels)
+            rel_boot_samples = boot_samples_from_counts(rel_counts, num_boot)
 
         # Calculate confidence interval
         ent_CIs = calculate_CI(ent_boot_samples[0], ent_boot_samples[1],
@@ -489,13 +1559,11 @@ def get_performance_row(pred_file, gold_std_file, bootstrap,
 
     else:
         # Calculate performance
-        pred_ent, gold_ent, match_ent, mismatch_rows = get_f1_input(
-            gold_std_dicts, pred_dicts, 'ent', mismatch_rows, check_types=check_types)
-        ent_means = compute_f1(pred_ent, gold_ent, match_ent)
+        tp, fp, fn = ent_counts.sum(axis=0)
+        ent_means = compute_f1(tp + fp, tp + fn, tp)
         if pred_rels:
-            pred_rel, gold_rel, match_rel, _ = get_f1_input(
-                gold_std_dicts, pred_dicts, 'rel', check_types, sym_rels)
-            rel_means = compute_f1(pred_rel, gold_rel, match_rel)
+            tp, fp, fn = rel_counts.sum(axis=0)
+            rel_means = compute_f1(tp + fp, tp + fn, tp)
         else:
             rel_means = [np.nan for i in range(3)]
 
@@ -511,8 +1579,151 @@ def get_performance_row(pred_file, gold_std_file, bootstrap,
         return df_rows, mismatch_rows
 
 
+def get_model_rows(pred_file, gold_std_file, gold_std_dict, cols,
+                   mismatch_cols, eval_kwargs, curve_cols=None,
+                   keep_counts=False, map_sets=None, level_cols=None):
+    """
+    Evaluate a single prediction file into new row dicts.
+
+    parameters:
+        pred_file, str: path to the prediction file
+        gold_std_file, str: path to the gold standard file
+        gold_std_dict, dict: gold standard read in by load_gold_standard
+        cols, list of str: performance df columns
+        mismatch_cols, list of str: mismatch df columns, empty if mismatches
+            aren't being saved
+        eval_kwargs, dict: the rest of the arguments to get_performance_row
+        curve_cols, list of str or None: threshold curve df columns, None if
+            thresholds aren't being swept
+        keep_counts, bool: whether to return the per-document counts
+        map_sets, list of dict or None: if given, the predictions are read
+            in once and evaluated against each of these instead of
+            gold_std_dict. Each has the keys 'name', 'gold_std_file',
+            'gold_std_dict', 'entity_map' and 'relation_map', and every row
+            gets a 'map_name' column.
+        level_cols, list of str or None: type hierarchy level df columns,
+            None if performance isn't being broken down by level
+
+    returns:
+        df_rows, dict: performance rows for this model
+        mismatch_rows, dict: mismatch rows for this model, empty dict if
+            mismatch_cols is empty
+        curve_rows, dict or None: threshold curve rows for this model, None
+            if curve_cols is None
+        doc_counts, list of dict or None: per-document counts for this model,
+            one per map set, None if keep_counts is False
+        level_rows, dict or None: hierarchy level rows for this model, None
+            if level_cols is None
+    """
+    verboseprint(f'\nEvaluating model predictions from file {pred_file}...')
+    df_rows = {k: [] for k in cols}
+    mismatch_rows = {k: [] for k in mismatch_cols}
+    curve_rows = None if curve_cols is None else {k: [] for k in curve_cols}
+    level_rows = None if level_cols is None else {k: [] for k in level_cols}
+    doc_counts = [] if keep_counts else None
+
+    if map_sets is None:
+        model_counts = {} if keep_counts else None
+        df_rows, mismatch_rows = get_performance_row(pred_file, gold_std_file,
+                                                     df_rows=df_rows,
+                                                     mismatch_rows=mismatch_rows,
+                                                     gold_std_dict=gold_std_dict,
+                                                     curve_rows=curve_rows,
+                                                     doc_counts=model_counts,
+                                                     level_rows=level_rows,
+                                                     **eval_kwargs)
+        if keep_counts:
+            doc_counts.append(model_counts)
+
+    else:
+        # Match the predictions against every map set in one read
+        set_kwargs = []
+        for map_set in map_sets:
+            set_kwargs.append(dict(map_set))
+            set_kwargs[-1]['mismatch_rows'] = {k: [] for k in mismatch_cols}
+            set_kwargs[-1]['score_matches'] = None if curve_cols is None else {
+                'ent': [],
+                'rel': []
+            }
+            set_kwargs[-1]['level_counts'] = None if level_cols is None else {
+                'ent': [],
+                'rel': []
+            }
+        set_counts = get_map_set_counts(pred_file, set_kwargs,
+                                        eval_kwargs['check_types'],
+                                        eval_kwargs['sym_rels'],
+                                        eval_kwargs['stream_batch'],
+                                        eval_kwargs['score_col'],
+                                        eval_kwargs['hierarchy'])
+
+        # Then score each one, labelling its rows with the map set's name
+        row_kwargs = {
+            k: v
+            for k, v in eval_kwargs.items()
+            if k in ['bootstrap', 'num_boot', 'check_types', 'sym_rels']
+        }
+        for map_set, (ent_counts, rel_counts,
+                      doc_keys) in zip(set_kwargs, set_counts):
+            set_rows = {k: [] for k in cols if k != 'map_name'}
+            set_curve_rows = None
+            if curve_cols is not None:
+                set_curve_rows = {k: [] for k in curve_cols if k != 'map_name'}
+            set_level_rows = None
+            if level_cols is not None:
+                set_level_rows = {k: [] for k in level_cols if k != 'map_name'}
+            set_doc_counts = {} if keep_counts else None
+            set_rows, set_mismatch_rows = get_performance_row(
+                pred_file,
+                map_set['gold_std_file'],
+                df_rows=set_rows,
+                mismatch_rows=map_set['mismatch_rows'],
+                curve_rows=set_curve_rows,
+                doc_counts=set_doc_counts,
+                level_rows=set_level_rows,
+                counts=(ent_counts, rel_counts, doc_keys,
+                        map_set['score_matches'], map_set['level_counts']),
+                **row_kwargs)
+            for rows, new_rows in [(df_rows, set_rows),
+                                   (mismatch_rows, set_mismatch_rows),
+                                   (curve_rows, set_curve_rows),
+                                   (level_rows, set_level_rows)]:
+                if rows is None or len(rows.keys()) == 0:
+                    continue
+                num_new = len(next(iter(new_rows.values()), []))
+                for k, v in new_rows.items():
+                    rows[k].extend(v)
+                if 'map_name' in rows:
+                    rows['map_name'].extend([map_set['name']] * num_new)
+            if keep_counts:
+                set_doc_counts['map_name'] = map_set['name']
+                doc_counts.append(set_doc_counts)
+
+    # Add the model string onto the mismatch rows
+    if len(mismatch_rows.keys()) != 0:
+        mismatch_rows['model'] = [
+            pred_file for i in range(len(mismatch_rows['doc_key']))
+        ]
+    if keep_counts:
+        for model_counts in doc_counts:
+            model_counts['pred_file'] = basename(pred_file)
+
+    return df_rows, mismatch_rows, curve_rows, doc_counts, level_rows
+
+
+def get_model_rows_worker(pred_file):
+    """
+    Pool worker for get_model_rows, reads everything but the prediction file
+    from worker_args, so that workers share the parsed gold standard instead
+    of each reading their own copy.
+    """
+    return get_model_rows(pred_file, **worker_args)
+
+
 def main(gold_standard, out_name, predictions, check_types, bootstrap, num_boot,
-         save_mismatches, map_types, entity_map, relation_map, sym_rels):
+         save_mismatches, map_types, entity_map, relation_map, sym_rels,
+         workers=1, stream_batch=None, gold_cache=None,
+         sweep_thresholds=False, score_col='softmax', paired=False,
+         map_sets=None, hierarchy=None):
 
     # Some setup before performance calculation
     verboseprint('\nCalculating performance...')
@@ -528,6 +1739,8 @@ def main(gold_standard, out_name, predictions, check_types, bootstrap, num_boot,
             'pred_file', 'gold_std_file', 'ent_precision', 'ent_recall',
             'ent_F1', 'rel_precision', 'rel_recall', 'rel_F1'
         ]
+    if map_sets is not None:
+        cols.insert(2, 'map_name')
     df_rows = {k: [] for k in cols}
     if save_mismatches:
         # 'mismatch_type' column: 1 if the model correctly matched the gold
@@ -540,12 +1753,35 @@ def main(gold_standard, out_name, predictions, check_types, bootstrap, num_boot,
             'doc_key', 'mismatch_type', 'sent_num', 'gold_ent_list',
             'gold_ent_type', 'pred_ent_list', 'pred_ent_type', 'model'
         ]
+        if map_sets is not None:
+            mismatch_cols.append('map_name')
         mismatch_rows = {k: [] for k in mismatch_cols}
     else:
         # To avoid having to add too much code, if the user doesn't want
         # mismatches, will just add nothing to an empty dict to allow the same
         # returns
+        mismatch_cols = []
         mismatch_rows = {}
+    if sweep_thresholds:
+        curve_cols = [
+            'pred_file', 'pred_type', 'threshold', 'precision', 'recall', 'F1'
+        ]
+        if map_sets is not None:
+            curve_cols.insert(1, 'map_name')
+        curve_rows = {k: [] for k in curve_cols}
+    else:
+        curve_cols = None
+    if hierarchy is not None:
+        level_cols = [
+            'pred_file', 'pred_type', 'level', 'precision', 'recall', 'F1'
+        ]
+        if map_sets is not None:
+            level_cols.insert(1, 'map_name')
+        level_rows = {k: [] for k in level_cols}
+        verboseprint(f'\nReading in type hierarchy from {hierarchy}...')
+        hierarchy = load_hierarchy(hierarchy)
+    else:
+        level_cols = None
 
     # Read in the maps
     if entity_map != '':
@@ -555,28 +1791,80 @@ def main(gold_standard, out_name, predictions, check_types, bootstrap, num_boot,
         with open(relation_map) as myf:
             relation_map = json.load(myf)
 
+    # Read in the gold standard once for all models
+    verboseprint(f'\nReading in gold standard from {gold_standard}...')
+    gold_std_dict = load_gold_standard(gold_standard, gold_cache)
+
+    # And the gold standards and maps of each map set. Map sets without
+    # their own gold standard use the main one
+    if map_sets is not None:
+        set_list = []
+        gold_dicts = {gold_standard: gold_std_dict}
+        for name, map_set in map_sets.items():
+            set_gold = map_set.get('gold_standard', gold_standard)
+            if set_gold not in gold_dicts:
+                verboseprint(f'\nReading in gold standard for map set {name} '
+                             f'from {set_gold}...')
+                gold_dicts[set_gold] = load_gold_standard(set_gold, gold_cache)
+            set_maps = {}
+            for map_name in ['entity_map', 'relation_map']:
+                set_maps[map_name] = map_set.get(map_name, '')
+                if set_maps[map_name] != '':
+                    with open(set_maps[map_name]) as myf:
+                        set_maps[map_name] = json.load(myf)
+            set_list.append({
+                'name': name,
+                'gold_std_file': set_gold,
+                'gold_std_dict': gold_dicts[set_gold],
+                **set_maps
+            })
+        map_sets = set_list
+
     # Calculate performance
-    for model in predictions:
-        verboseprint(f'\nEvaluating model predictions from file {model}...')
-        df_rows, mismatch_rows = get_performance_row(model, gold_standard,
-                                                     bootstrap,
-                                                     num_boot, df_rows,
-                                                     mismatch_rows=mismatch_rows, map_types=map_types,
-                                                     entity_map=entity_map, relation_map=relation_map,
-                                                     check_types=check_types,
-                                                     sym_rels=sym_rels)
-
-        if save_mismatches:
-            # Add the model string onto the mismatch_rows df
-            mismatch_col_lens = list(
-                set([len(v) for k, v in mismatch_rows.items()]))
-            assert len(mismatch_col_lens) == 2
-            missing_model_name_num = abs(mismatch_col_lens[0] -
-                                         mismatch_col_lens[1])
-            missing_model_names = [
-                model for i in range(missing_model_name_num)
-            ]
-            mismatch_rows['model'].extend(missing_model_names)
+    model_args = {
+        'gold_std_file': gold_standard,
+        'gold_std_dict': gold_std_dict,
+        'cols': cols,
+        'mismatch_cols': mismatch_cols,
+        'curve_cols': curve_cols,
+        'keep_counts': paired,
+        'map_sets': map_sets,
+        'level_cols': level_cols,
+        'eval_kwargs': {
+            'bootstrap': bootstrap,
+            'num_boot': num_boot,
+            'map_types': map_types,
+            'entity_map': entity_map,
+            'relation_map': relation_map,
+            'check_types': check_types,
+            'sym_rels': sym_rels,
+            'stream_batch': stream_batch,
+            'score_col': score_col,
+            'hierarchy': hierarchy
+        }
+    }
+    if workers > 1:
+        verboseprint(f'\nEvaluating {len(predictions)} models with '
+                     f'{workers} workers...')
+    model_results = run_tasks(get_model_rows_worker, predictions, workers,
+                              model_args, chunksize=1)
+
+    # Merge rows in the order the prediction files were given
+    model_counts = []
+    for (model_rows, model_mismatch_rows, model_curve_rows, model_doc_counts,
+         model_level_rows) in model_results:
+        for k in cols:
+            df_rows[k].extend(model_rows[k])
+        for k in mismatch_cols:
+            mismatch_rows[k].extend(model_mismatch_rows[k])
+        if sweep_thresholds:
+            for k in curve_cols:
+                curve_rows[k].extend(model_curve_rows[k])
+        if paired:
+            model_counts.extend(model_doc_counts)
+        if hierarchy is not None:
+            for k in level_cols:
+                level_rows[k].extend(model_level_rows[k])
 
     # Make df
     verboseprint('\nMaking dataframe...')
@@ -597,6 +1885,51 @@ def main(gold_standard, out_name, predictions, check_types, bootstrap, num_boot,
         verboseprint(f'\nSaving mismatch file as {mismatch_out_name}')
         mismatch_df.to_csv(mismatch_out_name, index=False)
 
+    # Save the threshold curves, and the F1-optimal threshold of each one.
+    # Curves run from the highest threshold down, so ties go to the highest
+    if sweep_thresholds:
+        curve_df = pd.DataFrame(curve_rows, columns=curve_cols)
+        best_df = curve_df.loc[curve_df.groupby(['pred_file', 'pred_type'],
+                                                sort=False)['F1'].idxmax()]
+        verboseprint(f'\nF1-optimal thresholds:\n{best_df}')
+        curve_out_name = splitext(out_name)[0] + '_PR_CURVE.csv'
+        verboseprint(f'\nSaving threshold curves as {curve_out_name}')
+        curve_df.to_csv(curve_out_name, index=False)
+        best_out_name = splitext(out_name)[0] + '_BEST_THRESHOLDS.csv'
+        verboseprint(f'\nSaving best thresholds as {best_out_name}')
+        best_df.to_csv(best_out_name, index=False)
+
+    # Save the performance at each level of the type hierarchy
+    if hierarchy is not None:
+        level_df = pd.DataFrame(level_rows, columns=level_cols)
+        verboseprint(f'\nPerformance by hierarchy level:\n{level_df}')
+        level_out_name = splitext(out_name)[0] + '_HIERARCHY.csv'
+        verboseprint(f'\nSaving hierarchy levels as {level_out_name}')
+        level_df.to_csv(level_out_name, index=False)
+
+    # Compare models on shared resamples
+    if paired:
+        verboseprint('\nComparing models on paired bootstrap samples...')
+        if map_sets is None:
+            paired_df = pd.DataFrame(
+                get_paired_comparisons(model_counts, num_boot))
+        else:
+            # Models are only compared within the same map set
+            set_dfs = []
+            for map_set in map_sets:
+                set_df = pd.DataFrame(
+                    get_paired_comparisons([
+                        counts for counts in model_counts
+                        if counts['map_name'] == map_set['name']
+                    ], num_boot))
+                set_df.insert(2, 'map_name', map_set['name'])
+                set_dfs.append(set_df)
+            paired_df = pd.concat(set_dfs, ignore_index=True)
+        verboseprint(f'Snapshot of dataframe:\n{paired_df.head()}')
+        paired_out_name = splitext(out_name)[0] + '_PAIRED.csv'
+        verboseprint(f'\nSaving paired comparisons as {paired_out_name}')
+        paired_df.to_csv(paired_out_name, index=False)
+
     verboseprint('\nDone!\n')
 
 
@@ -651,7 +1984,8 @@ if __name__ == "__main__":
         help='Path to relation map, required if --map_types is provided',
         default='')
     parser.add_argument('-sym_rels', type=str, nargs='+',
-        help='Relations that should be evaluated symmetrically',
+        help='Relations that should be evaluated symmetrically. Their types '
+        'are compared even without --check_types',
         default='')
     parser.add_argument(
         '--save_mismatches',
@@ -659,6 +1993,74 @@ if __name__ == "__main__":
         help='Whether or not to save the types and numbers of  mismatches '
         'for all models. To be used in downstream analysis. Can only be '
         'specified if --bootstrap is not specified.')
+    parser.add_argument(
+        '-workers',
+        type=int,
+        help='Number of processes to use. Each process evaluates a share of '
+        'the prediction files against the same gold standard, which is only '
+        'read in once. Default is 1.',
+        default=1)
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Read and evaluate prediction files a batch of documents at a '
+        'time instead of loading them whole. Use for prediction files that '
+        'are too large to fit comfortably in memory.')
+    parser.add_argument(
+        '-stream_batch',
+        type=int,
+        help='Number of documents per batch if --stream is specified, '
+        'default is 1000',
+        default=1000)
+    parser.add_argument(
+        '-gold_cache',
+        type=str,
+        help='Directory to keep compiled gold standards in. The first run '
+        'against a gold standard compiles it into a binary form here, and '
+        'later runs memory-map that instead of parsing the jsonl. Entries are '
+        'keyed by the gold standard\'s contents, so edits are picked up.',
+        default=None)
+    parser.add_argument(
+        '-map_sets',
+        type=str,
+        help='Path to a json file of named map sets to evaluate every model '
+        'against in one run, instead of -entity_map and -relation_map. Keys '
+        'are names, values are dicts with the keys "entity_map" and '
+        '"relation_map" (paths to maps, leave out to keep the predicted '
+        'types), and optionally "gold_standard" (path to the gold standard '
+        'for that set, defaults to the gold_standard argument). Each model '
+        'gets one row per map set.',
+        default=None)
+    parser.add_argument(
+        '--paired',
+        action='store_true',
+        help='Whether or not to test whether differences in F1 between '
+        'models are significant. Every model is scored on the same -num_boot '
+        'bootstrap resamples of the documents, and the win rate and p-value '
+        'for each pair of models are saved as <out_name>_PAIRED.csv.')
+    parser.add_argument(
+        '--sweep_thresholds',
+        action='store_true',
+        help='Also calculate precision, recall and F1 at every prediction '
+        'score threshold, for entities and relations. Saves the curves as '
+        '<out_name>_PR_CURVE.csv and the F1-optimal threshold for each model '
+        'as <out_name>_BEST_THRESHOLDS.csv.')
+    parser.add_argument(
+        '-threshold_score',
+        type=str,
+        choices=['softmax', 'logit'],
+        help='Prediction score to threshold on if --sweep_thresholds is '
+        'specified, default is softmax',
+        default='softmax')
+    parser.add_argument(
+        '-hierarchy',
+        type=str,
+        help='Path to an annotation.conf. If given, entity and relation '
+        'performance is also calculated with types compared at each level '
+        'of its type hierarchy (leaf, parent and root), and saved as '
+        '<out_name>_HIERARCHY.csv. Types are always checked for these '
+        'scores, whether or not --check_types is specified.',
+        default=None)
     parser.add_argument('--verbose',
         '-v',
         action='store_true',
@@ -696,13 +2098,37 @@ if __name__ == "__main__":
     if args.sym_rels == '':
         args.sym_rels = None
 
+    if not args.stream:
+        args.stream_batch = None
+
+    if args.gold_cache is not None:
+        args.gold_cache = abspath(args.gold_cache)
+
+    if args.hierarchy is not None:
+        args.hierarchy = abspath(args.hierarchy)
+
+    # Paths in the map set file are relative to the file itself
+    if args.map_sets is not None:
+        assert not args.map_types, ('-map_sets and --map_types cannot be '
+                                    'specified together, please use one or '
+                                    'the other')
+        map_set_dir = dirname(abspath(args.map_sets))
+        with open(args.map_sets) as myf:
+            args.map_sets = json.load(myf)
+        for map_set in args.map_sets.values():
+            for k in ['gold_standard', 'entity_map', 'relation_map']:
+                if k in map_set:
+                    map_set[k] = abspath(join(map_set_dir, map_set[k]))
+
     verboseprint = print if args.verbose else lambda *a, **k: None
 
     pred_files = [
-        join(args.prediction_dir, f) for f in listdir(args.prediction_dir)
+        join(args.prediction_dir, f) for f in sorted(listdir(args.prediction_dir))
         if f.startswith(args.use_prefix)
     ]
 
     main(args.gold_standard, args.out_name, pred_files, args.check_types,
          args.bootstrap, args.num_boot, args.save_mismatches, args.map_types,
-         args.entity_map, args.relation_map, args.sym_rels)
+         args.entity_map, args.relation_map, args.sym_rels, args.workers,
+         args.stream_batch, args.gold_cache, args.sweep_thresholds,
+         args.threshold_score, args.paired, args.map_sets, args.hierarchy)
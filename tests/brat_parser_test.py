@@ -0,0 +1,92 @@
+"""
+Spot checks for brat_parser.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+
+sys.path.append('../annotation/abstract_scripts')
+import brat_parser as bp
+
+
+@pytest.fixture
+def ann():
+    return ('T1\tProtein 0 5;9 12\tsome text\n'
+            'T2\tProtein 20 25\tother\r\n'
+            '\n'
+            'R1\tinteracts Arg1:T1 Arg2:T2\n'
+            'E1\tBinding:T3 Theme:T1 Theme2:T2\n'
+            'E2\tcauses Arg1:T1 Arg2:T2\n'
+            'A1\tNegation E1\n'
+            'M1\tConfidence E1 High\n'
+            '#1\tAnnotatorNotes T1\ta note\n'
+            '*\tEquiv T1 T2\n')
+
+
+def test_parse_ann_entities(ann):
+
+    brat_ann = bp.parse_ann(ann)
+
+    assert brat_ann.entities == {
+        'T1': bp.Entity('T1', 'Protein', ((0, 5), (9, 12)), 'some text'),
+        'T2': bp.Entity('T2', 'Protein', ((20, 25),), 'other')
+    }
+
+
+def test_parse_ann_entity_offsets():
+
+    brat_ann = bp.parse_ann('T1\tPROTEIN 24 29\tPROT1\n'
+                            'T2\tPROTEIN 24 29;42 44;79 82\tPROT1 PR O1\n')
+
+    assert brat_ann.entities['T1'].offsets == ((24, 29),)
+    assert brat_ann.entities['T2'].offsets == ((24, 29), (42, 44), (79, 82))
+    assert brat_ann.entities['T2'].text == 'PROT1 PR O1'
+
+
+def test_parse_ann_relations(ann):
+
+    brat_ann = bp.parse_ann(ann)
+    rel = brat_ann.relations['R1']
+
+    assert rel == bp.Relation('R1', 'interacts',
+                              (('Arg1', 'T1'), ('Arg2', 'T2')))
+    assert (rel.arg1, rel.arg2) == ('T1', 'T2')
+
+
+def test_parse_ann_events(ann):
+
+    brat_ann = bp.parse_ann(ann)
+
+    assert brat_ann.events == {
+        'E1': bp.Event('E1', 'Binding', 'T3',
+                       (('Theme', 'T1'), ('Theme2', 'T2'))),
+        'E2': bp.Event('E2', 'causes', None, (('Arg1', 'T1'), ('Arg2', 'T2')))
+    }
+
+
+def test_parse_ann_attributes_notes_other(ann):
+
+    brat_ann = bp.parse_ann(ann)
+
+    assert brat_ann.attributes == {
+        'A1': bp.Attribute('A1', 'Negation', 'E1', None),
+        'M1': bp.Attribute('M1', 'Confidence', 'E1', 'High')
+    }
+    assert brat_ann.notes == {
+        '#1': bp.Note('#1', 'AnnotatorNotes', 'T1', 'a note')
+    }
+    assert brat_ann.other == ['*\tEquiv T1 T2']
+
+
+def test_format_ann_line_round_trip(ann):
+
+    brat_ann = bp.parse_ann(ann)
+    records = []
+    for kind in brat_ann[:5]:
+        records.extend(kind.values())
+    records.extend(brat_ann.other)
+    lines = [bp.format_ann_line(record) for record in records]
+
+    expected = [line.rstrip('\r') for line in ann.split('\n') if line.strip()]
+    assert sorted(lines) == sorted(expected)
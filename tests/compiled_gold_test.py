@@ -0,0 +1,71 @@
+"""
+Spot checks for compiled_gold.py
+
+Author: Serena G. Lotreck
+"""
+import sys
+from os import listdir
+
+sys.path.append('../models/')
+
+import jsonlines
+import numpy as np
+import compiled_gold as cg
+
+
+class TestCompiledGold:
+    def setup_method(self):
+        self.docs = [{
+            'doc_key': 'doc1',
+            'ner': [[[0, 1, 'Protein'], [3, 3, 'Gene']], [], [[9, 10,
+                                                                'Gene']]],
+            'relations': [[[0, 1, 3, 3, 'interacts']], [], []]
+        }, {
+            'doc_key': 'doc2',
+            'ner': [[[0, 0, 'Gene']]],
+            'relations': [[]]
+        }]
+
+    def write_gold(self, tmp_path, docs):
+        gold_std_file = str(tmp_path / 'gold.jsonl')
+        with jsonlines.open(gold_std_file, 'w') as writer:
+            writer.write_all(docs)
+        return gold_std_file
+
+    def test_round_trip(self, tmp_path):
+        gold_std_file = self.write_gold(tmp_path, self.docs)
+        gold = cg.load_compiled_gold(gold_std_file, str(tmp_path / 'cache'))
+
+        assert list(gold) == ['doc1', 'doc2']
+        assert gold.has_relations()
+        assert gold['doc1']['relations'] == self.docs[0]['relations']
+        assert gold['doc1']['ner'] == [[[0, 1, 'protein'], [3, 3, 'gene']],
+                                       [], [[9, 10, 'gene']]]
+
+    def test_reuses_cache(self, tmp_path):
+        gold_std_file = self.write_gold(tmp_path, self.docs)
+        cg.load_compiled_gold(gold_std_file, str(tmp_path / 'cache'))
+        cg.load_compiled_gold(gold_std_file, str(tmp_path / 'cache'))
+
+        assert len(listdir(tmp_path / 'cache')) == 1
+
+    def test_changed_gold_recompiles(self, tmp_path):
+        gold_std_file = self.write_gold(tmp_path, self.docs)
+        cg.load_compiled_gold(gold_std_file, str(tmp_path / 'cache'))
+        gold_std_file = self.write_gold(tmp_path, self.docs[:1])
+        gold = cg.load_compiled_gold(gold_std_file, str(tmp_path / 'cache'))
+
+        assert len(listdir(tmp_path / 'cache')) == 2
+        assert list(gold) == ['doc1']
+
+    def test_get_ent_arrays(self, tmp_path):
+        gold_std_file = self.write_gold(tmp_path, self.docs)
+        gold = cg.load_compiled_gold(gold_std_file, str(tmp_path / 'cache'))
+        ent_arr, scores, ent_types, ner_sents = gold.get_ent_arrays(
+            ['doc2', 'doc1'])
+
+        assert ent_types == ['protein', 'gene']
+        assert ner_sents.tolist() == [1, 3]
+        assert ent_arr.tolist() == [[0, 0, 0, 0, 1], [1, 0, 0, 1, 0],
+                                    [1, 0, 3, 3, 1], [1, 2, 9, 10, 1]]
+        assert np.isnan(scores).all()
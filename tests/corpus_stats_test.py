@@ -0,0 +1,199 @@
+"""
+Spot checks for corpus_stats.py
+
+Author: Serena G. Lotreck
+"""
+import sys
+import types
+
+sys.path.append('../annotation/abstract_scripts')
+
+import jsonlines
+import pandas as pd
+import corpus_stats as cs
+
+
+class StubToken:
+    def __init__(self, idx):
+        self.idx = idx
+
+
+class StubSpan:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.start_char = tokens[0].idx
+
+    def __len__(self):
+        return len(self.tokens)
+
+
+class StubDoc:
+    """
+    Whitespace tokens, with a sentence ending at every token that ends in a
+    period.
+    """
+    def __init__(self, text):
+        self.tokens = []
+        self.sent_ends = []
+        idx = 0
+        for word in text.split():
+            idx = text.index(word, idx)
+            self.tokens.append(StubToken(idx))
+            idx += len(word)
+            if word.endswith('.'):
+                self.sent_ends.append(len(self.tokens))
+
+    @property
+    def sents(self):
+        start = 0
+        for end in self.sent_ends:
+            yield StubSpan(self.tokens[start:end])
+            start = end
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+
+class StubNLP:
+    def pipe(self, texts, as_tuples=False, batch_size=None, n_process=None):
+        for text, context in texts:
+            yield StubDoc(text), context
+
+
+class TestCorpusStats:
+    def setup_method(self):
+        self.docs = [{
+            'doc_key': 'doc1',
+            'sentences': [['a', 'b', 'c'], ['d', 'e']],
+            'ner': [[[0, 0, 'X'], [1, 2, 'Y']], [[3, 3, 'X']]],
+            'relations': [[[0, 0, 1, 2, 'r']], []]
+        }, {
+            'doc_key': 'doc2',
+            'sentences': [['a']],
+            'ner': [[]],
+            'relations': [[]],
+            'predicted_ner': [[[0, 0, 'X']]]
+        }]
+
+        self.ann_strs = {
+            'doc1.ann': ('T1\tX 0 1\ta\nT2\tY 2 3\tb\n'
+                         'R1\tr Arg1:T1 Arg2:T2\n'),
+            'doc2.ann': 'T1\tX 0 1\ta\n'
+        }
+
+    def write_jsonl(self, tmp_path):
+        corpus_file = str(tmp_path / 'corpus.jsonl')
+        with jsonlines.open(corpus_file, 'w') as writer:
+            writer.write_all(self.docs)
+        return corpus_file
+
+    def test_get_annotation_stats_dygiepp(self, tmp_path):
+
+        ann_stats_df = cs.get_annotation_stats_dygiepp(
+            self.write_jsonl(tmp_path))
+
+        assert ann_stats_df['entities'].tolist() == [3, 1.5, 1.5, 1.5, 3, 0]
+        assert ann_stats_df['relations'].tolist() == [1, 0.5, 0.5, 0.5, 1, 0]
+
+    def test_get_text_stats_dygiepp(self, tmp_path):
+
+        text_stats_df = cs.get_text_stats_dygiepp(self.write_jsonl(tmp_path))
+
+        assert text_stats_df['tokens'].tolist() == [6, 3, 2, 3, 5, 1]
+
+    def test_get_corpus_stats_predicted(self, tmp_path):
+
+        corpus_stats = cs.get_corpus_stats(self.write_jsonl(tmp_path),
+                                           'dygiepp', predicted=True)
+
+        assert corpus_stats['entities'].summary()[0] == 1
+
+    def test_get_annotation_stats_brat(self, tmp_path):
+        for name, ann_str in self.ann_strs.items():
+            (tmp_path / name).write_text(ann_str)
+
+        ann_stats_df = cs.get_annotation_stats_brat(str(tmp_path))
+
+        assert ann_stats_df['entities'].tolist() == [3, 1.5, 0.5, 1.5, 2, 1]
+
+    def test_get_corpus_stats_brat(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(sys.modules, 'spacy',
+                            types.SimpleNamespace(
+                                load=lambda model, exclude: StubNLP()))
+        (tmp_path / 'doc1.txt').write_text('Alpha binds beta. Gamma is here.')
+        (tmp_path / 'doc1.ann').write_text(
+            'T1\tPROT 0 5\tAlpha\n'
+            'T2\tPROT 6 17;18 23\tbinds beta. Gamma\n'
+            'T3\tCHEM 24 32\tis here.\n'
+            'R1\tinteracts Arg1:T1 Arg2:T2\n'
+            'R2\tinteracts Arg1:T1 Arg2:T3\n')
+        profile = cs.DistributionProfile()
+
+        corpus_stats = cs.get_corpus_stats(str(tmp_path), 'brat',
+                                           profile=profile)
+
+        assert corpus_stats['sentences'].summary()[0] == 2
+        assert corpus_stats['tokens'].summary()[0] == 6
+        assert corpus_stats['entities'].summary()[0] == 3
+        assert corpus_stats['relations'].summary()[0] == 2
+        assert profile.span_widths['PROT'].items() == [(1, 1), (3, 1)]
+        assert profile.span_widths['CHEM'].items() == [(2, 1)]
+        assert profile.sentence_lengths.items() == [(3, 2)]
+        assert profile.relation_types.items() == [('interacts', 2)]
+        assert profile.cross_sentence_relations.items() == [('interacts', 1)]
+
+    def test_profile_brat_without_ann(self, tmp_path, monkeypatch):
+        monkeypatch.setitem(sys.modules, 'spacy',
+                            types.SimpleNamespace(
+                                load=lambda model, exclude: StubNLP()))
+        (tmp_path / 'doc1.txt').write_text('Alpha binds beta.')
+        (tmp_path / 'doc1.ann').write_text('T1\tPROT 0 5\tAlpha\n')
+        (tmp_path / 'doc2.txt').write_text('Gamma.')
+        profile = cs.DistributionProfile()
+
+        corpus_stats = cs.get_corpus_stats(str(tmp_path), 'brat',
+                                           profile=profile)
+
+        assert corpus_stats['entities'].summary()[0] == 1
+        assert profile.sentence_lengths.items() == [(1, 1), (3, 1)]
+        assert profile.entity_types.items() == [('PROT', 1)]
+
+    def test_main_side_by_side(self, tmp_path):
+        corpus_file = self.write_jsonl(tmp_path)
+        other_file = str(tmp_path / 'other.jsonl')
+        with jsonlines.open(other_file, 'w') as writer:
+            writer.write_all(self.docs[:1])
+
+        cs.main([corpus_file, other_file], 'dygiepp', str(tmp_path))
+
+        comparison = (tmp_path /
+                      'corpus_comparison_annotation_stats.csv').read_text()
+        assert comparison.splitlines()[0] == (',corpus,corpus,other,other')
+        assert (tmp_path / 'other_text_stats.csv').exists()
+
+    def test_profile_dygiepp(self, tmp_path):
+        self.docs[0]['relations'][1] = [[3, 3, 0, 0, 'r']]
+        profile = cs.DistributionProfile()
+
+        cs.get_corpus_stats(self.write_jsonl(tmp_path), 'dygiepp',
+                            profile=profile)
+
+        assert profile.entity_types.items() == [('X', 2), ('Y', 1)]
+        assert profile.span_widths['Y'].items() == [(2, 1)]
+        assert profile.sentence_lengths.items() == [(1, 1), (2, 1), (3, 1)]
+        assert profile.relation_types.items() == [('r', 2)]
+        assert profile.cross_sentence_relations.items() == [('r', 1)]
+
+    def test_main_distributions(self, tmp_path):
+        corpus_file = self.write_jsonl(tmp_path)
+
+        cs.main([corpus_file], 'dygiepp', str(tmp_path), distributions=True)
+
+        dist_df = pd.read_csv(tmp_path / 'corpus_distributions.csv')
+        widths = dist_df[dist_df.distribution == 'span_width']
+        assert widths[['label', 'value', 'count']].values.tolist() == [
+            ['X', 1, 2], ['Y', 2, 1]
+        ]
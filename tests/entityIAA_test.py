@@ -0,0 +1,198 @@
+"""
+Spot checks for entityIAA.py
+
+Author: Serena G. Lotreck
+"""
+import re
+import sys
+
+sys.path.append('../annotation/iaa')
+
+import numpy as np
+import entityIAA as eiaa
+
+
+def whitespace_tokenize(text):
+    return np.array([m.span() for m in re.finditer(r'\S+', text)],
+                    dtype=np.int64).reshape(-1, 2)
+
+
+class TestTokenCache:
+    def setup_method(self):
+
+        self.calls = []
+
+        def tokenize(text):
+            self.calls.append(text)
+            return whitespace_tokenize(text)
+
+        self.tokenize = tokenize
+
+    def test_get_memory(self):
+
+        cache = eiaa.TokenCache(self.tokenize, 'ws')
+        first = cache.get('one two three')
+        second = cache.get('one two three')
+
+        assert np.array_equal(first, [[0, 3], [4, 7], [8, 13]])
+        assert np.array_equal(first, second)
+        assert len(self.calls) == 1
+
+    def test_get_disk(self, tmp_path):
+
+        eiaa.TokenCache(self.tokenize, 'ws', str(tmp_path)).get('one two')
+        offsets = eiaa.TokenCache(self.tokenize, 'ws',
+                                  str(tmp_path)).get('one two')
+
+        assert np.array_equal(offsets, [[0, 3], [4, 7]])
+        assert len(self.calls) == 1
+
+
+class TestGetTokenInstances:
+    def test_get_token_instances(self):
+
+        token_offsets = whitespace_tokenize('alpha beta gamma delta')
+        entities = [('PROT', ((0, 7), )), ('DNA', ((11, 16), (17, 22)))]
+
+        instances = eiaa.get_token_instances(entities, token_offsets)
+
+        assert instances == {('PROT', 0), ('PROT', 1), ('DNA', 2),
+                             ('DNA', 3)}
+
+
+class TestGetEntityIAA:
+    def setup_method(self):
+
+        self.text = 'alpha beta gamma delta'
+        self.anns = {
+            'ann1': 'T1\tPROT 0 10\talpha beta\nT2\tDNA 17 22\tdelta\n',
+            'ann2': 'T1\tPROT 0 5\talpha\nT2\tDNA 17 22\tdelta\n',
+            'ann3': 'T1\tPROT 0 10\talpha beta\n'
+        }
+
+    def make_project(self, root):
+
+        for annotator, ann in self.anns.items():
+            (root / annotator / 'second').mkdir(parents=True)
+            (root / annotator / 'second' / 'doc1.txt').write_text(self.text)
+            (root / annotator / 'second' / 'doc1.ann').write_text(ann)
+        # Only one annotator has this one, so it's left out
+        (root / 'ann1' / 'doc2.txt').write_text(self.text)
+        (root / 'ann1' / 'doc2.ann').write_text('')
+
+    def test_get_entity_iaa(self, tmp_path):
+
+        self.make_project(tmp_path)
+        cache = eiaa.TokenCache(whitespace_tokenize, 'ws')
+
+        annotators, docs, agreements = eiaa.get_entity_iaa(
+            str(tmp_path), cache)
+
+        assert annotators == ['ann1', 'ann2', 'ann3']
+        assert docs == ['second/doc1']
+
+        # Pair F1's are 1/2, 2/3 and 0 at the instance level
+        instance = agreements['Instance']
+        assert np.isclose(instance['overall'].loc['overall', 'mean_F1'],
+                          (0.5 + 2 / 3) / 3)
+        assert np.isclose(instance['overall'].loc['overall', 'SD_F1'],
+                          np.std([0.5, 2 / 3, 0]))
+        assert np.allclose(instance['per_label'].loc[['DNA', 'PROT'],
+                                                     'mean_F1'],
+                           [1 / 3, 1 / 3])
+
+        # And 4/5, 4/5 and 1/2 at the token level
+        token = agreements['Token']
+        assert np.isclose(token['overall'].loc['overall', 'mean_F1'],
+                          (0.8 + 0.8 + 0.5) / 3)
+
+    def test_get_entity_iaa_cache(self, tmp_path):
+
+        self.make_project(tmp_path / 'project')
+        project = str(tmp_path / 'project')
+        token_cache = eiaa.TokenCache(whitespace_tokenize, 'ws')
+        iaa_cache = eiaa.IAACache(str(tmp_path / 'cache.json'))
+        eiaa.get_entity_iaa(project, token_cache, iaa_cache=iaa_cache)
+
+        # Only the two comparisons with annotator 3 are redone
+        (tmp_path / 'project' / 'ann3' / 'second' / 'doc1.ann').write_text(
+            'T1\tDNA 17 22\tdelta\n')
+        iaa_cache.hits, iaa_cache.misses = 0, 0
+        _, _, agreements = eiaa.get_entity_iaa(project,
+                                               token_cache,
+                                               iaa_cache=iaa_cache)
+        _, _, expected = eiaa.get_entity_iaa(project, token_cache)
+
+        assert (iaa_cache.hits, iaa_cache.misses) == (1, 2)
+        for level in ['Instance', 'Token']:
+            for name, agreement_df in agreements[level].items():
+                assert agreement_df.equals(expected[level][name])
+
+
+class TestChanceCorrectedAgreement:
+    def setup_method(self):
+
+        # Example from Fleiss (1971), 14 raters and 5 categories
+        self.fleiss_counts = np.array([[0, 0, 0, 0, 14], [0, 2, 6, 4, 2],
+                                       [0, 0, 3, 5, 6], [0, 3, 9, 2, 0],
+                                       [2, 2, 8, 1, 1], [7, 7, 0, 0, 0],
+                                       [3, 2, 6, 3, 0], [2, 5, 3, 2, 2],
+                                       [6, 5, 2, 1, 0], [0, 2, 2, 3, 7]])
+
+        # Nominal example from Krippendorff (2011), 4 coders and 12 units
+        # with missing values
+        codes = [[1, 2, 3, 3, 2, 1, 4, 1, 2, 0, 0, 0],
+                 [1, 2, 3, 3, 2, 2, 4, 1, 2, 5, 0, 3],
+                 [0, 3, 3, 3, 2, 3, 4, 2, 2, 5, 1, 0],
+                 [1, 2, 3, 3, 2, 4, 4, 1, 2, 5, 1, 0]]
+        codes = np.array(codes).T
+        self.alpha_counts = (codes[:, :, None] == np.arange(1, 6)).sum(axis=1)
+
+    def test_fleiss_kappa(self):
+
+        assert np.isclose(eiaa.fleiss_kappa(self.fleiss_counts),
+                          0.2099,
+                          atol=1e-4)
+
+    def test_krippendorff_alpha(self):
+
+        assert np.isclose(eiaa.krippendorff_alpha(self.alpha_counts),
+                          0.743,
+                          atol=1e-3)
+
+    def test_one_label(self):
+
+        counts = np.array([[3, 0], [3, 0]])
+
+        assert np.isnan(eiaa.fleiss_kappa(counts))
+        assert np.isnan(eiaa.krippendorff_alpha(counts))
+
+
+class TestGetMultiAnnotatorAgreement:
+    def test_get_multi_annotator_agreement(self):
+
+        # Two docs, of 3 and 2 tokens, and 3 annotators
+        token_sets = [[{('DNA', 0), ('PROT', 0), ('PROT', 1)}, {('DNA', 1)}],
+                      [{('PROT', 0), ('PROT', 1)}, {('DNA', 1)}],
+                      [{('PROT', 1)}, set()]]
+        num_tokens = np.array([3, 2])
+
+        label_array, valid = eiaa.get_label_array(token_sets, num_tokens,
+                                                  ['DNA', 'PROT'])
+        multi_df = eiaa.get_multi_annotator_agreement(
+            token_sets, num_tokens, ['DNA', 'PROT'])
+
+        assert label_array.shape == (2, 3, 3, 2)
+        assert valid.tolist() == [[True, True, True], [True, True, False]]
+
+        # Overall, annotator 1 labels the first token DNA, since it comes
+        # first
+        overall_counts = np.array([[1, 1, 1], [0, 0, 3], [3, 0, 0],
+                                   [3, 0, 0], [1, 2, 0]])
+        assert np.isclose(multi_df.loc['overall', 'krippendorff_alpha'],
+                          eiaa.krippendorff_alpha(overall_counts))
+        assert np.isclose(multi_df.loc['overall', 'fleiss_kappa'],
+                          eiaa.fleiss_kappa(overall_counts))
+        prot_counts = np.array([[1, 2], [0, 3], [3, 0], [3, 0], [3, 0]])
+        assert np.isclose(multi_df.loc['PROT', 'fleiss_kappa'],
+                          eiaa.fleiss_kappa(prot_counts))
@@ -0,0 +1,57 @@
+"""
+Spot checks for estimate_dygiepp_memory.py
+
+Author: Serena G. Lotreck
+"""
+import sys
+sys.path.append('../models/')
+import jsonlines
+import pandas as pd
+import estimate_dygiepp_memory as edm
+
+
+def test_read_config_settings(tmp_path):
+    config = tmp_path / 'wide.jsonnet'
+    config.write_text('template.DyGIE {\n  max_span_width: 12,\n}\n')
+
+    settings = edm.read_config_settings([str(config)])
+
+    assert settings == {'max_span_width': 12, 'spans_per_word': 0.5}
+
+
+def test_estimate_doc_cost():
+
+    cost = edm.estimate_doc_cost([3, 1], max_span_width=2, span_bytes=1,
+                                 pair_bytes=10)
+
+    # 5 + 1 spans, ceil(1.5)**2 + ceil(0.5)**2 pairs
+    assert cost == {'num_sents': 2, 'num_tokens': 4, 'num_spans': 6,
+                    'num_pairs': 5, 'est_bytes': 56}
+
+
+def test_plan_shards():
+
+    shards = edm.plan_shards([4, 7, 3, 12, 2], budget=10)
+
+    # 12 is over budget and alone, then 7 + 3 and 4 + 2
+    assert shards.tolist() == [2, 1, 1, 0, 2]
+
+
+def test_plan_shards_max_docs():
+
+    shards = edm.plan_shards([1, 1, 1], budget=10, max_docs=2)
+
+    assert shards.tolist() == [0, 0, 1]
+
+
+def test_main(tmp_path):
+    dset_path = str(tmp_path / 'dset.jsonl')
+    with jsonlines.open(dset_path, 'w') as writer:
+        writer.write_all([{'doc_key': 'short', 'sentences': [['a']]},
+                          {'doc_key': 'long', 'sentences': [['a'] * 200]}])
+
+    edm.main(dset_path, str(tmp_path), 10, [], shards=True)
+
+    plan_df = pd.read_csv(tmp_path / 'dset_memory_plan.csv')
+    assert plan_df.over_budget.tolist() == [False, True]
+    assert (tmp_path / 'dset_shard_1.jsonl').exists()
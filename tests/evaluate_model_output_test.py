@@ -8,12 +8,15 @@ import sys
 
 sys.path.append('../models/')
 
+import json
+import jsonlines
 import numpy as np
+import pandas as pd
 import evaluate_model_output as emo
+import type_hierarchy as th
 
-## Didn't write a test for drawing the samples,
-## since it just randomly selects and then uses other funcs
-## that already have tests
+## Drawing the samples is random, so the bootstrap tests only check cases
+## where every resample has to give the same answer
 
 
 class TestCalculateCI:
@@ -43,6 +46,262 @@ class TestCalculateCI:
         assert f1_CI == self.f1_CI
 
 
+class TestComputeF1Arrays:
+    def setup_method(self):
+        self.predicted = [4, 0, 2]
+        self.gold = [2, 3, 0]
+        self.matched = [2, 0, 0]
+
+        self.prec = [0.5, 0, 0]
+        self.rec = [1, 0, 0]
+        self.f1 = [2 / 3, 0, 0]
+
+    def test_compute_f1_arrays(self):
+        prec, rec, f1 = emo.compute_f1_arrays(self.predicted, self.gold,
+                                              self.matched)
+
+        assert np.allclose(prec, self.prec)
+        assert np.allclose(rec, self.rec)
+        assert np.allclose(f1, self.f1)
+
+
+class TestBootSamplesFromCounts:
+    def setup_method(self):
+        # Identical documents, so every resample has the same totals
+        self.doc_counts = np.array([[1, 1, 0], [1, 1, 0], [1, 1, 0]])
+        self.num_boot = 20
+
+    def test_boot_samples_from_counts(self):
+        prec, rec, f1 = emo.boot_samples_from_counts(
+            self.doc_counts, self.num_boot, np.random.default_rng(0))
+
+        assert len(prec) == self.num_boot
+        assert np.allclose(prec, 0.5)
+        assert np.allclose(rec, 1)
+        assert np.allclose(f1, 2 / 3)
+
+    def test_boot_samples_from_counts_no_docs(self):
+        prec, rec, f1 = emo.boot_samples_from_counts(
+            np.zeros((0, 3), dtype=int), self.num_boot)
+
+        assert np.allclose(f1, np.zeros(self.num_boot))
+
+
+class TestAlignDocCounts:
+    def setup_method(self):
+        self.doc_keys = ['doc3', 'doc1']
+        self.doc_counts = np.array([[1, 2, 3], [4, 5, 6]])
+        self.all_doc_keys = ['doc1', 'doc2', 'doc3']
+
+        self.aligned = [[4, 5, 6], [0, 0, 0], [1, 2, 3]]
+
+    def test_align_doc_counts(self):
+        aligned = emo.align_doc_counts(self.doc_keys, self.doc_counts,
+                                       self.all_doc_keys)
+
+        assert aligned.tolist() == self.aligned
+
+
+class TestGetPairedComparisons:
+    def setup_method(self):
+        # Model a gets every doc right and model b gets every doc wrong, so
+        # a wins every resample
+        self.model_counts = [{
+            'pred_file': 'a.jsonl',
+            'doc_keys': ['doc1', 'doc2', 'doc3'],
+            'ent': np.array([[1, 0, 0], [2, 0, 0], [1, 0, 0]]),
+            'rel': None
+        }, {
+            'pred_file': 'b.jsonl',
+            'doc_keys': ['doc1', 'doc2', 'doc3'],
+            'ent': np.array([[0, 1, 1], [0, 2, 2], [0, 1, 1]]),
+            'rel': None
+        }]
+        self.num_boot = 20
+
+    def test_get_paired_comparisons(self):
+        paired_rows = emo.get_paired_comparisons(self.model_counts,
+                                                 self.num_boot,
+                                                 np.random.default_rng(0))
+
+        assert paired_rows['pred_file_a'] == ['a.jsonl']
+        assert paired_rows['pred_file_b'] == ['b.jsonl']
+        assert paired_rows['pred_type'] == ['ent']
+        assert paired_rows['F1_a'] == [1]
+        assert paired_rows['F1_b'] == [0]
+        assert paired_rows['win_rate'] == [1]
+        assert paired_rows['p_value'] == [0]
+
+
+class TestJoinKeys:
+    def setup_method(self):
+        self.pred_keys = np.array([[0, 0, 1, 2], [0, 0, 3, 3], [1, 0, 1, 2]])
+        self.gold_keys = np.array([[0, 0, 1, 2], [0, 1, 5, 6], [0, 0, 1, 2]])
+
+        self.pred_matches = [2, 0, 0]
+        self.gold_matched = [True, False, True]
+
+    def test_join_keys_counts(self):
+        pred_matches, gold_matched, _, _ = emo.join_keys(
+            self.pred_keys, self.gold_keys)
+
+        assert pred_matches.tolist() == self.pred_matches
+        assert gold_matched.tolist() == self.gold_matched
+
+    def test_join_keys_match_block(self):
+        pred_matches, _, gold_order, match_starts = emo.join_keys(
+            self.pred_keys, self.gold_keys)
+        block = gold_order[match_starts[0]:match_starts[0] + pred_matches[0]]
+
+        assert block.tolist() == [0, 2]
+
+    def test_join_keys_empty(self):
+        pred_matches, gold_matched, _, _ = emo.join_keys(
+            np.zeros((0, 4), dtype=int), np.zeros((0, 4), dtype=int))
+
+        assert len(pred_matches) == 0
+        assert len(gold_matched) == 0
+
+
+class TestGetThresholdCurve:
+    def setup_method(self):
+        self.scores = np.array([0.9, 0.5, 0.9, 0.2])
+        self.pred_tp = np.array([1, 0, 0, 1])
+        self.gold_best = np.array([0.9, 0.2, -np.inf])
+
+        self.thresholds = [0.9, 0.5, 0.2]
+        self.prec = [0.5, 1 / 3, 0.5]
+        self.rec = [1 / 3, 1 / 3, 2 / 3]
+        self.f1 = [0.4, 1 / 3, 4 / 7]
+
+    def test_get_threshold_curve(self):
+        thresholds, prec, rec, f1 = emo.get_threshold_curve(
+            self.scores, self.pred_tp, self.gold_best)
+
+        assert np.allclose(thresholds, self.thresholds)
+        assert np.allclose(prec, self.prec)
+        assert np.allclose(rec, self.rec)
+        assert np.allclose(f1, self.f1)
+
+
+class TestGetThresholdCurveDuplicateGold:
+    def setup_method(self):
+        # The gold standard has the same entity twice, so a prediction of it
+        # is two true positives
+        self.gold = [{
+            'doc_key': 'doc1',
+            'ner': [[[0, 0, 'X'], [0, 0, 'X'], [2, 3, 'Y']]]
+        }]
+        self.preds = [{
+            'doc_key': 'doc1',
+            'predicted_ner': [[[0, 0, 'X', 0.1, 0.9], [2, 3, 'Y', 0.1, 0.5],
+                               [5, 5, 'X', 0.1, 0.7]]]
+        }]
+
+    def test_get_threshold_curve_matches_filtered_runs(self):
+        score_matches = []
+        emo.get_ent_doc_counts(self.preds, self.gold, {}, True,
+                               score_matches=score_matches,
+                               score_col='softmax')
+        curve = emo.get_threshold_curve(*score_matches[0])
+
+        for threshold, prec, rec, f1 in zip(*curve):
+            kept = [{
+                'doc_key': 'doc1',
+                'predicted_ner': [[
+                    ent for ent in self.preds[0]['predicted_ner'][0]
+                    if ent[4] >= threshold
+                ]]
+            }]
+            predicted, gold, matched, _ = emo.get_f1_input(
+                self.gold, kept, 'ent', check_types=True)
+            assert np.allclose([prec, rec, f1],
+                               emo.compute_f1_arrays(predicted, gold,
+                                                     matched))
+            assert prec <= 1
+
+
+class TestGetRelScoreMatches:
+    def setup_method(self):
+        self.preds = [{
+            'doc_key': 'doc1',
+            'predicted_relations': [[[0, 1, 3, 4, 'a', 0.1, 0.8],
+                                     [5, 5, 7, 7, 'a', 0.2, 0.3]]]
+        }]
+        self.gold = [{
+            'doc_key': 'doc1',
+            'relations': [[[3, 4, 0, 1, 'a'], [9, 9, 10, 10, 'a']]]
+        }]
+
+        self.scores = [0.8, 0.3]
+        self.pred_tp = [1, 0]
+        self.gold_best = [0.8, -np.inf]
+
+    def test_get_rel_score_matches(self):
+        scores, pred_tp, gold_best = emo.get_rel_score_matches(
+            self.preds, self.gold, 'softmax')
+
+        assert np.allclose(scores, self.scores)
+        assert pred_tp.tolist() == self.pred_tp
+        assert gold_best.tolist() == self.gold_best
+
+
+class TestHierarchyLevelCounts:
+    def setup_method(self):
+        hierarchies = th.parse_annotation_conf(
+            '[entities]\n!Chemical\n\tProtein\n\tDNA\nOrganism\n'
+            '[relations]\n!causal\n\tactivates\n\tinhibits\n'
+            '\tinteracts\n')
+        self.ent_hierarchy = hierarchies['entities'].lowercase()
+        self.rel_hierarchy = hierarchies['relations']
+
+        self.preds = [{
+            'doc_key': 'doc1',
+            'predicted_ner': [[[0, 1, 'Protein'], [3, 4, 'DNA'],
+                               [6, 6, 'Organism']]],
+            'predicted_relations': [[[0, 1, 3, 4, 'interacts'],
+                                     [0, 1, 6, 6, 'activates']]]
+        }]
+        self.gold = [{
+            'doc_key': 'doc1',
+            'ner': [[[0, 1, 'Protein'], [3, 4, 'Protein'], [6, 6, 'DNA']]],
+            'relations': [[[3, 4, 0, 1, 'interacts'],
+                           [0, 1, 6, 6, 'inhibits']]]
+        }]
+
+        # Leaf, parent and root rows of tp, fp, fn
+        self.ent_level_counts = [[1, 2, 2], [2, 1, 1], [2, 1, 1]]
+        self.rel_level_counts = [[1, 1, 1], [2, 0, 0], [2, 0, 0]]
+
+    def test_get_ent_doc_counts_levels(self):
+        level_counts = []
+
+        doc_counts, _ = emo.get_ent_doc_counts(self.preds, self.gold, {},
+                                               check_types=True,
+                                               hierarchy=self.ent_hierarchy,
+                                               level_counts=level_counts)
+
+        assert level_counts[0][0].tolist() == self.ent_level_counts
+        assert level_counts[0][0, 0].tolist() == doc_counts[0].tolist()
+
+    def test_get_ent_doc_counts_levels_without_types(self):
+        level_counts = []
+
+        emo.get_ent_doc_counts(self.preds, self.gold, {},
+                               hierarchy=self.ent_hierarchy,
+                               level_counts=level_counts)
+
+        assert level_counts[0][0].tolist() == self.ent_level_counts
+
+    def test_get_rel_level_doc_counts(self):
+
+        level_counts = emo.get_rel_level_doc_counts(self.preds, self.gold,
+                                                    self.rel_hierarchy,
+                                                    ['interacts'])
+
+        assert level_counts[0].tolist() == self.rel_level_counts
+
+
 class TestGetDocEntCountsWithoutTypes:
     maxDiff = None
 
@@ -182,6 +441,18 @@ class TestGetDocEntCountsWithoutTypes:
 
         assert counts == self.doc1_perf_dict
 
+    def test_get_doc_ent_counts_doc1_capitalization_unchanged(self):
+        counts, mismatch_rows = emo.get_doc_ent_counts(
+            self.doc1_pred_capitalization_mismatches, self.doc1_gold, {
+                'tp': 0,
+                'fp': 0,
+                'fn': 0
+            }, self.mismatch_rows_col_input)
+
+        assert self.doc1_pred_capitalization_mismatches['predicted_ner'][0][
+            0][2] == 'hellO'
+        assert self.doc1_gold['ner'][0][0][2] == 'ENTITY'
+
     def test_get_doc_ent_counts_doc1_perf_mismatch_rows(self):
         counts, mismatch_rows = emo.get_doc_ent_counts(
             self.doc1_pred_perf, self.doc1_gold, {
@@ -507,6 +778,12 @@ class TestCheckRelMatchesWithoutTypes:
         ]
         self.pred_is_gold_result = True
 
+        # Spans that are substrings of gold spans aren't matches
+        self.substr_pred = [1, 2, 5, 6, "hello-world"]
+        self.substr_gold = [[11, 2, 5, 6, "hello-world"],
+                            [1, 2, 15, 16, "hello-world"]]
+        self.substr_result = False
+
     def test_check_rel_matches_no_matches(self):
         result = emo.check_rel_matches(self.inc_pred, self.inc_gold)
 
@@ -527,6 +804,20 @@ class TestCheckRelMatchesWithoutTypes:
 
         assert result == self.pred_is_gold_result
 
+    def test_check_rel_matches_substring_spans(self):
+        result = emo.check_rel_matches(self.substr_pred, self.substr_gold)
+
+        assert result == self.substr_result
+
+    def test_check_rel_matches_sym_type_compared(self):
+        # Symmetric types are compared even when types aren't checked
+        sym_pred = [5, 6, 1, 3, "hello-world"]
+
+        assert not emo.check_rel_matches(sym_pred, self.corr_out_gold,
+                                         sym_rels=["hello-world"])
+        assert emo.check_rel_matches(sym_pred, self.corr_out_gold,
+                                     sym_rels=["goodbye-world"])
+
 
 class TestCheckRelMatchesWithTypes:
     def setup_method(self):
@@ -1655,3 +1946,155 @@ class TestGetF1InputWithTypes:
             sym_rels=self.incorr_types_both_syms_sym_rels)
 
         assert matched == self.imperf_matched_num_rel
+
+
+class TestMain:
+    def setup_method(self):
+        self.gold = [{
+            'doc_key': 'doc1',
+            'sentences': [['a', 'b', 'c'], ['d', 'e']],
+            'ner': [[[0, 0, 'X'], [1, 2, 'Y']], [[3, 4, 'X']]],
+            'relations': [[[0, 0, 1, 2, 'r']], []]
+        }, {
+            'doc_key': 'doc2',
+            'sentences': [['f', 'g']],
+            'ner': [[[0, 0, 'X'], [1, 1, 'Y']]],
+            'relations': [[[1, 1, 0, 0, 'r']]]
+        }, {
+            'doc_key': 'doc3',
+            'sentences': [['h']],
+            'ner': [[[0, 0, 'Y']]],
+            'relations': [[]]
+        }]
+        self.preds = {
+            'model1.jsonl': [{
+                'doc_key': 'doc1',
+                'sentences': [['a', 'b', 'c'], ['d', 'e']],
+                'predicted_ner': [[[0, 0, 'X', 1.0, 0.9],
+                                   [1, 2, 'X', 0.5, 0.6]],
+                                  [[3, 4, 'X', 0.2, 0.4]]],
+                'predicted_relations': [[[0, 0, 1, 2, 'r', 0.3, 0.7]], []]
+            }, {
+                'doc_key': 'doc2',
+                'sentences': [['f', 'g']],
+                'predicted_ner': [[[1, 1, 'Y', 0.1, 0.5]]],
+                'predicted_relations': [[[0, 0, 1, 1, 'r', 0.1, 0.2]]]
+            }, {
+                'doc_key': 'doc3',
+                'sentences': [['h']],
+                'predicted_ner': [[[0, 0, 'X', 0.4, 0.3]]],
+                'predicted_relations': [[]]
+            }],
+            'model2.jsonl': [{
+                'doc_key': 'doc1',
+                'sentences': [['a', 'b', 'c'], ['d', 'e']],
+                'predicted_ner': [[[1, 2, 'Y', 0.5, 0.6]], []],
+                'predicted_relations': [[], []]
+            }]
+        }
+
+    def write_files(self, tmp_path):
+        gold_file = str(tmp_path / 'gold.jsonl')
+        with jsonlines.open(gold_file, 'w') as writer:
+            writer.write_all(self.gold)
+        pred_files = []
+        for name, preds in self.preds.items():
+            pred_files.append(str(tmp_path / name))
+            with jsonlines.open(pred_files[-1], 'w') as writer:
+                writer.write_all(preds)
+        return gold_file, pred_files
+
+    def run_main(self, tmp_path, out_name, monkeypatch, **kwargs):
+        monkeypatch.setattr(emo, 'verboseprint', lambda *a, **k: None,
+                            raising=False)
+        gold_file, pred_files = self.write_files(tmp_path)
+        out_name = str(tmp_path / out_name)
+        main_kwargs = {
+            'check_types': True,
+            'bootstrap': False,
+            'num_boot': 10,
+            'save_mismatches': True,
+            'map_types': False,
+            'entity_map': '',
+            'relation_map': '',
+            'sym_rels': None
+        }
+        main_kwargs.update(kwargs)
+        emo.main(gold_file, out_name, pred_files, **main_kwargs)
+        return out_name
+
+    def test_main_workers(self, tmp_path, monkeypatch):
+
+        serial = self.run_main(tmp_path, 'serial.csv', monkeypatch)
+        pooled = self.run_main(tmp_path, 'pooled.csv', monkeypatch,
+                               workers=2)
+
+        for suffix in ['.csv', '_MISMATCHES.csv']:
+            serial_df = pd.read_csv(serial.replace('.csv', suffix))
+            pooled_df = pd.read_csv(pooled.replace('.csv', suffix))
+            assert len(serial_df) > 0
+            pd.testing.assert_frame_equal(serial_df, pooled_df)
+
+    def test_stream_matches_whole_file(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(emo, 'verboseprint', lambda *a, **k: None,
+                            raising=False)
+        gold_file, pred_files = self.write_files(tmp_path)
+        gold_std_dict = emo.load_gold_standard(gold_file)
+
+        runs = []
+        for stream_batch in [None, 2]:
+            ent_counts, rel_counts, _, doc_keys = emo.get_pred_file_counts(
+                pred_files[0], gold_std_dict, {}, stream_batch=stream_batch)
+            order = np.argsort(doc_keys)
+            runs.append((ent_counts[order], rel_counts[order]))
+
+        for whole, streamed in zip(*runs):
+            assert np.array_equal(whole, streamed)
+            whole_CIs = emo.calculate_CI(*emo.boot_samples_from_counts(
+                whole, 50, np.random.default_rng(0)))
+            streamed_CIs = emo.calculate_CI(*emo.boot_samples_from_counts(
+                streamed, 50, np.random.default_rng(0)))
+            assert whole_CIs == streamed_CIs
+
+    def test_stream_empty_prediction_file(self, tmp_path, monkeypatch):
+        self.preds = {'empty.jsonl': []}
+
+        out_name = self.run_main(tmp_path, 'empty.csv', monkeypatch,
+                                 stream_batch=2, sweep_thresholds=True)
+
+        assert len(pd.read_csv(out_name)) == 1
+        assert len(pd.read_csv(out_name.replace('.csv',
+                                                '_PR_CURVE.csv'))) == 0
+
+    def test_map_sets_match_map_types(self, tmp_path, monkeypatch):
+        maps = {
+            'drop_y': ({'X': 'X', 'Y': ''}, {'r': 'r'}),
+            'all_y': ({'X': 'Y', 'Y': 'Y'}, {'r': ''})
+        }
+        map_sets = {}
+        for name, (entity_map, relation_map) in maps.items():
+            map_sets[name] = {}
+            for key, type_map in [('entity_map', entity_map),
+                                  ('relation_map', relation_map)]:
+                map_sets[name][key] = str(tmp_path / f'{name}_{key}.json')
+                with open(map_sets[name][key], 'w') as myf:
+                    json.dump(type_map, myf)
+
+        set_name = self.run_main(tmp_path, 'sets.csv', monkeypatch,
+                                 map_sets=map_sets)
+        set_df = pd.read_csv(set_name)
+        set_mismatch_df = pd.read_csv(
+            set_name.replace('.csv', '_MISMATCHES.csv'))
+
+        for name, map_set in map_sets.items():
+            map_name = self.run_main(tmp_path, f'{name}.csv', monkeypatch,
+                                     map_types=True, **map_set)
+            map_df = pd.read_csv(map_name)
+            map_mismatch_df = pd.read_csv(
+                map_name.replace('.csv', '_MISMATCHES.csv'))
+            for sets, single in [(set_df, map_df),
+                                 (set_mismatch_df, map_mismatch_df)]:
+                sets = sets[sets.map_name == name].drop(columns='map_name')
+                assert len(single) > 0
+                pd.testing.assert_frame_equal(sets.reset_index(drop=True),
+                                              single, check_dtype=False)
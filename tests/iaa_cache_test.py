@@ -0,0 +1,90 @@
+"""
+Spot checks for iaa_cache.py
+
+Author: Serena G. Lotreck
+"""
+import sys
+
+sys.path.append('../annotation/iaa')
+
+import iaa_cache as ic
+
+
+class TestIAACache:
+    def test_save_and_load(self, tmp_path):
+
+        path = str(tmp_path / 'cache.json')
+        cache = ic.IAACache(path)
+        key = cache.make_key({'tolerance': 'STRICT'}, ['abc', 'def'])
+        assert cache.get(key) is None
+        cache.set(key, {'interacts': [1, 2, 3]})
+        cache.save()
+
+        reloaded = ic.IAACache(path)
+
+        assert reloaded.get(key) == {'interacts': [1, 2, 3]}
+
+    def test_save_drops_unused(self, tmp_path):
+
+        path = str(tmp_path / 'cache.json')
+        cache = ic.IAACache(path)
+        old_key = cache.make_key({}, ['old'])
+        kept_key = cache.make_key({}, ['kept'])
+        cache.set(old_key, 1)
+        cache.set(kept_key, 2)
+        cache.save()
+
+        rerun = ic.IAACache(path)
+        assert rerun.get(kept_key) == 2
+        new_key = rerun.make_key({}, ['new'])
+        rerun.set(new_key, 3)
+        rerun.save()
+
+        reloaded = ic.IAACache(path)
+
+        assert reloaded.entries == {kept_key: 2, new_key: 3}
+
+    def test_make_key(self):
+
+        key = ic.IAACache.make_key({'tolerance': 'STRICT'}, ['abc', 'def'])
+
+        assert key == ic.IAACache.make_key({'tolerance': 'STRICT'},
+                                           ['abc', 'def'])
+        assert key != ic.IAACache.make_key({'tolerance': 'LOOSE'},
+                                           ['abc', 'def'])
+        assert key != ic.IAACache.make_key({'tolerance': 'STRICT'},
+                                           ['def', 'abc'])
+
+
+class TestAtomicWrite:
+    def test_atomic_write_error(self, tmp_path):
+
+        path = str(tmp_path / 'out.txt')
+        with open(path, 'w') as myf:
+            myf.write('before')
+
+        try:
+            with ic.atomic_write(path) as myf:
+                myf.write('partial')
+                raise ValueError
+        except ValueError:
+            pass
+
+        with open(path) as myf:
+            assert myf.read() == 'before'
+        assert list(tmp_path.iterdir()) == [tmp_path / 'out.txt']
+
+
+class TestGetSnapshot:
+    def test_get_snapshot(self, tmp_path):
+
+        (tmp_path / 'ann1').mkdir()
+        (tmp_path / 'ann1' / 'doc1.ann').write_text('T1\tPROT 0 5\tPROT1\n')
+        (tmp_path / 'ann1' / 'notes.md').write_text('not an annotation')
+
+        before = ic.get_snapshot(str(tmp_path))
+        (tmp_path / 'ann1' / 'doc1.ann').write_text('')
+        after = ic.get_snapshot(str(tmp_path))
+
+        assert list(before) == [str(tmp_path / 'ann1' / 'doc1.ann')]
+        assert before != after
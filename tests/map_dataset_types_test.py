@@ -7,6 +7,7 @@ Author: Serena G. Lotreck
 """
 import pytest
 import sys
+from copy import deepcopy
 
 sys.path.append('../annotation/abstract_scripts')
 import map_dataset_types as mdt
@@ -197,3 +198,40 @@ def test_needs_entity_and_rel_drops(entity_map, relation_map,
     assert dygiepp_needs_entity_and_rel_drops == dygiepp_needs_entity_and_rel_drops_result
     assert de == 2
     assert dr == 4
+
+
+def test_dropped_spans_stay_in_their_doc(entity_map, relation_map):
+
+    docs = [{
+        "doc_key": "doc1",
+        "sentences": [["a", "b"]],
+        "ner": [[[0, 0, "UNDEFINED"], [1, 1, "GENE"]]],
+        "relations": [[]]
+    }, {
+        "doc_key": "doc2",
+        "sentences": [["a", "b"]],
+        "ner": [[[0, 0, "CHEMICAL"], [1, 1, "GENE"]]],
+        "relations": [[[0, 0, 1, 1, "SUBSTRATE"]]]
+    }]
+
+    de, dr = mdt.map_jsonl(docs, entity_map, relation_map, predicted=False)
+
+    assert docs[1]["relations"] == [[[0, 0, 1, 1, "interacts"]]]
+    assert de == 1
+    assert dr == 0
+
+
+def test_map_jsonl_view(entity_map, relation_map,
+                        dygiepp_needs_entity_and_rel_drops,
+                        dygiepp_needs_entity_and_rel_drops_result):
+
+    original = deepcopy(dygiepp_needs_entity_and_rel_drops)
+    mapped, de, dr = mdt.map_jsonl_view(dygiepp_needs_entity_and_rel_drops,
+                                        entity_map,
+                                        relation_map,
+                                        predicted=False)
+
+    assert mapped == dygiepp_needs_entity_and_rel_drops_result
+    assert dygiepp_needs_entity_and_rel_drops == original
+    assert de == 2
+    assert dr == 4
@@ -10,54 +10,11 @@ import sys
 
 sys.path.append('../annotation/iaa')
 
+import numpy as np
 import pandas as pd
 from pandas.testing import assert_frame_equal
 import relationIAA as riaa
-
-
-class TestGetOffsets:
-    def setup_method(self):
-
-        self.one_offset = '24 29\tPROT1\n'
-        self.multiple_offsets = '24 29;42 44;79 82\tPROT1\n'
-
-        self.right_answer_single = [('24', '29')]
-        self.right_answer_multiple = [('24', '29'), ('42', '44'), ('79', '82')]
-
-    def test_get_offstes_single(self):
-
-        offsets = riaa.get_offsets(self.one_offset, [])
-
-        assert offsets == self.right_answer_single
-
-    def test_get_offsets_multiple(self):
-
-        offsets = riaa.get_offsets(self.multiple_offsets, [])
-
-        assert offsets == self.right_answer_multiple
-
-
-class TestFormatRelation:
-    def setup_method(self):
-
-        self.rel = '\tinteracts-indirect Arg1:T1 Arg2:T4\n'
-
-        self.line_dict = {
-            'T1': '\tPROTEIN 24 29\tPROT1\n',
-            'T4': '\tDNA 42 44\tPRO1\n',
-            'R1': '\tinteracts-indirect Arg1:T1 Arg2:T4\n'
-        }
-
-        self.right_answer = [
-            'interacts-indirect', ([('24', '29')], 'PROTEIN'),
-            ([('42', '44')], 'DNA')
-        ]
-
-    def test_format_relation(self):
-
-        rel = riaa.format_relation(self.rel, self.line_dict)
-
-        assert rel == self.right_answer
+import type_hierarchy as th
 
 
 class TestMakeAnnDF:
@@ -94,6 +51,21 @@ R2\tinteracts-direct Arg1:T4 Arg2:T5"""
 
         self.ann_empty_df = pd.DataFrame([], columns=['Type', 'Arg1', 'Arg2'])
 
+        # Every fragment of a discontinuous argument is kept, in order
+        ann_discont = ('T1\tPROTEIN 24 29;42 44;79 82\tPROT1 PR O1\n'
+                       'T4\tDNA 42 44\tPRO1\n'
+                       'R1\tinteracts-indirect Arg1:T1 Arg2:T4\n')
+
+        self.ann_discont_path = f'{self.tmpdir}/ann_discont.ann'
+        with open(self.ann_discont_path, 'w') as myf:
+            myf.write(ann_discont)
+
+        self.ann_discont_df = pd.DataFrame({
+            'Type': ['interacts-indirect'],
+            'Arg1': [([('24', '29'), ('42', '44'), ('79', '82')], 'PROTEIN')],
+            'Arg2': [([('42', '44')], 'DNA')]
+        })
+
     def teardown_method(self):
 
         shutil.rmtree(self.tmpdir)
@@ -109,3 +81,306 @@ R2\tinteracts-direct Arg1:T4 Arg2:T5"""
         ann_df = riaa.make_ann_df(self.ann_empty_path)
 
         assert_frame_equal(ann_df, self.ann_empty_df)
+
+    def test_make_ann_df_discontinuous(self):
+
+        ann_df = riaa.make_ann_df(self.ann_discont_path)
+
+        assert_frame_equal(ann_df, self.ann_discont_df)
+
+
+class TestAgreementTables:
+    def setup_method(self):
+
+        self.ann_df1 = pd.DataFrame(
+            [['interacts', ([('0', '5')], 'PROTEIN'), ([('10', '15')], 'DNA')],
+             ['activates', ([('20', '25')], 'PROTEIN'),
+              ([('30', '35'), ('50', '55')], 'DNA')],
+             ['inhibits', ([('60', '65')], 'PROTEIN'),
+              ([('70', '75')], 'DNA')]],
+            columns=['Type', 'Arg1', 'Arg2'])
+
+        # First is reversed, second only overlaps on the discontinuous span,
+        # third has a different type
+        self.ann_df2 = pd.DataFrame(
+            [['interacts', ([('12', '13')], 'DNA'), ([('3', '4')], 'PROTEIN')],
+             ['activates', ([('22', '23')], 'PROTEIN'),
+              ([('55', '58')], 'DNA')],
+             ['activates', ([('60', '65')], 'PROTEIN'),
+              ([('70', '75')], 'DNA')]],
+            columns=['Type', 'Arg1', 'Arg2'])
+
+        self.symm_rels = ['interacts']
+
+    def test_get_compatible_pairs(self):
+
+        pairs = riaa.get_compatible_pairs(list(self.ann_df1.itertuples()),
+                                          list(self.ann_df2.itertuples()))
+
+        assert pairs == [(1, 1), (2, 2)]
+
+    def test_get_compatible_pairs_symm(self):
+
+        pairs = riaa.get_compatible_pairs(list(self.ann_df1.itertuples()),
+                                          list(self.ann_df2.itertuples()),
+                                          symm=True)
+
+        assert pairs == [(0, 0), (1, 1), (2, 2)]
+
+    def test_get_strict_agreement_table(self):
+
+        a, b, c = riaa.get_strict_agreement_table(self.ann_df1, self.ann_df2,
+                                                  self.symm_rels)
+
+        assert (a, b, c) == (2, 1, 1)
+
+    def test_get_loose_agreement_table(self):
+
+        a, b, c = riaa.get_loose_agreement_table(self.ann_df1, self.ann_df2)
+
+        assert (a, b, c) == (3, 0, 0)
+
+    def test_get_type_agreement_table_strict(self):
+
+        type_counts = riaa.get_type_agreement_table(self.ann_df1,
+                                                    self.ann_df2,
+                                                    self.symm_rels)
+
+        assert type_counts == {
+            'interacts': [1, 1, 1, 1],
+            'activates': [1, 1, 1, 2],
+            'inhibits': [0, 0, 1, 0]
+        }
+        assert riaa.get_type_f1(type_counts) == riaa.calculate_f1(2, 1, 1)
+
+    def test_get_type_agreement_table_loose(self):
+
+        type_counts = riaa.get_type_agreement_table(self.ann_df1,
+                                                    self.ann_df2,
+                                                    self.symm_rels,
+                                                    tolerance='LOOSE')
+
+        # The inhibits/activates match is credited to both types
+        assert type_counts == {
+            'interacts': [1, 1, 1, 1],
+            'activates': [1, 2, 1, 2],
+            'inhibits': [1, 0, 1, 0]
+        }
+        assert riaa.get_type_f1(type_counts) == riaa.calculate_f1(3, 0, 0)
+
+    def test_get_level_agreement_table(self):
+        hierarchy = th.parse_annotation_conf(
+            '[relations]\n!causal\n\tactivates\n\tinhibits\n'
+            '\tinteracts\n')['relations']
+
+        level_counts = riaa.get_level_agreement_table(self.ann_df1,
+                                                      self.ann_df2,
+                                                      self.symm_rels,
+                                                      hierarchy)
+
+        assert level_counts['leaf'] == riaa.get_type_agreement_table(
+            self.ann_df1, self.ann_df2, self.symm_rels)
+        assert level_counts['parent'] == {'causal': [3, 3, 3, 3]}
+        assert level_counts['root'] == {'causal': [3, 3, 3, 3]}
+
+
+class TestGetTypeStats:
+    def setup_method(self):
+
+        self.pair_type_counts = {
+            ('ann1', 'ann2'): {
+                'doc1.ann': {
+                    'interacts': [1, 1, 2, 1],
+                    'activates': [0, 0, 1, 0]
+                },
+                'doc2.ann': {
+                    'interacts': [1, 1, 1, 1]
+                }
+            },
+            ('ann1', 'ann3'): {
+                'doc1.ann': {
+                    'activates': [1, 1, 1, 2]
+                }
+            }
+        }
+
+    def test_get_type_stats(self, tmp_path):
+
+        type_df = riaa.get_type_stats(self.pair_type_counts,
+                                      str(tmp_path),
+                                      'test',
+                                      num_boot=0)
+
+        assert type_df['rel_type'].tolist() == [
+            'interacts', 'activates', 'overall'
+        ]
+        assert type_df['a'].tolist() == [2, 1, 3]
+        assert type_df['b'].tolist() == [1, 1, 2]
+        assert type_df['c'].tolist() == [0, 1, 1]
+        assert type_df['F1'].tolist() == [4 / 5, 2 / 4, 6 / 9]
+        assert os.path.exists(tmp_path / 'test_per_type.csv')
+
+    def test_get_type_stats_boot(self, tmp_path):
+
+        type_df = riaa.get_type_stats(self.pair_type_counts,
+                                      str(tmp_path),
+                                      'test',
+                                      num_boot=200,
+                                      rng=np.random.default_rng(0))
+
+        assert (type_df['F1_CI_low'] <= type_df['F1']).all()
+        assert (type_df['F1'] <= type_df['F1_CI_high']).all()
+        # interacts has full agreement on doc2 and 2/3 on doc1
+        assert type_df.loc[0, 'F1_CI_low'] == 2 / 3
+        assert type_df.loc[0, 'F1_CI_high'] == 1
+
+
+class TestAlignment:
+    def setup_method(self):
+
+        # Relation 0 from annotator 1 overlaps both of annotator 2's
+        self.pairs = [(0, 0), (0, 1), (1, 0)]
+        self.ann_df1 = pd.DataFrame(
+            [['interacts', ([('0', '5')], 'PROTEIN'), ([('10', '15')], 'DNA')]],
+            columns=['Type', 'Arg1', 'Arg2'])
+        self.ann_df2 = pd.DataFrame(
+            [['interacts', ([('0', '2')], 'PROTEIN'), ([('10', '12')], 'DNA')],
+             ['interacts', ([('3', '5')], 'PROTEIN'), ([('13', '15')], 'DNA')]],
+            columns=['Type', 'Arg1', 'Arg2'])
+
+    def test_align_pairs_greedy(self):
+
+        aligned = riaa.align_pairs(self.pairs, 'greedy')
+
+        assert aligned == [(0, 0)]
+
+    def test_align_pairs_optimal(self):
+
+        aligned = riaa.align_pairs(self.pairs, 'optimal')
+
+        assert aligned == [(0, 1), (1, 0)]
+
+    def test_agreement_table_all(self):
+
+        a, b, c = riaa.get_loose_agreement_table(self.ann_df1, self.ann_df2)
+
+        assert (a, b, c) == (2, -1, 0)
+
+    def test_agreement_table_optimal(self):
+
+        a, b, c = riaa.get_loose_agreement_table(self.ann_df1, self.ann_df2,
+                                                 'optimal')
+
+        assert (a, b, c) == (1, 0, 1)
+
+
+class TestGetPairIAAs:
+    def setup_method(self):
+
+        self.ann_strs = {
+            'ann1': {
+                'doc1.ann': ('T1\tPROTEIN 0 5\tPROT1\nT2\tDNA 10 15\tDNA1\n'
+                             'R1\tinteracts Arg1:T1 Arg2:T2\n'),
+                'doc2.ann': ('T1\tPROTEIN 0 5\tPROT1\nT2\tDNA 10 15\tDNA1\n'
+                             'R1\tinteracts Arg1:T1 Arg2:T2\n')
+            },
+            'ann2': {
+                'doc1.ann': ('T1\tPROTEIN 0 5\tPROT1\nT2\tDNA 10 15\tDNA1\n'
+                             'R1\tactivates Arg1:T1 Arg2:T2\n'),
+                'doc2.ann': ('T1\tPROTEIN 0 5\tPROT1\nT2\tDNA 10 15\tDNA1\n'
+                             'R1\tinteracts Arg1:T2 Arg2:T1\n')
+            },
+            'ann3': {
+                'doc1.ann': ('T1\tPROTEIN 0 5\tPROT1\nT2\tDNA 10 15\tDNA1\n'
+                             'R1\tinteracts Arg1:T1 Arg2:T2\n')
+            }
+        }
+
+    def make_project(self, root):
+
+        annotator_paths = []
+        for annotator, docs in self.ann_strs.items():
+            iaa_dir = root / annotator / 'iaa'
+            iaa_dir.mkdir(parents=True)
+            for name, ann_str in docs.items():
+                (iaa_dir / name).write_text(ann_str)
+            annotator_paths.append(str(root / annotator))
+
+        return annotator_paths
+
+    def test_get_pair_iaas(self, tmp_path):
+
+        ann1, ann2, ann3 = self.make_project(tmp_path)
+
+        iaas = riaa.get_pair_iaas([ann1, ann2, ann3], 'iaa', ['interacts'],
+                                  'STRICT')
+
+        assert iaas == {
+            (ann1, ann2): {
+                'doc1.ann': [0],
+                'doc2.ann': [1]
+            },
+            (ann1, ann3): {
+                'doc1.ann': [1]
+            },
+            (ann2, ann3): {
+                'doc1.ann': [0]
+            }
+        }
+
+    def test_get_pair_iaas_workers(self, tmp_path):
+
+        annotator_paths = self.make_project(tmp_path)
+
+        serial = riaa.get_pair_iaas(annotator_paths, 'iaa', ['interacts'],
+                                    'STRICT')
+        parallel = riaa.get_pair_iaas(annotator_paths,
+                                      'iaa', ['interacts'],
+                                      'STRICT',
+                                      workers=2)
+
+        assert parallel == serial
+
+    def test_get_pair_iaas_cache(self, tmp_path):
+
+        ann1, ann2, ann3 = self.make_project(tmp_path / 'project')
+        cache = riaa.IAACache(str(tmp_path / 'cache.json'))
+        riaa.get_pair_iaas([ann1, ann2, ann3], 'iaa', ['interacts'],
+                           'STRICT',
+                           iaa_cache=cache)
+
+        # Only the two comparisons with annotator 3 are redone
+        (tmp_path / 'project' / 'ann3' / 'iaa' / 'doc1.ann').write_text(
+            'T1\tPROTEIN 0 5\tPROT1\nT2\tDNA 10 15\tDNA1\n'
+            'R1\tinhibits Arg1:T1 Arg2:T2\n')
+        cache.hits, cache.misses = 0, 0
+        iaas = riaa.get_pair_iaas([ann1, ann2, ann3], 'iaa', ['interacts'],
+                                  'STRICT',
+                                  iaa_cache=cache)
+
+        assert (cache.hits, cache.misses) == (2, 2)
+        assert iaas == riaa.get_pair_iaas([ann1, ann2, ann3], 'iaa',
+                                          ['interacts'], 'STRICT')
+
+    def test_get_pair_type_counts_levels(self, tmp_path):
+
+        annotator_paths = self.make_project(tmp_path)
+        hierarchy = th.parse_annotation_conf(
+            '[relations]\n!causal\n\tactivates\n\tinteracts\n'
+            '!static\n\tinhibits\n')['relations']
+
+        level_counts = riaa.get_pair_type_counts(annotator_paths, 'iaa',
+                                                 ['interacts'], 'STRICT',
+                                                 hierarchy=hierarchy)
+
+        assert riaa.select_level(level_counts,
+                                 'leaf') == riaa.get_pair_type_counts(
+                                     annotator_paths, 'iaa', ['interacts'],
+                                     'STRICT')
+        # interacts and activates agree as causal relations
+        assert riaa.get_iaas_from_type_counts(
+            riaa.select_level(level_counts, 'parent'))[tuple(
+                annotator_paths[:2])] == {
+                    'doc1.ann': [1],
+                    'doc2.ann': [1]
+                }
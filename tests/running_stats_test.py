@@ -0,0 +1,85 @@
+"""
+Spot checks for running_stats.py
+
+Author: Serena G. Lotreck
+"""
+import sys
+
+sys.path.append('../annotation/abstract_scripts')
+
+import numpy as np
+import running_stats as rs
+
+
+class TestRunningStats:
+    def setup_method(self):
+        self.values = [4, 8, 15, 16, 23, 42]
+
+    def test_summary(self):
+
+        stats = rs.RunningStats.from_values(self.values)
+
+        assert np.allclose(stats.summary(), [
+            sum(self.values),
+            np.mean(self.values),
+            np.std(self.values),
+            np.median(self.values),
+            max(self.values),
+            min(self.values)
+        ])
+
+    def test_merge(self):
+
+        stats = rs.RunningStats.from_values(self.values[:2])
+        stats.merge(rs.RunningStats.from_values(self.values[2:]))
+
+        assert np.allclose(
+            stats.summary(),
+            rs.RunningStats.from_values(self.values).summary())
+
+    def test_empty(self):
+
+        summary = rs.RunningStats().summary()
+
+        assert summary[0] == 0
+        assert np.isnan(summary[1:]).all()
+
+
+class TestQuantileSketch:
+
+    def test_quantile_exact(self):
+        sketch = rs.QuantileSketch()
+        for value in [3, 1, 2, 2, 10]:
+            sketch.add(value)
+
+        assert sketch.quantile(0.5) == 2
+        assert sketch.quantile(0.25) == np.quantile([3, 1, 2, 2, 10], 0.25)
+
+    def test_quantile_approximate(self):
+        values = np.random.default_rng(0).lognormal(8, 2, 1001)
+        sketch = rs.QuantileSketch(rel_acc=0.01)
+        for value in values:
+            sketch.add(value)
+
+        assert abs(sketch.quantile(0.5) / np.median(values) - 1) <= 0.01
+
+
+class TestHistogram:
+
+    def test_update_grows(self):
+        histogram = rs.Histogram()
+        histogram.update([1, 1, 3])
+        histogram.add(40, 2)
+
+        assert histogram.items() == [(1, 2), (3, 1), (40, 2)]
+
+    def test_label_counts_merge(self):
+        counts = rs.LabelCounts()
+        counts.add('b')
+        counts.add('a', 0)
+        other = rs.LabelCounts()
+        other.add('a', 2)
+        other.add('b')
+        counts.merge(other)
+
+        assert counts.items() == [('b', 2), ('a', 2)]
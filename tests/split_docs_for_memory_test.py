@@ -0,0 +1,82 @@
+"""
+Spot checks for split_docs_for_memory.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+sys.path.append('../annotation/abstract_scripts')
+import split_docs_for_memory as sdm
+
+
+@pytest.fixture
+def doc():
+    return {"doc_key": "doc1",
+    "dataset": "seedev",
+    "sentences": [["a", "b", "c"], ["d", "e"], ["f", "g", "h"], ["i"]],
+    "ner": [[[0, 0, "X"], [1, 2, "Y"]], [[3, 4, "X"]], [[5, 5, "Y"]],
+        [[8, 8, "X"]]],
+    "relations": [[], [[3, 4, 5, 5, "r"]], [], [[8, 8, 8, 8, "r"]]]}
+
+
+def test_get_span_counts():
+
+    span_counts = sdm.get_span_counts([3, 10], max_span_width=2)
+
+    assert span_counts.tolist() == [5, 19]
+
+
+def test_get_sentence_blocks(doc):
+
+    # The relation in sentence 1 goes into sentence 2
+    assert sdm.get_sentence_blocks(doc) == [1, 3, 4]
+
+
+def test_chunk_doc_keeps_relations(doc):
+
+    chunks, offsets = sdm.chunk_doc(doc, max_tokens=4)
+
+    assert [chunk["sentences"] for chunk in chunks] == [
+        [["a", "b", "c"]], [["d", "e"], ["f", "g", "h"]], [["i"]]
+    ]
+    assert chunks[1]["relations"] == [[[0, 1, 2, 2, "r"]], []]
+    assert chunks[2]["ner"] == [[[0, 0, "X"]]]
+    assert [offset["token_offset"] for offset in offsets] == [0, 3, 8]
+    assert chunks[1]["doc_key"] == "doc1_split_2"
+
+
+def test_chunk_doc_fits(doc):
+
+    chunks, offsets = sdm.chunk_doc(doc, max_tokens=9)
+
+    assert chunks == [doc]
+    assert offsets[0]["doc_key"] == "doc1"
+
+
+def test_reassemble_docs(doc):
+    chunks, offset_map = sdm.chunk_docs([doc], max_spans=6)
+    for chunk in chunks:
+        chunk["predicted_ner"] = [[ent + [0.5, 0.9] for ent in sent]
+                                  for sent in chunk["ner"]]
+
+    reassembled = sdm.reassemble_docs(chunks[::-1], offset_map)
+
+    assert len(reassembled) == 1
+    assert reassembled[0]["doc_key"] == "doc1"
+    assert reassembled[0]["sentences"] == doc["sentences"]
+    assert reassembled[0]["relations"] == doc["relations"]
+    assert reassembled[0]["predicted_ner"][3] == [[8, 8, "X", 0.5, 0.9]]
+
+
+def test_reassemble_docs_uneven(doc):
+    chunks, offset_map = sdm.chunk_docs([doc], max_spans=6)
+    # Only the middle chunk has predictions
+    chunks[1]["predicted_ner"] = [[ent + [0.5, 0.9] for ent in sent]
+                                  for sent in chunks[1]["ner"]]
+
+    reassembled = sdm.reassemble_docs(chunks, offset_map)
+
+    assert reassembled[0]["predicted_ner"] == [
+        [], [[3, 4, "X", 0.5, 0.9]], [[5, 5, "Y", 0.5, 0.9]], []
+    ]
+    assert "predicted_relations" not in reassembled[0]
@@ -0,0 +1,73 @@
+"""
+Spot checks for type_hierarchy.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+
+sys.path.append('../annotation/abstract_scripts')
+import type_hierarchy as th
+
+
+@pytest.fixture
+def conf():
+    return ('[entities]\n'
+            '!Chemical\n'
+            '\t!Compound\n'
+            '\t\tProtein\n'
+            '\t\tDNA\n'
+            '\n'
+            '\tElement\n'
+            '\n'
+            'Organism\n'
+            '\n'
+            '[relations]\n'
+            '!causal\tArg1:<ENTITY>, Arg2:<ENTITY>\n'
+            '\tactivates\tArg1:<ENTITY>, Arg2:<ENTITY>\n'
+            '<OVERLAP>\t\tArg1:<ENTITY>, Arg2:<ENTITY>, <OVL-TYPE>:<ANY>\n'
+            '\n'
+            '[events]\n')
+
+
+def test_parse_annotation_conf_sections(conf):
+
+    hierarchies = th.parse_annotation_conf(conf)
+
+    assert hierarchies['entities'].names == [
+        'Chemical', 'Compound', 'Protein', 'DNA', 'Element', 'Organism'
+    ]
+    assert hierarchies['relations'].names == ['causal', 'activates']
+    assert hierarchies['events'].names == []
+
+
+def test_ancestors(conf):
+
+    ents = th.parse_annotation_conf(conf)['entities']
+
+    # Blank lines don't end a group, indentation does
+    assert ents.parents.tolist() == [-1, 0, 1, 1, 0, -1]
+    assert ents.ancestors.tolist() == [[0, 0, 0], [1, 0, 0], [2, 1, 0],
+                                       [3, 1, 0], [4, 0, 0], [5, 5, 5]]
+
+
+def test_get_level_names(conf):
+
+    ents = th.parse_annotation_conf(conf)['entities']
+
+    level_names = ents.get_level_names(['Protein', 'Element', 'Virus'])
+
+    assert level_names == {
+        'leaf': ['Protein', 'Element', 'Virus'],
+        'parent': ['Compound', 'Chemical', 'Virus'],
+        'root': ['Chemical', 'Chemical', 'Virus']
+    }
+
+
+def test_get_level_ids_unknown(conf):
+
+    ents = th.parse_annotation_conf(conf)['entities'].lowercase()
+
+    level_ids = ents.get_level_ids(['virus', 'dna', 'virus', 'Protein'])
+
+    assert level_ids.tolist() == [[6, 3, 6, 7], [6, 1, 6, 7], [6, 0, 6, 7]]
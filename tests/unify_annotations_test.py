@@ -9,8 +9,10 @@ import shutil
 import sys
 
 sys.path.append('../annotation/iaa/')
+sys.path.append('../annotation/abstract_scripts')
 
 import unify_annotations as ua
+import brat_parser as bp
 
 
 class TestUnifyAnnotations:
@@ -113,4 +115,58 @@ T20\tENTITY 411 419\tclone 51
 
     def test_unify_annotations_rels(self):
 
-        pass
+        # Same relation between the same entities, with different IDs
+        with open(self.ann2, 'a') as myf:
+            myf.write('T11\tENTITY 22 24\tET\n'
+                      'T12\tENTITY 67 72\taspen\n'
+                      'R1\tPART-OF Arg1:T11 Arg2:T12\n'
+                      'R2\tPART-OF Arg1:T9 Arg2:T12\n')
+
+        ua.main(self.tmpdir, self.iaa_dir_name, "rel", self.tmpdir)
+
+        with open(f'{self.tmpdir}/last_ten_unified/txt1.ann') as myf:
+            ann_file = myf.read()
+
+        rel_lines = [l for l in ann_file.split('\n') if l.startswith('R')]
+        assert rel_lines == ['R1\tPART-OF Arg1:T11 Arg2:T12',
+                             'R2\tPART-OF Arg1:T9 Arg2:T12']
+        assert ann_file.count('\tENTITY 22 24\tET\n') == 1
+        assert 'T11\tENTITY 22 24\tET\n' in ann_file
+
+    def test_unify_annotations_workers(self):
+
+        ua.main(self.tmpdir, self.iaa_dir_name, "ent", self.tmpdir,
+                workers=2)
+
+        with open(f'{self.tmpdir}/last_ten_unified/txt1.ann') as myf:
+            ann_file = myf.read()
+
+        assert ann_file == self.right_answer
+
+
+class TestUnifyDoc:
+    def setup_method(self):
+
+        self.brat_anns = [
+            bp.parse_ann('T1\tA 0 5\tabcde\nT2\tB 3 8\tdefgh\n'
+                         'T3\tA 20 25\tuvwxy\n'),
+            bp.parse_ann('T1\tBA 0 5\tabcde\nT2\tA 0 5\tabcde\n'
+                         'T3\tA 8 10\tij\n')
+        ]
+
+    def test_unify_doc(self):
+
+        records = ua.unify_doc(self.brat_anns, 'ent')
+
+        # Type A isn't mistaken for a duplicate of type BA
+        assert [bp.format_ann_line(r) for r in records] == [
+            'T1\tA 0 5\tabcde', 'T2\tB 3 8\tdefgh', 'T3\tA 20 25\tuvwxy',
+            'T4\tBA 0 5\tabcde', 'T6\tA 8 10\tij'
+        ]
+
+    def test_unify_doc_group(self):
+
+        records = ua.unify_doc(self.brat_anns, 'ent', group=True)
+
+        # A 8 10 starts where B 3 8 ends, so it's in its own group
+        assert [r.id for r in records] == ['T1', 'T2', 'T4', 'T6', 'T3']
@@ -0,0 +1,31 @@
+"""
+Spot checks for worker_pool.py
+
+Author: Serena G. Lotreck
+"""
+import pytest
+import sys
+
+sys.path.append('../annotation/abstract_scripts')
+import worker_pool as wp
+
+
+def add_offset(task):
+    return task + wp.worker_args['offset']
+
+
+def test_run_tasks_pool():
+
+    results = wp.run_tasks(add_offset, [1, 2, 3], 2, {'offset': 10})
+
+    assert results == [11, 12, 13]
+    assert wp.worker_args == {}
+
+
+def test_run_tasks_without_fork(monkeypatch):
+    monkeypatch.setattr(wp, 'can_fork', lambda: False)
+
+    with pytest.warns(UserWarning):
+        results = wp.run_tasks(add_offset, [1, 2], 2, {'offset': 10})
+
+    assert results == [11, 12]